@@ -0,0 +1,78 @@
+from downloader.transfer_stats import session_stats
+
+
+class ProgressAggregator:
+    """
+    Intermediario entre los hilos de descarga y ProgressManager. Los hilos solo
+    sustituyen la tupla de su archivo en un dict (una asignación, atómica con el
+    GIL, sin locks) y siguen descargando; el bucle de Tk dibuja cada
+    FRAME_INTERVAL_MS una foto de los slots que han cambiado desde el último
+    fotograma. Así los widgets solo se tocan desde el hilo de Tk y su coste por
+    segundo no depende de cuántos callbacks lleguen ni de su frecuencia.
+    """
+
+    FRAME_INTERVAL_MS = 100  # 10 fotogramas por segundo
+    MAX_UPDATES_PER_FRAME = 50  # Barras por archivo actualizadas como mucho en un fotograma
+
+    def __init__(self, root, progress_manager):
+        self.root = root
+        self.progress_manager = progress_manager
+        self.slots = {}  # { file_id: (descargado, total, file_path, eta) }, escrito por los hilos
+        self.rendered = {}  # { file_id: tupla ya dibujada }
+        self.global_counts = None  # (completados, total) del progreso global
+        self.rendered_global = None
+
+    def report(self, downloaded, total, file_id=None, file_path=None, speed=None, eta=None):
+        """Callback de progreso de los descargadores; se llama desde cualquier hilo."""
+        self.slots[file_id] = (downloaded, total, file_path, eta)
+
+    def report_global(self, completed_files, total_files):
+        self.global_counts = (completed_files, total_files)
+
+    def start(self):
+        self.root.after(self.FRAME_INTERVAL_MS, self.render)
+
+    def render(self):
+        try:
+            self.render_frame()
+        finally:
+            self.root.after(self.FRAME_INTERVAL_MS, self.render)
+
+    def render_frame(self):
+        # Copia en C de una sola vez: los hilos pueden seguir escribiendo mientras se dibuja
+        snapshot = self.slots.copy()
+        changed = [(file_id, value) for file_id, value in snapshot.items() if self.rendered.get(file_id) is not value]
+        # Primero los terminados, para que sus barras se retiren sin esperar
+        changed.sort(key=lambda item: not (item[1][1] and item[1][0] >= item[1][1]))
+
+        for file_id, value in changed[:self.MAX_UPDATES_PER_FRAME]:
+            downloaded, total, file_path, eta = value
+            self.progress_manager.update_progress(downloaded, total, file_id, file_path, None, eta)
+            # La contabilidad de la sesión solo necesita el último valor de cada archivo
+            session_stats.update(file_id, downloaded, total)
+            if total and downloaded >= total:
+                self.forget(file_id, value)
+            else:
+                self.rendered[file_id] = value
+
+        if changed:
+            self.progress_manager.update_transfer_stats(*session_stats.snapshot())
+
+        global_counts = self.global_counts
+        if global_counts is not None and global_counts is not self.rendered_global:
+            self.rendered_global = global_counts
+            self.progress_manager.update_global_progress(*global_counts)
+
+    def forget(self, file_id, value):
+        """Retira un archivo terminado, salvo que su hilo haya vuelto a escribir entretanto."""
+        self.rendered.pop(file_id, None)
+        current = self.slots.pop(file_id, None)
+        if current is not None and current is not value:
+            self.slots.setdefault(file_id, current)
+
+    def clear(self):
+        """Olvida los archivos de la sesión anterior (al empezar otra descarga)."""
+        self.slots.clear()
+        self.rendered.clear()
+        self.global_counts = None
+        self.rendered_global = None
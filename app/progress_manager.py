@@ -120,11 +120,19 @@ class ProgressManager:
                     self.progress_bars[file_id][1].configure(text="0%")
                     self.progress_bars[file_id][2].configure(text="ETA: N/A")
 
-        # Actualizar velocidad en el footer (si corresponde)
-        if speed is not None:
-            speed_text = f"Speed: {speed / 1024:.2f} KB/s" if speed < 1048576 else f"Speed: {speed / 1048576:.2f} MB/s"
+    def update_transfer_stats(self, done, total, speed, eta):
+        """Velocidad y ETA de toda la sesión en el footer (ver TransferAccountant)."""
+        speed_text = f"Speed: {speed / 1024:.2f} KB/s" if speed < 1048576 else f"Speed: {speed / 1048576:.2f} MB/s"
+        if self.footer_speed_label.winfo_exists():
             self.footer_speed_label.configure(text=speed_text)
-            self.footer_eta_label.configure(text=self.footer_eta_label.cget("text"))
+        if eta is not None:
+            hours, remainder = divmod(int(eta), 3600)
+            eta_text = f"ETA: {hours}h {remainder // 60}m {remainder % 60}s" if hours else f"ETA: {remainder // 60}m {remainder % 60}s"
+            eta_text += f" ({done / 1048576:.1f} MB / {total / 1048576:.1f} MB)"
+        else:
+            eta_text = "ETA: N/A"
+        if self.footer_eta_label.winfo_exists():
+            self.footer_eta_label.configure(text=eta_text)
 
     def remove_progress_bar(self, file_id):
         if file_id in self.progress_bars and self.progress_bars[file_id][3].winfo_exists():
@@ -1,5 +1,7 @@
+import datetime
 import json
 import os
+import queue
 import sqlite3
 import threading
 from tkinter import filedialog, messagebox, ttk
@@ -8,6 +10,11 @@ import tkinter as tk
 from PIL import Image, ImageTk
 from PIL import Image as PilImage
 
+from downloader.db_schema import file_type
+from downloader.db_writer import DatabaseWriter
+from downloader.history import DownloadHistory
+from downloader.url_index import UrlIndex
+
 
 class SettingsWindow:
     CONFIG_PATH = 'resources/config/settings.json' 
@@ -87,6 +94,38 @@ class SettingsWindow:
         
         header_label = ctk.CTkLabel(db_frame, text=self.translate("Database Management"), font=("Helvetica", 16, "bold"))
         header_label.pack(pady=(0, 10))
+
+        # Búsqueda en el historial (nombre de archivo, título del post o usuario) y filtros
+        search_frame = ctk.CTkFrame(db_frame, fg_color="transparent")
+        search_frame.pack(fill="x", pady=(0, 5))
+        self.db_search_entry = ctk.CTkEntry(search_frame, placeholder_text=self.translate("Search files, posts or users..."))
+        self.db_search_entry.pack(side="left", fill="x", expand=True)
+        self.db_search_entry.bind("<Return>", lambda event: self.search_db_records())
+        self.db_type_labels = {
+            self.translate("All types"): None,
+            self.translate("Image"): 'image',
+            self.translate("Video"): 'video',
+            self.translate("Document"): 'document',
+            self.translate("Compressed"): 'compressed',
+            self.translate("Other"): 'other',
+        }
+        self.db_type_combobox = ctk.CTkComboBox(search_frame, values=list(self.db_type_labels), state='readonly', width=120)
+        self.db_type_combobox.set(self.translate("All types"))
+        self.db_type_combobox.pack(side="left", padx=(10, 0))
+        ctk.CTkButton(search_frame, text=self.translate("Search"), width=80,
+                      command=self.search_db_records).pack(side="left", padx=(10, 0))
+        ctk.CTkButton(search_frame, text=self.translate("Clear search"), width=80,
+                      command=self.clear_db_search).pack(side="left", padx=(10, 0))
+
+        filter_frame = ctk.CTkFrame(db_frame, fg_color="transparent")
+        filter_frame.pack(fill="x", pady=(0, 10))
+        self.db_filter_entries = {}
+        for key, label in (('min_size', "Min MB"), ('max_size', "Max MB"),
+                           ('date_from', "From (YYYY-MM-DD)"), ('date_to', "To (YYYY-MM-DD)")):
+            entry = ctk.CTkEntry(filter_frame, placeholder_text=self.translate(label), width=140)
+            entry.pack(side="left", padx=(0, 10))
+            entry.bind("<Return>", lambda event: self.search_db_records())
+            self.db_filter_entries[key] = entry
         
         # Configurar un estilo personalizado para el Treeview
         style = ttk.Style()
@@ -135,6 +174,15 @@ class SettingsWindow:
         vsb.grid(row=0, column=1, sticky="ns")
         table_frame.grid_rowconfigure(0, weight=1)
         table_frame.grid_columnconfigure(0, weight=1)
+
+        # Los hijos de cada nodo se piden al desplegarlo, por páginas y en un hilo de fondo
+        self.db_history = DownloadHistory(self.downloader.db_path)
+        self.db_nodes = {}  # { nodo: dict con el tipo de nodo y su clave }
+        self.db_results = queue.Queue()
+        self.db_generation = 0  # Descarta resultados de cargas anteriores del árbol
+        self.db_tree.bind("<<TreeviewOpen>>", self.on_db_node_open)
+        self.db_tree.bind("<<TreeviewSelect>>", self.on_db_node_select)
+        self.poll_db_results()
         
         # Botones para exportar y limpiar
         btn_frame = ctk.CTkFrame(db_frame, fg_color="transparent")
@@ -164,9 +212,9 @@ class SettingsWindow:
             return
 
         user_ids = [
-            self.db_tree.item(node, 'text')
+            self.db_nodes[node]['user_id']
             for node in selected
-            if self.db_tree.parent(node) == ''
+            if self.db_nodes.get(node, {}).get('kind') == 'user'
         ]
         if not user_ids:
             messagebox.showwarning(
@@ -187,12 +235,19 @@ class SettingsWindow:
             return
 
         try:
+            # Lo que el hilo escritor tenga en cola se confirma antes de borrar, o esas
+            # inserciones volverían a crear las filas de los usuarios borrados
+            DatabaseWriter.for_path(self.downloader.db_path).flush()
             conn = sqlite3.connect(self.downloader.db_path)
             cursor = conn.cursor()
             for uid in user_ids:
                 cursor.execute("DELETE FROM downloads WHERE user_id = ?", (uid,))
+                cursor.execute("DELETE FROM creator_sync WHERE user_id = ?", (uid,))
+                cursor.execute("DELETE FROM jobs WHERE user_id = ?", (uid,))
             conn.commit()
             conn.close()
+            # El índice de URLs compartido (también el de una descarga en curso) se recarga sin estos registros
+            UrlIndex.invalidate(self.downloader.db_path)
 
             messagebox.showinfo(
                 self.translate("Success"),
@@ -208,85 +263,174 @@ class SettingsWindow:
 
 
     def load_db_records(self):
-        """Consulta la base de datos y carga los registros en el Treeview agrupados por usuario y, opcionalmente, por post."""
+        """
+        Carga en el Treeview los usuarios de la base de datos (agrupados, con número
+        de archivos y tamaño). Sus posts y archivos se piden al desplegar cada nodo.
+        """
         db_path = self.downloader.db_path
         if not os.path.exists(db_path):
             tk.messagebox.showwarning(self.translate("Warning"), self.translate("Database not found."))
             return
 
-        try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, media_url, file_path, file_size, user_id, post_id, downloaded_at FROM downloads")
-            rows = cursor.fetchall()
-            conn.close()
-        except Exception as e:
-            tk.messagebox.showerror(self.translate("Error"), self.translate("Error loading database: {e}", e=e))
+        # Limpiar el Treeview
+        self.db_generation += 1
+        self.db_nodes = {}
+        for child in self.db_tree.get_children():
+            self.db_tree.delete(child)
+
+        placeholder = self.insert_db_placeholder("", 'users', (), 0)
+        self.request_db_page(placeholder)
+
+    def search_db_records(self):
+        """Sustituye el árbol por los archivos que cumplen la búsqueda y los filtros, por páginas."""
+        text = self.db_search_entry.get().strip()
+        filters = {'file_type': self.db_type_labels.get(self.db_type_combobox.get())}
+        for key, entry in self.db_filter_entries.items():
+            value = entry.get().strip()
+            if not value:
+                filters[key] = None
+                continue
+            try:
+                if key in ('min_size', 'max_size'):
+                    filters[key] = int(float(value) * 1024**2)
+                else:
+                    filters[key] = datetime.date.fromisoformat(value).isoformat()
+            except ValueError:
+                messagebox.showwarning(self.translate("Warning"),
+                                       self.translate("Invalid filter value: {value}", value=value))
+                return
+
+        if not text and not any(filters.values()):
+            self.load_db_records()
+            return
+        if not os.path.exists(self.downloader.db_path):
+            tk.messagebox.showwarning(self.translate("Warning"), self.translate("Database not found."))
             return
 
-        # Limpiar el Treeview
+        self.db_generation += 1
+        self.db_nodes = {}
         for child in self.db_tree.get_children():
             self.db_tree.delete(child)
+        key = (text, filters['file_type'], filters['min_size'], filters['max_size'],
+               filters['date_from'], filters['date_to'])
+        placeholder = self.insert_db_placeholder("", 'search', key, 0)
+        self.request_db_page(placeholder)
+
+    def clear_db_search(self):
+        self.db_search_entry.delete(0, "end")
+        for entry in self.db_filter_entries.values():
+            entry.delete(0, "end")
+        self.db_type_combobox.set(self.translate("All types"))
+        self.load_db_records()
 
-        # Función auxiliar para determinar el tipo de archivo según la extensión
-        def get_file_type(file_path):
-            ext = os.path.splitext(file_path)[1].lower()
-            if ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff']:
-                return self.translate("Image")
-            elif ext in ['.mp4', '.mkv', '.webm', '.mov', '.avi', '.flv', '.wmv', '.m4v']:
-                return self.translate("Video")
-            elif ext in ['.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx']:
-                return self.translate("Document")
-            elif ext in ['.zip', '.rar', '.7z', '.tar', '.gz']:
-                return self.translate("Compressed")
-            else:
-                return self.translate("Other")
-
-        # Función para formatear el tamaño
-        def format_size(size):
-            if size < 1024:
-                return f"{size} B"
-            elif size < 1024**2:
-                return f"{size/1024:.2f} KB"
+    def insert_db_placeholder(self, parent, query, key, offset):
+        """Nodo "Cargando..." / "Cargar más..." que representa la siguiente página de parent."""
+        text = self.translate("Loading...") if offset == 0 else self.translate("Load more...")
+        node = self.db_tree.insert(parent, "end", text=text)
+        self.db_nodes[node] = {'kind': 'more', 'query': query, 'key': key, 'offset': offset, 'requested': False}
+        return node
+
+    def request_db_page(self, placeholder):
+        info = self.db_nodes[placeholder]
+        if info['requested']:
+            return
+        info['requested'] = True
+        self.db_tree.item(placeholder, text=self.translate("Loading..."))
+        query = getattr(self.db_history, info['query'])
+        key, offset = info['key'], info['offset']
+        generation = self.db_generation
+
+        def work():
+            try:
+                self.db_results.put((generation, placeholder, query(*key, offset=offset), None))
+            except Exception as e:
+                self.db_results.put((generation, placeholder, None, e))
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def poll_db_results(self):
+        """Inserta en el Treeview, desde el hilo de Tk, las páginas que han llegado de la base de datos."""
+        if not self.settings_window.winfo_exists():
+            return
+        while True:
+            try:
+                generation, placeholder, page, error = self.db_results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self.db_generation or not self.db_tree.exists(placeholder):
+                continue
+            if error is not None:
+                self.db_tree.delete(placeholder)
+                tk.messagebox.showerror(self.translate("Error"), self.translate("Error loading database: {e}", e=error))
+                continue
+            self.insert_db_page(placeholder, *page)
+        self.settings_window.after(50, self.poll_db_results)
+
+    def insert_db_page(self, placeholder, rows, has_more):
+        info = self.db_nodes.pop(placeholder)
+        parent = self.db_tree.parent(placeholder)
+        self.db_tree.delete(placeholder)
+        query, key = info['query'], info['key']
+
+        for row in rows:
+            if query == 'users':
+                user_id, count, size, downloaded_at = row
+                node = self.db_tree.insert(parent, "end", text=user_id, open=False, values=(
+                    "", self.translate("{count} files", count=count), "", self.format_size(size), downloaded_at))
+                self.db_nodes[node] = {'kind': 'user', 'user_id': user_id}
+                self.insert_db_placeholder(node, 'posts', (user_id,), 0)
+            elif query == 'posts':
+                post_id, post_title, count, size, downloaded_at = row
+                text = post_id or self.translate("No Post")
+                node = self.db_tree.insert(parent, "end", text=text, open=False, values=(
+                    "", post_title or self.translate("{count} files", count=count), "",
+                    self.format_size(size), downloaded_at))
+                self.db_nodes[node] = {'kind': 'post', 'user_id': key[0], 'post_id': post_id}
+                self.insert_db_placeholder(node, 'files', (key[0], post_id), 0)
+            elif query == 'search':
+                rec_id, file_path, file_size, kind, downloaded_at, user_id, post_id, post_title = row
+                text = f"{user_id} / {post_id or self.translate('No Post')}"
+                node = self.db_tree.insert(parent, "end", text=text, values=(
+                    rec_id, os.path.basename(file_path or ""), self.file_type_label(kind or file_type(file_path)),
+                    self.format_size(file_size or 0), downloaded_at))
+                self.db_nodes[node] = {'kind': 'file', 'id': rec_id}
             else:
-                return f"{size/1024**2:.2f} MB"
-
-        # Agrupar registros por usuario
-        usuarios = {}
-        for rec in rows:
-            rec_id, media_url, file_path, file_size, user_id, post_id, downloaded_at = rec
-            usuarios.setdefault(user_id, []).append(rec)
-
-        # Insertar cada usuario como nodo padre en el Treeview
-        for user, registros in usuarios.items():
-            user_node = self.db_tree.insert("", "end", text=user, open=False)
-            # Dentro de cada usuario, agrupar los registros que tienen post_id y los que no
-            posts = {}
-            sin_post = []
-            for rec in registros:
-                rec_id, media_url, file_path, file_size, user_id, post_id, downloaded_at = rec
-                if post_id:
-                    posts.setdefault(post_id, []).append(rec)
-                else:
-                    sin_post.append(rec)
-            # Insertar nodos para cada post
-            for post, recs in posts.items():
-                post_node = self.db_tree.insert(user_node, "end", text=post, open=False)
-                for rec in recs:
-                    rec_id, media_url, file_path, file_size, user_id, post_id, downloaded_at = rec
-                    file_name = os.path.basename(file_path)
-                    file_type = get_file_type(file_path)
-                    size_str = format_size(file_size)
-                    self.db_tree.insert(post_node, "end", values=(rec_id, file_name, file_type, size_str, downloaded_at))
-            # Insertar los registros sin post en un nodo especial
-            if sin_post:
-                sin_post_node = self.db_tree.insert(user_node, "end", text=self.translate("No Post"), open=False)
-                for rec in sin_post:
-                    rec_id, media_url, file_path, file_size, user_id, post_id, downloaded_at = rec
-                    file_name = os.path.basename(file_path)
-                    file_type = get_file_type(file_path)
-                    size_str = format_size(file_size)
-                    self.db_tree.insert(sin_post_node, "end", values=(rec_id, file_name, file_type, size_str, downloaded_at))
+                rec_id, file_path, file_size, kind, downloaded_at = row
+                node = self.db_tree.insert(parent, "end", values=(
+                    rec_id, os.path.basename(file_path or ""), self.file_type_label(kind or file_type(file_path)),
+                    self.format_size(file_size or 0), downloaded_at))
+                self.db_nodes[node] = {'kind': 'file', 'id': rec_id}
+
+        if has_more:
+            self.insert_db_placeholder(parent, query, key, info['offset'] + len(rows))
+        elif query == 'search' and info['offset'] == 0 and not rows:
+            self.db_tree.insert(parent, "end", text=self.translate("No results."))
+
+    def on_db_node_open(self, event=None):
+        # Primera vez que se despliega: el único hijo es el marcador de la primera página
+        for child in self.db_tree.get_children(self.db_tree.focus()):
+            if self.db_nodes.get(child, {}).get('kind') == 'more':
+                self.request_db_page(child)
+
+    def on_db_node_select(self, event=None):
+        for node in self.db_tree.selection():
+            if self.db_nodes.get(node, {}).get('kind') == 'more':
+                self.request_db_page(node)
+
+    def file_type_label(self, kind):
+        labels = {'image': "Image", 'video': "Video", 'document': "Document", 'compressed': "Compressed"}
+        return self.translate(labels.get(kind, "Other"))
+
+    @staticmethod
+    def format_size(size):
+        if size < 1024:
+            return f"{size} B"
+        elif size < 1024**2:
+            return f"{size/1024:.2f} KB"
+        elif size < 1024**3:
+            return f"{size/1024**2:.2f} MB"
+        else:
+            return f"{size/1024**3:.2f} GB"
 
     def render_general_tab(self, tab):
         tab.grid_columnconfigure(0, weight=1)
@@ -8,8 +8,7 @@ import threading
 import tkinter as tk
 from pathlib import Path
 from tkinter import filedialog, messagebox, scrolledtext
-from typing import Optional
-from urllib.parse import ParseResult, parse_qs, urlparse
+from urllib.parse import urlparse
 import webbrowser
 import requests
 from PIL import Image
@@ -22,38 +21,25 @@ from app.settings_window import SettingsWindow
 #from app.user_panel import UserPanel
 from app.about_window import AboutWindow
 from downloader.bunkr import BunkrDownloader
+from downloader.db_writer import close_writers
 from downloader.downloader import Downloader
 from downloader.erome import EromeDownloader
 from downloader.simpcity import SimpCity
 from downloader.jpg5 import Jpg5Downloader
+from downloader.factory import build_downloader
+from downloader.scheduler import DownloadScheduler
+from downloader.rate_limiter import bandwidth_limiter
+from downloader.transfer_stats import session_stats
+from downloader.routing import (
+    SITE_BUNKR, SITE_COOMER, SITE_EROME, SITE_JPG5, SITE_SIMPCITY,
+    detect_site, extract_ck_parameters, extract_ck_query, is_bunkr_post, is_erome_album
+)
+from app.progress_aggregator import ProgressAggregator
 from app.progress_manager import ProgressManager
 
 VERSION = "V0.8.11"
 MAX_LOG_LINES = None
 
-def extract_ck_parameters(url: ParseResult) -> tuple[Optional[str], Optional[str], Optional[str]]:
-    """
-    Get the service, user and post id from the url if they exist
-    """
-    match = re.search(r"/(?P<service>[^/?]+)(/user/(?P<user>[^/?]+)(/post/(?P<post>[^/?]+))?)?", url.path)
-    if match:
-        [site, service, post] = match.group("service", "user", "post")
-        return site, service, post
-    else:
-        return None, None, None
-
-def extract_ck_query(url: ParseResult) -> tuple[Optional[str], int]:
-    """
-    Try to obtain the query and offset from the url if they exist
-    """
-
-    # This is kinda contrived but query parameters are awful to get right
-    query = parse_qs(url.query)
-    q = query.get("q")[0] if query.get("q") is not None and len(query.get("q")) > 0 else None
-    o = query.get("o")[0] if query.get("o") is not None and len(query.get("o")) > 0 else "0"
-
-    return q, int(o) if str.isdigit(o) else 0
-
 # Application class
 class ImageDownloaderApp(ctk.CTk):
     def __init__(self):
@@ -150,6 +136,12 @@ class ImageDownloaderApp(ctk.CTk):
             progress_bar=self.progress_bar,
             progress_percentage=self.progress_percentage
         )
+        # Los hilos de descarga solo dejan su progreso en slots; Tk lo dibuja a 10 Hz
+        self.progress_aggregator = ProgressAggregator(self, self.progress_manager)
+        self.progress_aggregator.start()
+
+        # Ofrecer reanudar la cola de descargas que quedó sin terminar en la sesión anterior
+        self.after(1000, self.offer_resume_jobs)
 
     # Application close event
     def on_app_close(self):
@@ -166,6 +158,12 @@ class ImageDownloaderApp(ctk.CTk):
         return self.active_downloader is not None
     
     def close_program(self):
+        # Las descargas en curso dejan de escribir y lo encolado se confirma en la base de datos:
+        # matar el proceso con psutil impide que corran los manejadores de atexit. close_writers
+        # espera como mucho SHUTDOWN_FLUSH_TIMEOUT por escritor para que un hilo colgado no bloquee el cierre
+        if self.active_downloader:
+            self.active_downloader.request_cancel()
+        close_writers()
         # Cierra todas las ventanas y termina el proceso principal
         self.destroy()
         # Matar el proceso actual (eliminar del administrador de tareas)
@@ -636,7 +634,8 @@ class ImageDownloaderApp(ctk.CTk):
                 'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
                 'Referer': 'https://bunkr.site/',
             },
-            max_workers=self.max_downloads
+            max_workers=self.max_downloads,
+            throttle_policies=self.settings_window.settings.get('throttle_policies')
         )
 
     def setup_general_downloader(self):
@@ -655,7 +654,23 @@ class ImageDownloaderApp(ctk.CTk):
             download_compressed=self.download_compressed_check.get(),
             tr=self.tr,
             max_workers=self.max_downloads,
-            folder_structure=self.settings_window.settings.get('folder_structure', 'default')
+            folder_structure=self.settings_window.settings.get('folder_structure', 'default'),
+            download_engine=self.settings_window.settings.get('download_engine', 'threads'),
+            async_max_concurrency=self.settings_window.settings.get('async_max_concurrency', 100),
+            segment_count=self.settings_window.settings.get('segment_count', 1),
+            segment_threshold_mb=self.settings_window.settings.get('segment_threshold_mb', 100),
+            rate_limit_per_second=self.settings_window.settings.get('rate_limit_per_second'),
+            rate_limit_burst=self.settings_window.settings.get('rate_limit_burst', 2),
+            throttle_policies=self.settings_window.settings.get('throttle_policies'),
+            adaptive_concurrency=self.settings_window.settings.get('adaptive_concurrency', False),
+            adaptive_max_concurrency=self.settings_window.settings.get('adaptive_max_concurrency', 16),
+            subdomain_cache_ttl_hours=self.settings_window.settings.get('subdomain_cache_ttl_hours', 24),
+            api_page_window=self.settings_window.settings.get('api_page_window', 4),
+            incremental_sync=self.settings_window.settings.get('incremental_sync', True),
+            content_dedup=self.settings_window.settings.get('content_dedup', True),
+            task_order=self.settings_window.settings.get('task_order', 'none'),
+            head_prefetch_workers=self.settings_window.settings.get('head_prefetch_workers', 8),
+            partial_max_age_days=self.settings_window.settings.get('partial_max_age_days', 7)
         )
         self.general_downloader.file_naming_mode = self.settings_window.settings.get('file_naming_mode', 0)
 
@@ -684,13 +699,14 @@ class ImageDownloaderApp(ctk.CTk):
     
     # Reemplaza las llamadas a los métodos de progreso con self.progress_manager
     def update_progress(self, downloaded, total, file_id=None, file_path=None, speed=None, eta=None):
-        self.progress_manager.update_progress(downloaded, total, file_id, file_path, speed, eta)
+        # Se llama desde los hilos de descarga: no toca widgets, el agregador dibuja desde Tk
+        self.progress_aggregator.report(downloaded, total, file_id, file_path, speed, eta)
 
     def remove_progress_bar(self, file_id):
         self.progress_manager.remove_progress_bar(file_id)
 
     def update_global_progress(self, completed_files, total_files):
-        self.progress_manager.update_global_progress(completed_files, total_files)
+        self.progress_aggregator.report_global(completed_files, total_files)
 
     def toggle_progress_details(self):
         self.progress_manager.toggle_progress_details()
@@ -718,6 +734,17 @@ class ImageDownloaderApp(ctk.CTk):
             messagebox.showerror(self.tr("Error"), self.tr("Por favor, selecciona una carpeta de descarga."))
             return
 
+        # El límite de ancho de banda se relee en cada descarga por si cambió en ajustes
+        bandwidth_limiter.configure(self.settings_window.settings.get('bandwidth_limit'))
+        session_stats.reset()
+        self.progress_aggregator.clear()
+
+        # Varias URLs separadas por espacios o comas se reparten en el planificador global
+        urls = [u for u in re.split(r'[\s,]+', url) if u]
+        if len(urls) > 1:
+            self.start_batch_download(urls)
+            return
+
         self.download_button.configure(state="disabled")
         self.cancel_button.configure(state="normal")
         self.download_start_time = datetime.datetime.now()
@@ -725,32 +752,33 @@ class ImageDownloaderApp(ctk.CTk):
         download_all = True
 
         parsed_url = urlparse(url)
+        site_kind = detect_site(url)
         
-        if "erome.com" in url:
+        if site_kind == SITE_EROME:
             self.add_log_message_safe(self.tr("Descargando Erome"))
-            is_profile_download = "/a/" not in url
+            is_profile_download = not is_erome_album(url)
             self.setup_erome_downloader(is_profile_download=is_profile_download)
             self.active_downloader = self.erome_downloader
-            if "/a/" in url:
+            if is_erome_album(url):
                 self.add_log_message_safe(self.tr("URL del álbum"))
                 download_thread = threading.Thread(target=self.wrapped_download, args=(self.active_downloader.process_album_page, url, self.download_folder, self.download_images_check.get(), self.download_videos_check.get()))
             else:
                 self.add_log_message_safe(self.tr("URL del perfil"))
                 download_thread = threading.Thread(target=self.wrapped_download, args=(self.active_downloader.process_profile_page, url, self.download_folder, self.download_images_check.get(), self.download_videos_check.get()))
         
-        elif re.search(r"https?://([a-z0-9-]+\.)?bunkr\.[a-z]{2,}", url):
+        elif site_kind == SITE_BUNKR:
             self.add_log_message_safe(self.tr("Descargando Bunkr"))
             self.setup_bunkr_downloader()
             self.active_downloader = self.bunkr_downloader
             # Si la URL contiene "/v/", "/i/" o "/f/", la tratamos como un post individual.
-            if any(sub in url for sub in ["/v/", "/i/", "/f/"]):
+            if is_bunkr_post(url):
                 self.add_log_message_safe(self.tr("URL del post"))
                 download_thread = threading.Thread(target=self.wrapped_download, args=(self.bunkr_downloader.descargar_post_bunkr, url))
             else:
                 self.add_log_message_safe(self.tr("URL del perfil"))
                 download_thread = threading.Thread(target=self.wrapped_download, args=(self.bunkr_downloader.descargar_perfil_bunkr, url))
         
-        elif parsed_url.netloc in ["coomer.su", "kemono.su"]:
+        elif site_kind == SITE_COOMER:
             self.add_log_message_safe(self.tr("Iniciando descarga..."))
             self.setup_general_downloader()
             self.active_downloader = self.general_downloader
@@ -780,14 +808,14 @@ class ImageDownloaderApp(ctk.CTk):
                 self.add_log_message_safe(self.tr("Descargando todo el contenido del usuario..."))
                 download_thread = threading.Thread(target=self.wrapped_download, args=(self.start_ck_profile_download, site, service, user, query, download_all, offset))
         
-        elif "simpcity.su" in url:
+        elif site_kind == SITE_SIMPCITY:
             self.add_log_message_safe(self.tr("Descargando SimpCity"))
             self.setup_simpcity_downloader()
             self.active_downloader = self.simpcity_downloader
             # Iniciar la descarga en un hilo separado
             download_thread = threading.Thread(target=self.wrapped_download, args=(self.active_downloader.download_images_from_simpcity, url))
         
-        elif "jpg5.su" in url:
+        elif site_kind == SITE_JPG5:
             self.add_log_message_safe(self.tr("Descargando desde Jpg5"))
             self.setup_jpg5_downloader()
             
@@ -802,6 +830,51 @@ class ImageDownloaderApp(ctk.CTk):
 
         download_thread.start()
 
+    def start_batch_download(self, urls):
+        self.download_button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+        self.download_start_time = datetime.datetime.now()
+        self.errors = []
+
+        settings = self.settings_window.settings
+        scheduler = DownloadScheduler.from_settings(settings)
+        options = {
+            'settings': settings,
+            'download_folder': self.download_folder,
+            'max_workers': self.max_downloads,
+            'download_images': self.download_images_check.get(),
+            'download_videos': self.download_videos_check.get(),
+            'download_compressed': self.download_compressed_check.get(),
+        }
+        # Los widgets se habilitan cuando termina todo el lote, no con cada URL
+        callbacks = {
+            'log': self.add_log_message_safe,
+            'progress': self.update_progress,
+            'global_progress': self.update_global_progress,
+        }
+        self.active_downloader = scheduler
+        self.add_log_message_safe(self.tr("Descargando {count} URLs a la vez...", count=len(urls)))
+        download_thread = threading.Thread(target=self.wrapped_download, args=(self.run_batch_download, scheduler, urls, options, callbacks))
+        download_thread.start()
+
+    def run_batch_download(self, scheduler, urls, options, callbacks):
+        futures = []
+        for url in urls:
+            site_kind = detect_site(url)
+            if site_kind is None:
+                self.add_log_message_safe(f"{self.tr('URL no válida')}: {url}")
+                continue
+            futures.append(scheduler.submit(url, lambda url=url, site_kind=site_kind: build_downloader(
+                url, site_kind, options, callbacks, self.tr, scheduler=scheduler)))
+        try:
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    self.add_log_message_safe(f"Error: {e}")
+        finally:
+            scheduler.shutdown(wait=True)
+
     def start_ck_profile_download(self, site, service, user, query, download_all, initial_offset):
         download_info = self.active_downloader.download_media(site, user, service, query=query, download_all=download_all, initial_offset=initial_offset)
         if download_info:
@@ -811,6 +884,36 @@ class ImageDownloaderApp(ctk.CTk):
         self.active_downloader = None  # Resetea la active_downloader cuando la descarga termina
         self.enable_widgets()  # Asegúrate de habilitar los widgets
     
+    def offer_resume_jobs(self):
+        if self.is_download_active() or not self.download_folder:
+            return
+        unfinished = self.default_downloader.count_unfinished_jobs()
+        if not unfinished:
+            return
+        resume = messagebox.askyesno(
+            self.tr("Descargas pendientes"),
+            self.tr("Hay {count} descargas sin terminar de la sesión anterior. ¿Quieres reanudarlas?", count=unfinished)
+        )
+        if not resume:
+            return
+        self.download_button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+        self.download_start_time = datetime.datetime.now()
+        self.errors = []
+        bandwidth_limiter.configure(self.settings_window.settings.get('bandwidth_limit'))
+        session_stats.reset()
+        self.progress_aggregator.clear()
+        self.setup_general_downloader()
+        self.active_downloader = self.general_downloader
+        download_thread = threading.Thread(target=self.wrapped_download, args=(self.start_ck_resume_download,))
+        download_thread.start()
+
+    def start_ck_resume_download(self):
+        self.active_downloader.resume_jobs()
+        self.export_logs()
+        self.active_downloader = None  # Resetea la active_downloader cuando la descarga termina
+        self.enable_widgets()  # Asegúrate de habilitar los widgets
+
     def start_ck_post_download(self, site, service, user, post):
         download_info = self.active_downloader.download_single_post(site, post, service, user)
         if download_info:
@@ -847,6 +950,8 @@ class ImageDownloaderApp(ctk.CTk):
         if self.active_downloader:
             self.active_downloader.request_cancel()
             self.active_downloader = None
+            # Sin esto el siguiente fotograma volvería a dibujar las barras de la descarga cancelada
+            self.progress_aggregator.clear()
             self.clear_progress_bars()
         else:
             self.add_log_message_safe(self.tr("No hay una descarga en curso para cancelar."))
@@ -0,0 +1 @@
+"""Interfaz de línea de comandos sin Tk: python -m coomerdl URL [URL ...]"""
@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from downloader.factory import build_downloader
+from downloader.rate_limiter import bandwidth_limiter
+from downloader.routing import SITE_BUNKR, detect_site
+from downloader.scheduler import DownloadScheduler
+from downloader.transfer_stats import session_stats
+
+# Carpeta de la aplicación (la que contiene resources/), sea cual sea el directorio de trabajo
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS_PATH = os.path.join(APP_ROOT, "resources", "config", "settings.json")
+DOWNLOAD_FOLDER_PATH = os.path.join(APP_ROOT, "resources", "config", "download_path", "download_folder.json")
+TRANSLATIONS_PATH = os.path.join(APP_ROOT, "resources", "config", "languages", "translations.json")
+
+# Códigos de salida
+EXIT_OK = 0
+EXIT_FAILED = 1  # Alguna URL terminó con archivos fallidos
+EXIT_USAGE = 2  # Argumentos incorrectos o URLs no soportadas
+EXIT_CANCELLED = 130  # Interrumpido con Ctrl+C / SIGINT
+
+
+class JsonLinesReporter:
+    """
+    Escribe un objeto JSON por línea en stdout para cada evento (log, progreso,
+    inicio y fin de cada URL). El progreso por archivo se limita a un evento por
+    intervalo para no inundar la salida.
+    """
+
+    def __init__(self, stream=None, progress_interval=1.0):
+        self.stream = stream or sys.stdout
+        self.progress_interval = progress_interval
+        self.lock = threading.Lock()
+        self.last_progress = {}
+
+    def emit(self, event, **fields):
+        line = json.dumps({'event': event, 'time': round(time.time(), 3), **fields}, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def log(self, message):
+        self.emit('log', message=str(message))
+
+    def progress(self, downloaded, total, file_id=None, file_path=None, speed=None, eta=None):
+        session_stats.update(file_id, downloaded, total)
+        now = time.monotonic()
+        finished = bool(total) and downloaded >= total
+        with self.lock:
+            if not finished and now - self.last_progress.get(file_id, 0) < self.progress_interval:
+                return
+            if finished:
+                self.last_progress.pop(file_id, None)
+            else:
+                self.last_progress[file_id] = now
+        self.emit('progress', file_id=file_id, file_path=file_path, downloaded=downloaded, total=total,
+                  speed=round(speed or 0, 1), eta=round(eta or 0, 1))
+
+    def global_progress(self, completed_files, total_files):
+        # Bytes, velocidad (EWMA) y ETA de toda la sesión, sumando todas las URLs
+        done, total_bytes, speed, eta = session_stats.snapshot()
+        self.emit('global_progress', completed=completed_files, total=total_files,
+                  bytes_done=done, bytes_total=total_bytes, speed=round(speed, 1),
+                  eta=round(eta, 1) if eta is not None else None)
+
+
+def load_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def make_translator(language):
+    """Misma traducción que la interfaz, con las claves de translations.json."""
+    all_translations = load_json(TRANSLATIONS_PATH, {})
+    translations = {key: value.get(language, key) for key, value in all_translations.items()}
+
+    def tr(text, **kwargs):
+        translated_text = translations.get(text, text)
+        if kwargs:
+            translated_text = translated_text.format(**kwargs)
+        return translated_text
+    return tr
+
+
+def read_urls(args):
+    """URLs de la línea de comandos y de los archivos -f (una por línea, '#' para comentarios)."""
+    urls = list(args.urls)
+    for url_file in args.url_file or []:
+        if url_file == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(url_file, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        urls.extend(line.strip() for line in lines if line.strip() and not line.strip().startswith('#'))
+    return urls
+
+
+def file_counts(downloader):
+    """
+    (completados, fallidos, total) de un descargador, con los contadores que tenga.
+    Los fallidos salen de failed_files; solo los descargadores sin esa lista los
+    estiman como lo que no se completó ni se omitió.
+    """
+    total = getattr(downloader, 'total_files', 0) or 0
+    completed = getattr(downloader, 'completed_files', 0) or 0
+    failed_files = getattr(downloader, 'failed_files', None)
+    if failed_files is not None:
+        return completed, len(failed_files), total
+    skipped = len(getattr(downloader, 'skipped_files', None) or [])
+    return completed, max(0, total - completed - skipped), total
+
+
+def url_result(url, site_kind, future, reporter, cancelled):
+    """Emite el url_done de una URL ya terminada y devuelve su código de salida."""
+    downloader = None
+    error = None
+    if not future.cancelled():
+        error = future.exception()
+        if error is None:
+            downloader = future.result()
+        else:
+            reporter.log(f"Error downloading {url}: {error}")
+    if downloader is None and error is None:
+        reporter.emit('url_done', url=url, site=site_kind, status='cancelled' if cancelled else 'invalid')
+        return EXIT_CANCELLED if cancelled else EXIT_USAGE
+    if downloader is None:
+        reporter.emit('url_done', url=url, site=site_kind, status='failed', completed=0, failed=0, total=0)
+        return EXIT_FAILED
+
+    # BunkrDownloader acumula los mensajes y los envía cada pocos segundos
+    pending_logs = getattr(downloader, 'log_messages', None)
+    if site_kind == SITE_BUNKR and pending_logs:
+        reporter.log("\n".join(pending_logs))
+        pending_logs.clear()
+
+    completed, failed, total = file_counts(downloader)
+    if cancelled:
+        status, code = 'cancelled', EXIT_CANCELLED
+    elif failed or getattr(downloader, 'pagination_failed', False):
+        # Una paginación cortada deja posts sin listar aunque todo lo listado se bajara
+        status, code = 'failed', EXIT_FAILED
+    else:
+        status, code = 'ok', EXIT_OK
+    reporter.emit('url_done', url=url, site=site_kind, status=status,
+                  completed=completed, failed=failed, total=total)
+    return code
+
+
+def run_urls(urls, options, reporter, tr, scheduler):
+    """
+    Envía todas las URLs al planificador global y espera a que terminen.
+    Devuelve el código de salida combinado.
+    """
+    callbacks = {
+        'log': reporter.log,
+        'progress': reporter.progress,
+        'global_progress': reporter.global_progress,
+    }
+    exit_code = EXIT_OK
+    submitted = []  # (url, sitio, Future)
+    for url in urls:
+        site_kind = detect_site(url)
+        if site_kind is None:
+            reporter.emit('url_done', url=url, status='unsupported')
+            exit_code = EXIT_USAGE
+            continue
+
+        def build(url=url, site_kind=site_kind):
+            built = build_downloader(url, site_kind, options, callbacks, tr, scheduler=scheduler)
+            if built is not None:
+                reporter.emit('url_start', url=url, site=site_kind)
+            return built
+        submitted.append((url, site_kind, scheduler.submit(url, build)))
+
+    cancelled = False
+    pending = {future: (url, site_kind) for url, site_kind, future in submitted}
+    while pending:
+        try:
+            done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+        except KeyboardInterrupt:
+            cancelled = True
+            reporter.log(tr("Download cancellation requested."))
+            scheduler.request_cancel()
+            continue
+        for future in done:
+            url, site_kind = pending.pop(future)
+            code = url_result(url, site_kind, future, reporter, cancelled)
+            # Se conserva el peor resultado: cancelación, fallos de descarga y por último URLs no válidas
+            if code == EXIT_CANCELLED or (code == EXIT_FAILED and exit_code != EXIT_CANCELLED) \
+                    or (code == EXIT_USAGE and exit_code == EXIT_OK):
+                exit_code = code
+    return exit_code
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='coomerdl',
+        description='Download from coomer, kemono, erome, bunkr, simpcity and jpg5 without the graphical interface. '
+                    'Progress is written to stdout as one JSON object per line.'
+    )
+    parser.add_argument('urls', nargs='*', help='URLs to download')
+    parser.add_argument('-f', '--url-file', action='append',
+                        help="file with one URL per line ('-' reads stdin); can be repeated")
+    parser.add_argument('-o', '--output', help='download folder (default: the folder saved by the app)')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='simultaneous downloads across all URLs (default: scheduler.max_workers setting)')
+    parser.add_argument('-p', '--parallel-urls', type=int,
+                        help='URLs processed at the same time (default: scheduler.max_active_urls setting)')
+    parser.add_argument('--limit-rate', type=float, metavar='MB_PER_SECOND',
+                        help='bandwidth cap for all downloads in MB/s, 0 for none (default: bandwidth_limit setting)')
+    parser.add_argument('--no-images', action='store_true', help='skip images')
+    parser.add_argument('--no-videos', action='store_true', help='skip videos')
+    parser.add_argument('--no-compressed', action='store_true', help='skip compressed files')
+    parser.add_argument('--settings', default=SETTINGS_PATH, help='settings.json to use')
+    parser.add_argument('--language', default='en', help='language for log messages (default: en)')
+    parser.add_argument('--progress-interval', type=float, default=1.0,
+                        help='minimum seconds between progress events of the same file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    reporter = JsonLinesReporter(progress_interval=args.progress_interval)
+
+    try:
+        urls = read_urls(args)
+    except OSError as e:
+        reporter.emit('error', message=f"Could not read URL file: {e}")
+        return EXIT_USAGE
+    if not urls:
+        reporter.emit('error', message='No URLs given')
+        return EXIT_USAGE
+
+    settings = load_json(args.settings, {})
+    download_folder = args.output or load_json(DOWNLOAD_FOLDER_PATH, {}).get('download_folder', '')
+    if not download_folder:
+        reporter.emit('error', message='No download folder: pass --output')
+        return EXIT_USAGE
+    download_folder = os.path.abspath(download_folder)
+    os.makedirs(download_folder, exist_ok=True)
+    # Los descargadores guardan downloads.db, la caché de subdominios y los logs en
+    # resources/config relativo al directorio de trabajo, igual que la interfaz
+    os.chdir(APP_ROOT)
+
+    options = {
+        'settings': settings,
+        'download_folder': download_folder,
+        'max_workers': args.workers or settings.get('max_downloads', 3),
+        'download_images': not args.no_images,
+        'download_videos': not args.no_videos,
+        'download_compressed': not args.no_compressed,
+    }
+    tr = make_translator(args.language)
+
+    bandwidth_limiter.configure(settings.get('bandwidth_limit'))
+    if args.limit_rate is not None:
+        bandwidth_limiter.configure({'limit_mb_per_second': args.limit_rate})
+    scheduler = DownloadScheduler.from_settings(settings, max_workers=args.workers,
+                                                max_active_urls=args.parallel_urls)
+    try:
+        exit_code = run_urls(urls, options, reporter, tr, scheduler)
+    finally:
+        scheduler.shutdown(wait=True)
+    reporter.emit('finished', exit_code=exit_code, urls=len(urls))
+    return exit_code
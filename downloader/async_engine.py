@@ -0,0 +1,289 @@
+import asyncio
+import time
+from urllib.parse import urlparse
+
+from downloader.concurrency import parse_retry_after
+from downloader.partial_download import PartialDownload
+from downloader.rate_limiter import bandwidth_limiter, classify_endpoint
+from downloader.subdomain_cache import SubdomainCache
+from downloader.transfer_stats import session_stats
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp solo es necesario para el motor asyncio
+    aiohttp = None
+
+
+class AsyncDownloadEngine:
+    """
+    Motor de descargas basado en asyncio para Downloader.
+
+    En lugar de un hilo bloqueado por archivo, mantiene todas las transferencias
+    en un único event loop. La planificación (nombres, carpetas, filtros), los
+    callbacks de progreso, cancel_requested y el registro en downloads.db se
+    delegan en el Downloader que lo crea.
+    """
+
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, downloader, max_concurrency=100, per_host_limit=0, chunk_size=1048576):
+        self.downloader = downloader
+        self.max_concurrency = max_concurrency
+        self.per_host_limit = per_host_limit  # 0 = sin límite propio de aiohttp por host
+        self.chunk_size = chunk_size
+        self.host_slots = {}  # {(clase de endpoint, host): asyncio.Semaphore}, creados en el event loop
+
+    def run(self, tasks):
+        """Ejecuta las tareas (media_url, user_id, post_id, title) hasta terminar o cancelar."""
+        if aiohttp is None:
+            raise RuntimeError("The asyncio download engine requires aiohttp (pip install aiohttp).")
+        asyncio.run(self._run(tasks))
+
+    async def _run(self, tasks):
+        dl = self.downloader
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.per_host_limit)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+        slots = asyncio.Semaphore(self.max_concurrency)
+        pending = set()
+        # El controlador AIMD usa locks de hilo: avisa de cada hueco que se libera con este Event
+        self.slot_freed = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        notify_slot_freed = lambda: loop.call_soon_threadsafe(self.slot_freed.set)
+        if dl.concurrency is not None:
+            dl.concurrency.add_listener(notify_slot_freed)
+
+        async with aiohttp.ClientSession(headers=dl.headers, connector=connector, timeout=timeout) as session:
+            watcher = asyncio.create_task(self._watch_cancel(pending))
+            # Las tareas pueden venir de un generador que pagina la API: se piden en un
+            # hilo para no bloquear el event loop mientras llega la siguiente página
+            task_iter = iter(tasks)
+            try:
+                while True:
+                    await slots.acquire()
+                    next_task = await asyncio.to_thread(next, task_iter, None)
+                    if next_task is None:
+                        slots.release()
+                        break
+                    media_url, user_id, post_id, title = next_task
+                    if dl.cancel_requested.is_set():
+                        slots.release()
+                        break
+                    task = asyncio.create_task(
+                        self._download_guarded(session, slots, media_url, user_id, post_id, title)
+                    )
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                if pending:
+                    await asyncio.gather(*pending, return_exceptions=True)
+            finally:
+                watcher.cancel()
+                if dl.concurrency is not None:
+                    dl.concurrency.remove_listener(notify_slot_freed)
+
+    async def _watch_cancel(self, pending):
+        # cancel_requested es un threading.Event que se activa desde el hilo de Tk
+        while not self.downloader.cancel_requested.is_set():
+            await asyncio.sleep(0.2)
+        for task in list(pending):
+            task.cancel()
+
+    async def _download_guarded(self, session, slots, media_url, user_id, post_id, title):
+        concurrency = self.downloader.concurrency
+        host = urlparse(media_url).netloc
+        self.downloader.set_job_status(media_url, 'in_progress')
+        try:
+            if concurrency is None:
+                await self._download(session, media_url, user_id, post_id, title)
+                return
+            # Se espera al aviso de release() sin bloquear el event loop. Entre clear() y wait()
+            # no hay ningún await, así que un aviso no se puede perder; la pausa de Retry-After
+            # no avisa al terminar y se espera con timeout. La cancelación llega de _watch_cancel.
+            while True:
+                self.slot_freed.clear()
+                if concurrency.try_acquire(host):
+                    break
+                try:
+                    await asyncio.wait_for(self.slot_freed.wait(), timeout=concurrency.blocked_for(host))
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self._download(session, media_url, user_id, post_id, title)
+            finally:
+                concurrency.release(host)
+        except asyncio.CancelledError:
+            self.downloader.log(f"Download cancelled from {media_url}")
+        except Exception as e:
+            self.downloader.log(f"Error downloading {media_url}: {e}")
+            self.downloader.failed_files.append(media_url)
+        finally:
+            self.downloader.finish_job(media_url)
+            slots.release()
+
+    async def _wait_for_domain(self, domain, endpoint_class):
+        # Comparte los token buckets del Downloader; la reserva no bloquea el event loop
+        delay = self.downloader.throttle.reserve(endpoint_class, domain)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _host_slot(self, endpoint_class, domain):
+        """Equivalente de ThrottlePolicies.slot para el event loop: max_concurrent de la política."""
+        key = (endpoint_class, domain)
+        semaphore = self.host_slots.get(key)
+        if semaphore is None:
+            limit = self.downloader.throttle.policy(endpoint_class)['max_concurrent']
+            semaphore = self.host_slots[key] = asyncio.Semaphore(max(1, limit))
+        return semaphore
+
+    async def _request(self, session, url, headers=None):
+        """Equivalente asíncrono de Downloader.safe_request. Devuelve la respuesta abierta o None."""
+        dl = self.downloader
+        max_retries = dl.max_retries
+        original_url = url
+        if "coomer.su" in url:
+            cached_host = dl.subdomain_cache.get(url)
+            if cached_host:
+                url = SubdomainCache.apply(url, cached_host)
+        domain = urlparse(url).netloc
+        # _download_guarded toma el hueco del AIMD con el host original: la respuesta se anota con el mismo
+        feedback_host = urlparse(original_url).netloc
+        endpoint_class = classify_endpoint(url)
+        retry_wait = 1
+
+        for attempt in range(max_retries):
+            if dl.cancel_requested.is_set():
+                return None
+            await self._wait_for_domain(domain, endpoint_class)
+            try:
+                async with self._host_slot(endpoint_class, domain):
+                    request_start = time.monotonic()
+                    response = await session.get(url, headers=headers)
+                dl.record_host_feedback(feedback_host, response.status, response.headers, request_start)
+                if response.status == 403 and "coomer.su" in url:
+                    response.release()
+                    dl.log(dl.tr("403_warning"))
+                    if url != original_url:
+                        dl.subdomain_cache.invalidate(original_url)
+                    alt_url = await asyncio.to_thread(dl.resolve_subdomain, original_url)
+                    if alt_url in (url, original_url):
+                        dl.log("❌ Ningún subdominio válido. Abortando.")
+                        return None
+                    async with self._host_slot(endpoint_class, urlparse(alt_url).netloc):
+                        request_start = time.monotonic()
+                        response = await session.get(alt_url, headers=headers)
+                    dl.record_host_feedback(feedback_host, response.status, response.headers, request_start)
+                response.raise_for_status()
+                return response
+            except aiohttp.ClientResponseError as e:
+                if e.status in self.RETRY_STATUS:
+                    dl.log(dl.tr("Intento {attempt}/{max_retries}: Error {status_code} - Reintentando...").format(
+                        attempt=attempt + 1, max_retries=max_retries, status_code=e.status))
+                    retry_after = parse_retry_after((e.headers or {}).get('Retry-After'))
+                    await asyncio.sleep(retry_after if retry_after is not None else retry_wait)
+                    retry_wait *= 2
+                    continue
+                self._log_request_error(url, attempt, max_retries, e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._log_request_error(url, attempt, max_retries, e)
+            if attempt < max_retries - 1:
+                await asyncio.sleep(dl.retry_interval)
+        return None
+
+    def _log_request_error(self, url, attempt, max_retries, error):
+        dl = self.downloader
+        url_display = url if len(url) <= 60 else url[:60] + "..."
+        dl.log(dl.tr("Intento {attempt}/{max_retries}: Error al acceder a {url} - {error}").format(
+            attempt=attempt + 1, max_retries=max_retries, url=url_display, error=error))
+
+    async def _download(self, session, media_url, user_id, post_id, title):
+        dl = self.downloader
+        if dl.cancel_requested.is_set():
+            return
+
+        # SQLite, makedirs y la copia de archivos repetidos se hacen fuera del event loop
+        paths = await asyncio.to_thread(dl.prepare_media_element, media_url, user_id,
+                                        post_id=post_id, post_name=title)
+        if paths is None:
+            return
+        final_path, tmp_path = paths
+
+        # Los .tmp secuenciales de otra sesión se reanudan con Range + If-Range
+        partial = PartialDownload.load(tmp_path, media_url)
+        if partial is not None and partial.segments is not None:
+            # Segmentado por el motor de hilos: este motor no reparte rangos, se empieza de cero
+            partial.discard()
+            partial = None
+        response = await self._request(session, media_url,
+                                       headers=partial.range_headers() if partial is not None else None)
+        if response is None and partial is not None and not dl.cancel_requested.is_set():
+            partial.discard()
+            partial = None
+            response = await self._request(session, media_url)
+        if response is None:
+            dl.log(f"Failed to download {media_url} after retries.")
+            dl.failed_files.append(media_url)
+            return
+
+        if partial is not None and not partial.matches(response.status, response.headers):
+            dl.log(f"Remote file changed, discarding partial download of {media_url}")
+            partial.discard()
+            partial = None
+            if response.status == 206:
+                response.release()
+                response = await self._request(session, media_url)
+                if response is None:
+                    dl.log(f"Failed to download {media_url} after retries.")
+                    dl.failed_files.append(media_url)
+                    return
+
+        if partial is not None:
+            total_size = partial.size
+            downloaded_size = partial.offset()
+            dl.log(f"Resuming download at byte {downloaded_size} for {media_url} from a previous session")
+        else:
+            total_size = response.content_length or 0
+            downloaded_size = 0
+            if total_size:
+                PartialDownload.from_headers(tmp_path, media_url, total_size, response.headers).save()
+        resumed_size = downloaded_size
+        if resumed_size:
+            session_stats.begin(media_url, resumed_size)
+        start_time = time.time()
+
+        # Si se cancela, el .tmp y su sidecar se conservan para reanudar en otra sesión
+        with open(tmp_path, 'r+b' if partial is not None else 'wb') as f:
+            f.seek(downloaded_size)
+            f.truncate()
+            while True:
+                async with response:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        if dl.cancel_requested.is_set():
+                            dl.log(f"Download cancelled from {media_url}")
+                            return
+                        f.write(chunk)
+                        downloaded_size += len(chunk)
+                        delay = bandwidth_limiter.reserve(len(chunk))
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                        self._report_progress(downloaded_size, total_size, media_url, tmp_path,
+                                              start_time, resumed_size)
+
+                # Si no se ha descargado el total esperado, reanudar la descarga
+                if not total_size or downloaded_size >= total_size:
+                    break
+                dl.log(f"Resuming download at byte {downloaded_size} for {media_url}")
+                resume_headers = {'Range': f'bytes={downloaded_size}-'}
+                response = await self._request(session, media_url, headers=resume_headers)
+                if response is None:
+                    raise IOError(f"Could not resume {media_url} at byte {downloaded_size}")
+
+        await asyncio.to_thread(dl.finalize_media_element, media_url, tmp_path, final_path, total_size, user_id, post_id)
+
+    def _report_progress(self, downloaded_size, total_size, download_id, tmp_path, start_time, resumed_size=0):
+        callback = self.downloader.update_progress_callback
+        if not callback:
+            return
+        elapsed_time = time.time() - start_time
+        speed = (downloaded_size - resumed_size) / elapsed_time if elapsed_time > 0 else 0
+        remaining_time = (total_size - downloaded_size) / speed if speed > 0 else 0
+        callback(downloaded_size, total_size, file_id=download_id, file_path=tmp_path,
+                 speed=speed, eta=remaining_time)
@@ -9,8 +9,10 @@ import uuid
 import re
 import threading
 
+from downloader.rate_limiter import ThrottlePolicies, bandwidth_limiter, classify_endpoint
+
 class BunkrDownloader:
-    def __init__(self, download_folder, log_callback=None, enable_widgets_callback=None, update_progress_callback=None, update_global_progress_callback=None, headers=None, max_workers=5, translations=None):
+    def __init__(self, download_folder, log_callback=None, enable_widgets_callback=None, update_progress_callback=None, update_global_progress_callback=None, headers=None, max_workers=5, translations=None, throttle_policies=None, executor=None, throttle=None):
         self.download_folder = download_folder
         self.log_callback = log_callback
         self.enable_widgets_callback = enable_widgets_callback
@@ -24,7 +26,7 @@ class BunkrDownloader:
             'Accept-Language': 'en-US,en;q=0.9',
         }
         self.cancel_requested = False  # Flag to indicate if a cancellation request has been made
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)  # Thread pool executor for concurrent downloads
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers)  # Thread pool executor for concurrent downloads
         self.total_files = 0
         self.completed_files = 0
         self.max_downloads = 5  # Valor por defecto
@@ -32,6 +34,7 @@ class BunkrDownloader:
         self.notification_interval = 10  # Intervalo de notificación en segundos
         self.start_notification_thread()
         self.translations = translations or {}  
+        self.throttle = throttle or ThrottlePolicies(throttle_policies)  # Límites por clase de endpoint (HTML / CDN)
 
     def start_notification_thread(self):
         def notify_user():
@@ -66,6 +69,14 @@ class BunkrDownloader:
         self.executor.shutdown(wait=False)
         self.log("Executor shut down.")
 
+    def throttled_get(self, url, **kwargs):
+        # Espera turno según la clase de endpoint (página HTML o archivo del CDN) y el host
+        endpoint_class = classify_endpoint(url)
+        domain = urlparse(url).netloc
+        self.throttle.acquire(endpoint_class, domain)
+        with self.throttle.slot(endpoint_class, domain):
+            return self.session.get(url, headers=self.headers, **kwargs)
+
     def clean_filename(self, filename):
         return re.sub(r'[<>:"/\\|?*\u200b]', '_', filename)
     
@@ -95,7 +106,7 @@ class BunkrDownloader:
         for attempt in range(max_attempts):
             try:
                 self.log(f"Intentando descargar {url_media} (Intento {attempt + 1}/{max_attempts})")
-                response = self.session.get(url_media, headers=self.headers, stream=True)
+                response = self.throttled_get(url_media, stream=True)
                 response.raise_for_status()
                 
                 total_size = int(response.headers.get('content-length', 0))
@@ -111,6 +122,7 @@ class BunkrDownloader:
                             return
                         file.write(chunk)
                         downloaded_size += len(chunk)
+                        bandwidth_limiter.consume(len(chunk), lambda: self.cancel_requested)
                         if self.update_progress_callback:
                             self.update_progress_callback(downloaded_size, total_size, file_id=file_id, file_path=file_path)
 
@@ -140,7 +152,7 @@ class BunkrDownloader:
             if '/f/' in url_post:
                 self.log("Detectado URL tipo '/f/'. Procediendo a extraer el enlace intermedio.")
                 # Paso 1: Accedemos a la URL original para obtener el primer enlace (intermedio)
-                response = self.session.get(url_post, headers=self.headers)
+                response = self.throttled_get(url_post)
                 if response.status_code != 200:
                     self.log(f"Error al acceder al post {url_post}: Estado {response.status_code}")
                     return
@@ -158,7 +170,7 @@ class BunkrDownloader:
                 self.log(f"Enlace intermedio encontrado: {intermediate_url}")
 
                 # Paso 2: Accedemos a la URL intermedia para extraer el enlace final de descarga
-                intermediate_response = self.session.get(intermediate_url, headers=self.headers)
+                intermediate_response = self.throttled_get(intermediate_url)
                 if intermediate_response.status_code != 200:
                     self.log(f"Error al acceder a la URL intermedia: {intermediate_url} (Estado {intermediate_response.status_code})")
                     return
@@ -192,7 +204,7 @@ class BunkrDownloader:
             else:
                 # Lógica original para posts que contienen imágenes y videos
 
-                response = self.session.get(url_post, headers=self.headers)
+                response = self.throttled_get(url_post)
                 if response.status_code != 200:
                     self.log(f"Error al acceder al post {url_post}: Estado {response.status_code}")
                     return
@@ -234,7 +246,7 @@ class BunkrDownloader:
                     if download_page_link and 'href' in download_page_link.attrs:
                         video_page_url = download_page_link['href']
                         self.log(f"URL de la página de descarga encontrada: {video_page_url}. Accediendo ahora.")
-                        video_page_response = self.session.get(video_page_url, headers=self.headers)
+                        video_page_response = self.throttled_get(video_page_url)
                         self.log(f"Estado de la respuesta de la página de video: {video_page_response.status_code} para {video_page_url}")
 
                         if video_page_response.status_code == 200:
@@ -255,14 +267,12 @@ class BunkrDownloader:
             # Proceder a la descarga de todos los medios encontrados
             self.total_files = len(media_urls)
             if media_urls:  # Solo proceder si hay URLs para descargar
-                from concurrent.futures import ThreadPoolExecutor, as_completed
-                with ThreadPoolExecutor(max_workers=self.max_downloads) as executor:
-                    futures = [executor.submit(self.download_file, url, folder, str(uuid.uuid4())) for url, folder in media_urls]
-                    for future in as_completed(futures):
-                        if self.cancel_requested:
-                            self.log("Cancelando descargas restantes.")
-                            break
-                        future.result()
+                futures = [self.executor.submit(self.download_file, url, folder, str(uuid.uuid4())) for url, folder in media_urls]
+                for future in as_completed(futures):
+                    if self.cancel_requested:
+                        self.log("Cancelando descargas restantes.")
+                        break
+                    future.result()
 
             self.log("Descarga iniciada para todos los medios.")
             if self.enable_widgets_callback:
@@ -277,7 +287,7 @@ class BunkrDownloader:
     def descargar_perfil_bunkr(self, url_perfil):
         try:
             self.log(f"Iniciando descarga para el perfil: {url_perfil}")
-            response = self.session.get(url_perfil, headers=self.headers)
+            response = self.throttled_get(url_perfil)
             self.log(f"Código de estado de la respuesta: {response.status_code} para {url_perfil}")
             if response.status_code == 200:
                 soup = BeautifulSoup(response.text, 'html.parser')
@@ -310,7 +320,7 @@ class BunkrDownloader:
                         self.log(f"Processing media page URL: {image_page_url}")
 
                         # Visit the page to get the media URL
-                        image_response = self.session.get(image_page_url, headers=self.headers)
+                        image_response = self.throttled_get(image_page_url)
                         if image_response.status_code == 200:
                             image_soup = BeautifulSoup(image_response.text, 'html.parser')
 
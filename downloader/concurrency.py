@@ -0,0 +1,172 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value):
+    """Convierte la cabecera Retry-After (segundos o fecha HTTP) en segundos de espera."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class HostConcurrency:
+    """Estado del controlador para un host."""
+
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.ewma_latency = None
+        self.base_latency = None
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+
+
+class AIMDController:
+    """
+    Límite de transferencias simultáneas por host que se ajusta solo:
+    crece de forma aditiva (+increase por cada ventana completa de éxitos) y se
+    reduce multiplicativamente ante 429/503 o un pico de latencia. Si el servidor
+    envía Retry-After, el host queda en pausa hasta entonces.
+
+    Los hilos esperan en condition; el motor asyncio registra un listener que se
+    llama cada vez que puede haber un hueco nuevo (release o límite mayor).
+    """
+
+    BACKOFF_STATUS = (429, 503)
+
+    def __init__(self, initial=2, minimum=1, maximum=16, increase=1.0, decrease=0.5,
+                 latency_factor=3.0, min_spike_latency=0.5, ewma_alpha=0.2):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor  # Pico = latencia > base * factor
+        self.min_spike_latency = min_spike_latency  # Y además por encima de este mínimo absoluto
+        self.ewma_alpha = ewma_alpha
+        self.hosts = {}
+        self.condition = threading.Condition()
+        self.listeners = set()
+
+    def configure(self, initial=None, maximum=None):
+        """Ajusta los límites de un controlador compartido sin perder lo aprendido por host."""
+        with self.condition:
+            if initial is not None:
+                self.initial = initial
+            if maximum is not None:
+                self.maximum = maximum
+                for state in self.hosts.values():
+                    state.limit = min(state.limit, maximum)
+            self._notify()
+
+    def add_listener(self, callback):
+        """callback() se llama (con el lock tomado, debe ser rápido) cuando puede haber un hueco libre."""
+        with self.condition:
+            self.listeners.add(callback)
+
+    def remove_listener(self, callback):
+        with self.condition:
+            self.listeners.discard(callback)
+
+    def _notify(self):
+        self.condition.notify_all()
+        for callback in self.listeners:
+            callback()
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostConcurrency(min(max(self.initial, self.minimum), self.maximum))
+        return state
+
+    def _has_slot(self, state):
+        return state.in_flight < int(state.limit) and time.monotonic() >= state.blocked_until
+
+    def try_acquire(self, host):
+        """Toma un hueco si hay alguno libre, sin esperar."""
+        with self.condition:
+            state = self._state(host)
+            if not self._has_slot(state):
+                return False
+            state.in_flight += 1
+            return True
+
+    def acquire(self, host, cancel_event=None):
+        """Espera un hueco libre para el host. Devuelve False si se canceló mientras esperaba."""
+        with self.condition:
+            state = self._state(host)
+            while not self._has_slot(state):
+                if cancel_event is not None and cancel_event.is_set():
+                    return False
+                wait = max(0.05, state.blocked_until - time.monotonic())
+                self.condition.wait(timeout=min(wait, 0.5))
+            state.in_flight += 1
+            return True
+
+    def release(self, host):
+        with self.condition:
+            state = self._state(host)
+            state.in_flight = max(0, state.in_flight - 1)
+            self._notify()
+
+    def record(self, host, status=None, latency=None, retry_after=None):
+        """Registra el resultado de una petición al host y ajusta su límite."""
+        with self.condition:
+            state = self._state(host)
+            now = time.monotonic()
+
+            if status in self.BACKOFF_STATUS:
+                self._decrease(state, now)
+                if retry_after:
+                    state.blocked_until = max(state.blocked_until, now + retry_after)
+                return
+
+            if latency is not None:
+                if state.ewma_latency is None:
+                    state.ewma_latency = latency
+                else:
+                    state.ewma_latency += self.ewma_alpha * (latency - state.ewma_latency)
+                if state.base_latency is None or state.ewma_latency < state.base_latency:
+                    state.base_latency = state.ewma_latency
+                else:
+                    # La base sube despacio para seguir cambios reales de la red
+                    state.base_latency += 0.01 * (state.ewma_latency - state.base_latency)
+                if latency > max(state.base_latency * self.latency_factor, self.min_spike_latency):
+                    self._decrease(state, now)
+                    return
+
+            if status is None or status < 400:
+                # Aumento aditivo: +increase cuando se completa una ventana entera de éxitos
+                state.limit = min(self.maximum, state.limit + self.increase / max(state.limit, 1.0))
+                self._notify()
+
+    def _decrease(self, state, now):
+        # Como mucho un recorte por ventana de latencia, para no colapsar ante una ráfaga de errores
+        window = state.ewma_latency or 1.0
+        if now - state.last_decrease < window:
+            return
+        state.last_decrease = now
+        state.limit = max(self.minimum, state.limit * self.decrease)
+
+    def limit(self, host):
+        with self.condition:
+            return int(self._state(host).limit)
+
+    def blocked_for(self, host):
+        """Segundos que le quedan al host en pausa por Retry-After, o None si no está en pausa."""
+        with self.condition:
+            remaining = self._state(host).blocked_until - time.monotonic()
+            return remaining if remaining > 0 else None
+
+
+# Controlador del proceso, como bandwidth_limiter: los límites aprendidos por host
+# se conservan de una descarga a la siguiente en lugar de empezar de cero
+host_concurrency = AIMDController()
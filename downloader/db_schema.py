@@ -0,0 +1,207 @@
+import os
+import re
+import sqlite3
+from urllib.parse import urlparse
+
+FILE_TYPE_EXTENSIONS = {
+    'image': ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'),
+    'video': ('.mp4', '.mkv', '.webm', '.mov', '.avi', '.flv', '.wmv', '.m4v'),
+    'document': ('.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'),
+    'compressed': ('.zip', '.rar', '.7z', '.tar', '.gz'),
+}
+
+CONTENT_HASH_PATTERN = re.compile(r'/([0-9a-f]{64})(?:\.\w+)?$', re.I)
+
+# Nombre del archivo (sin carpetas) en SQL puro, para que los triggers funcionen en cualquier conexión:
+# rtrim quita del final todo lo que no sea / o \, y lo que queda es la carpeta
+FILE_NAME_SQL = "substr({path}, length(rtrim({path}, replace(replace({path}, '/', ''), '\\', ''))) + 1)"
+
+
+def file_type(file_path):
+    """Tipo de archivo (image, video, document, compressed u other) según la extensión."""
+    extension = os.path.splitext(file_path or '')[1].lower()
+    for kind, extensions in FILE_TYPE_EXTENSIONS.items():
+        if extension in extensions:
+            return kind
+    return 'other'
+
+
+def content_hash(media_url):
+    """Devuelve el sha256 que coomer/kemono usan como nombre del archivo, o None."""
+    match = CONTENT_HASH_PATTERN.search(urlparse(media_url or '').path)
+    return match.group(1).lower() if match else None
+
+
+def column_names(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [column[1] for column in cursor.fetchall()]
+
+
+def migration_1(cursor):
+    """Tabla downloads original."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS downloads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            media_url TEXT UNIQUE,
+            file_path TEXT,
+            file_size INTEGER,
+            user_id TEXT,
+            post_id TEXT,
+            downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def migration_2(cursor):
+    """sha256 del contenido para reutilizar archivos repetidos entre creadores."""
+    if 'content_hash' not in column_names(cursor, 'downloads'):
+        cursor.execute("ALTER TABLE downloads ADD COLUMN content_hash TEXT")
+    cursor.execute("UPDATE downloads SET content_hash = content_hash_of(media_url) WHERE content_hash IS NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_content_hash ON downloads (content_hash)")
+
+
+def migration_3(cursor):
+    """Marcas de sincronización incremental y cola persistente de tareas."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS creator_sync (
+            site TEXT,
+            service TEXT,
+            user_id TEXT,
+            last_post_id TEXT,
+            last_published TEXT,
+            synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (site, service, user_id)
+        )
+    """)
+    # pending -> in_progress -> done | failed
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            media_url TEXT UNIQUE,
+            user_id TEXT,
+            post_id TEXT,
+            post_title TEXT,
+            status TEXT DEFAULT 'pending',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+
+
+def migration_4(cursor):
+    """
+    Índices para borrar y agrupar por usuario / post y ordenar por fecha, y las
+    columnas post_title y file_type para buscar y filtrar el historial.
+    """
+    columns = column_names(cursor, 'downloads')
+    if 'post_title' not in columns:
+        cursor.execute("ALTER TABLE downloads ADD COLUMN post_title TEXT")
+    if 'file_type' not in columns:
+        cursor.execute("ALTER TABLE downloads ADD COLUMN file_type TEXT")
+    cursor.execute("UPDATE downloads SET file_type = file_type_of(file_path) WHERE file_type IS NULL")
+    cursor.execute("""
+        UPDATE downloads SET post_title = (SELECT jobs.post_title FROM jobs WHERE jobs.media_url = downloads.media_url)
+        WHERE post_title IS NULL
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_user_post ON downloads (user_id, post_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_post ON downloads (post_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_downloaded_at ON downloads (downloaded_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_creator_sync_user ON creator_sync (user_id)")
+
+
+def migration_5(cursor):
+    """
+    Índice de texto completo (FTS5) de nombres de archivo, títulos de post y
+    usuarios para la búsqueda del historial. La tabla FTS es de contenido externo
+    (la vista downloads_search), así que solo guarda el índice; los triggers la
+    mantienen al día. Si SQLite no tiene FTS5, la búsqueda usa LIKE. Además, un
+    índice por tipo para filtrar sin texto, de la más reciente a la más antigua.
+    """
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_downloads_file_type ON downloads (file_type, id)")
+    file_name = FILE_NAME_SQL.format(path='file_path')
+    cursor.execute(f"""
+        CREATE VIEW IF NOT EXISTS downloads_search AS
+        SELECT id, {file_name} AS file_name, post_title, user_id FROM downloads
+    """)
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS downloads_fts USING fts5(
+                file_name, post_title, user_id,
+                content='downloads_search', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError:
+        return  # SQLite compilado sin FTS5
+    old_values = f"'delete', old.id, {FILE_NAME_SQL.format(path='old.file_path')}, old.post_title, old.user_id"
+    new_values = f"new.id, {FILE_NAME_SQL.format(path='new.file_path')}, new.post_title, new.user_id"
+    columns = "downloads_fts, rowid, file_name, post_title, user_id"
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS downloads_fts_insert AFTER INSERT ON downloads BEGIN
+            INSERT INTO downloads_fts (rowid, file_name, post_title, user_id) VALUES ({new_values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS downloads_fts_delete AFTER DELETE ON downloads BEGIN
+            INSERT INTO downloads_fts ({columns}) VALUES ({old_values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS downloads_fts_update AFTER UPDATE OF file_path, post_title, user_id ON downloads BEGIN
+            INSERT INTO downloads_fts ({columns}) VALUES ({old_values});
+            INSERT INTO downloads_fts (rowid, file_name, post_title, user_id) VALUES ({new_values});
+        END
+    """)
+    cursor.execute("INSERT INTO downloads_fts (downloads_fts) VALUES ('rebuild')")
+
+
+def migration_6(cursor):
+    """Intentos fallidos de cada tarea de la cola, para retirar las que nunca terminan."""
+    if 'attempts' not in column_names(cursor, 'jobs'):
+        cursor.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0")
+
+
+def has_fts(connection):
+    """True si la base de datos tiene el índice de texto completo de la migración 5."""
+    row = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'downloads_fts'").fetchone()
+    return row is not None
+
+
+# MIGRATIONS[n - 1] lleva el esquema de la versión n - 1 a la n. Solo se añaden al final.
+MIGRATIONS = [migration_1, migration_2, migration_3, migration_4, migration_5, migration_6]
+
+# Versión del esquema de downloads.db, guardada en PRAGMA user_version
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(connection):
+    """
+    Actualiza la base de datos hasta SCHEMA_VERSION aplicando en orden las
+    migraciones pendientes, cada una en su propia transacción. Las bases de datos
+    anteriores a user_version (versión 0) ya pueden tener parte del esquema, por
+    eso las migraciones comprueban lo que existe antes de crearlo.
+    """
+    connection.create_function('content_hash_of', 1, content_hash)
+    connection.create_function('file_type_of', 1, file_type)
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None  # Transacciones explícitas: el DDL también queda dentro
+    cursor = connection.cursor()
+    try:
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        while version < SCHEMA_VERSION:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # Otro proceso puede haber migrado mientras se esperaba el lock
+                version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                if version < SCHEMA_VERSION:
+                    MIGRATIONS[version](cursor)
+                    version += 1
+                    cursor.execute(f"PRAGMA user_version = {version}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+    finally:
+        cursor.close()
+        connection.isolation_level = isolation_level
@@ -0,0 +1,163 @@
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+# Espera máxima de un flush al terminar: si el escritor se ha colgado no se bloquea el cierre
+SHUTDOWN_FLUSH_TIMEOUT = 10
+
+
+class DatabaseWriter:
+    """
+    Hilo escritor de downloads.db con commits agrupados. Los hilos de descarga
+    solo encolan sus sentencias (execute / executemany) y siguen; el escritor las
+    aplica por lotes en una sola transacción cada flush_interval segundos o cada
+    max_batch sentencias. Con journal_mode=WAL y synchronous=NORMAL, cada lote
+    cuesta un único fsync y los lectores (la pestaña de la base de datos en
+    ajustes, las consultas de la cola) no se bloquean mientras se escribe.
+
+    Hay un escritor por archivo de base de datos para todo el proceso
+    (for_path), compartido por todos los Downloader. Los errores de escritura van
+    a log_callback o, si no hay, al módulo logging.
+    """
+
+    writers = {}
+    writers_lock = threading.Lock()
+
+    def __init__(self, db_path, flush_interval=0.5, max_batch=500, log_callback=None):
+        self.db_path = db_path
+        self.log_callback = log_callback
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def for_path(cls, db_path, **kwargs):
+        """Devuelve el escritor del proceso para db_path, creándolo si hace falta."""
+        with cls.writers_lock:
+            writer = cls.writers.get(db_path)
+            # Un escritor cuyo hilo murió no confirmaría nada más: se sustituye
+            if writer is None or writer.closed or not writer.thread.is_alive():
+                writer = cls.writers[db_path] = cls(db_path, **kwargs)
+            return writer
+
+    @staticmethod
+    def configure_connection(connection, synchronous='NORMAL'):
+        """WAL para que lecturas y escrituras no se bloqueen; espera en vez de fallar si la DB está ocupada."""
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(f"PRAGMA synchronous={synchronous}")
+        connection.execute("PRAGMA busy_timeout=5000")
+
+    def execute(self, sql, params=()):
+        self.queue.put((sql, params, False))
+
+    def executemany(self, sql, seq_of_params):
+        self.queue.put((sql, list(seq_of_params), True))
+
+    def log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
+        else:
+            logging.getLogger(__name__).error(message)
+
+    def flush(self, timeout=None):
+        """
+        Espera a que todo lo encolado hasta ahora esté confirmado en la base de datos.
+        Devuelve False si no se pudo confirmar: se agotó timeout o el hilo escritor
+        ya no existe (en ese caso no se espera para siempre).
+        """
+        if self.closed or threading.current_thread() is self.thread:
+            return True
+        if not self.thread.is_alive():
+            self.log(f"Database writer for {self.db_path} is not running; pending writes were lost")
+            return False
+        done = threading.Event()
+        self.queue.put(done)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Se espera por tramos para notar si el hilo muere mientras tanto
+        while True:
+            wait = 0.5 if deadline is None else min(0.5, deadline - time.monotonic())
+            if wait <= 0:
+                self.log(f"Timed out waiting for pending writes to {self.db_path}")
+                return False
+            if done.wait(wait):
+                return True
+            if not self.thread.is_alive():
+                self.log(f"Database writer for {self.db_path} stopped; pending writes were lost")
+                return False
+
+    def close(self, timeout=SHUTDOWN_FLUSH_TIMEOUT):
+        if self.closed:
+            return
+        self.flush(timeout)
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+    def _run(self):
+        connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.configure_connection(connection)
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            batch = []
+            waiters = []
+            deadline = time.monotonic() + self.flush_interval
+            # Se agrupa todo lo que llegue hasta el intervalo, el tamaño máximo o un flush()
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._commit(connection, batch)
+            for waiter in waiters:
+                waiter.set()
+        connection.close()
+
+    def _commit(self, connection, batch):
+        try:
+            with connection:  # Una transacción por lote
+                for sql, params, many in batch:
+                    if many:
+                        connection.executemany(sql, params)
+                    else:
+                        connection.execute(sql, params)
+        except sqlite3.Error as e:
+            # Si falla el lote se reintenta sentencia a sentencia para no perder las demás
+            self.log(f"Database batch write failed, retrying one by one: {e}")
+            for sql, params, many in batch:
+                try:
+                    with connection:
+                        if many:
+                            connection.executemany(sql, params)
+                        else:
+                            connection.execute(sql, params)
+                except sqlite3.Error as error:
+                    self.log(f"Database write failed: {error}")
+
+
+@atexit.register
+def close_writers(timeout=SHUTDOWN_FLUSH_TIMEOUT):
+    # Confirma lo pendiente antes de salir (el hilo escritor es daemon), con una espera acotada
+    with DatabaseWriter.writers_lock:
+        writers = list(DatabaseWriter.writers.values())
+    for writer in writers:
+        writer.close(timeout)
@@ -1,21 +1,54 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Semaphore
+from threading import BoundedSemaphore, Semaphore
 from urllib.parse import quote_plus, urlencode, urljoin, urlparse
 import os
 import re
 import requests
+import shutil
 import threading
 import time
 import sqlite3
 
+from downloader.concurrency import host_concurrency, parse_retry_after
+from downloader.db_schema import content_hash, file_type, migrate
+from downloader.db_writer import SHUTDOWN_FLUSH_TIMEOUT, DatabaseWriter
+from downloader.partial_download import PartialDownload, url_digest
+from downloader.rate_limiter import ENDPOINT_API, ThrottlePolicies, bandwidth_limiter, classify_endpoint
+from downloader.scheduler import auxiliary_executor, run_with_helpers
+from downloader.subdomain_cache import SubdomainCache
+from downloader.transfer_stats import session_stats
+from downloader.url_index import UrlIndex
+
+# Orden de descarga de las tareas de cada página según su tamaño (ver order_tasks)
+TASK_ORDERS = ('none', 'small_first', 'large_first', 'interleaved')
+
+# Posts por página de /api/v1/.../user/...: una página más corta es la última
+API_PAGE_SIZE = 50
+
+# Una tarea fallida se retira de la cola tras tantos intentos o tras tantos días sin terminar
+MAX_JOB_ATTEMPTS = 5
+FAILED_JOB_EXPIRY_DAYS = 30
+
+
 class Downloader:
+    # Bases de datos cuya cola ya se recuperó en este proceso (ver recover_jobs)
+    recovered_db_paths = set()
+    recovered_db_paths_lock = threading.Lock()
+
     def __init__(self, download_folder, max_workers=5, log_callback=None, 
                  enable_widgets_callback=None, update_progress_callback=None, 
                  update_global_progress_callback=None, headers=None,
                  max_retries=3, retry_interval=2.0,
                  download_images=True, download_videos=True, download_compressed=True, 
-                 tr=None, folder_structure='default', rate_limit_interval=2.0):
+                 tr=None, folder_structure='default', rate_limit_interval=2.0,
+                 rate_limit_per_second=None, rate_limit_burst=2, throttle_policies=None,
+                 adaptive_concurrency=False, adaptive_max_concurrency=16,
+                 subdomain_cache_ttl_hours=24, api_page_window=4,
+                 download_engine='threads', async_max_concurrency=100,
+                 segment_count=1, segment_threshold_mb=100, incremental_sync=False,
+                 content_dedup=True, executor=None, throttle=None, concurrency_controller=None,
+                 task_order='none', head_prefetch_workers=8, partial_max_age_days=7):
         
         self.download_folder = download_folder
         self.log_callback = log_callback
@@ -30,12 +63,28 @@ class Downloader:
         self.media_counter = 0
         self.session = requests.Session()
         self.max_workers = max_workers  # Número máximo de hilos concurrentes
-        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.concurrency = concurrency_controller
+        if adaptive_concurrency and concurrency_controller is None:
+            # AIMD por host del proceso: max_workers es el punto de partida de los hosts nuevos
+            # y el pool admite hasta adaptive_max_concurrency
+            self.concurrency = host_concurrency
+            self.concurrency.configure(initial=max_workers, maximum=adaptive_max_concurrency)
+            self.max_workers = max(max_workers, adaptive_max_concurrency)
+        # Con DownloadScheduler el executor, los token buckets y el AIMD son compartidos entre descargadores
+        self.executor = executor or ThreadPoolExecutor(max_workers=self.max_workers)
+        self.shared_executor = executor is not None
         self.rate_limit = Semaphore(self.max_workers)  # Limita el número de peticiones concurrentes
-        self.domain_locks = defaultdict(lambda: Semaphore(2))
-        self.domain_last_request = defaultdict(float)  # Última solicitud por dominio
         self.rate_limit_interval = rate_limit_interval
+        if rate_limit_per_second is None:
+            rate_limit_per_second = 1.0 / rate_limit_interval if rate_limit_interval > 0 else 0
+        # Token bucket y peticiones simultáneas por dominio, separados por clase de endpoint
+        # (API, CDN, HTML). Las clases sin política propia usan rate_limit_per_second/burst.
+        self.throttle = throttle or ThrottlePolicies(throttle_policies, rate_limit_per_second, rate_limit_burst)
         self.download_mode = "multi"  # Modo de descarga: 'multi' para concurrente, 'queue' para secuencial
+        self.download_engine = download_engine  # 'threads' (ThreadPoolExecutor) o 'async' (asyncio + aiohttp)
+        self.async_max_concurrency = async_max_concurrency  # Transferencias simultáneas en el motor asyncio
+        self.segment_count = segment_count  # Conexiones por archivo grande (1 = sin segmentar)
+        self.segment_threshold_mb = segment_threshold_mb  # Tamaño mínimo para segmentar
         self.video_extensions = ('.mp4', '.mkv', '.webm', '.mov', '.avi', '.flv', '.wmv', '.m4v')
         self.image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff')
         self.document_extensions = ('.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx')
@@ -43,12 +92,11 @@ class Downloader:
         self.download_images = download_images
         self.download_videos = download_videos
         self.download_compressed = download_compressed
-        self.futures = []  # Lista para almacenar los objetos Future de tareas concurrentes
+        self.futures = set()  # Futures de las tareas concurrentes que siguen pendientes
         self.total_files = 0
         self.completed_files = 0
         self.skipped_files = []  
         self.failed_files = []
-        self.start_time = None
         self.tr = tr
         self.shutdown_called = False  # Para evitar múltiples cierres del executor
         self.folder_structure = folder_structure
@@ -57,8 +105,18 @@ class Downloader:
         self.retry_interval = retry_interval
         self.file_lock = threading.Lock()
         self.post_attachment_counter = defaultdict(int)
-        self.subdomain_cache = {}
+        # Subdominio que sirve cada prefijo de hash, persistido entre sesiones
+        self.subdomain_cache = SubdomainCache(ttl=subdomain_cache_ttl_hours * 3600)
         self.subdomain_locks = defaultdict(threading.Lock)
+        self.api_page_window = api_page_window  # Páginas de la API pedidas en paralelo
+        self.incremental_sync = incremental_sync  # Parar la paginación en el último post ya sincronizado
+        self.content_dedup = content_dedup  # Reutilizar archivos ya descargados con el mismo sha256
+        self.task_order = task_order if task_order in TASK_ORDERS else 'none'  # Orden de las tareas de cada página
+        self.head_prefetch_workers = head_prefetch_workers  # HEAD simultáneos al planificar
+        self.known_sizes = {}  # { media_url: tamaño } obtenido con HEAD al planificar
+        self.pagination_failed = False  # La última paginación se cortó por una página fallida
+        self.partial_max_age_days = partial_max_age_days  # Antigüedad a partir de la que se borra un .tmp (0 = nunca)
+        self.pruned_folders = set()  # Carpetas ya limpiadas de .tmp abandonados en esta sesión
 
         
         # ----- NUEVA SECCIÓN: INICIALIZACIÓN DE LA BASE DE DATOS -----
@@ -67,33 +125,183 @@ class Downloader:
         self.db_path = os.path.join(db_folder, "downloads.db")
         self.db_lock = threading.Lock()  # Lock para operaciones en la DB
         self.init_db()
-        self.load_download_cache()
+        self.load_url_index()
+        self.recover_jobs()
         # --------------------------------------------------------------
 
     def init_db(self):
-        """Inicializa (o crea si no existe) la base de datos para registrar los archivos descargados."""
+        """Abre (o crea) la base de datos de descargas y la migra a la última versión del esquema."""
         self.db_connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        DatabaseWriter.configure_connection(self.db_connection)
         self.db_cursor = self.db_connection.cursor()
-        self.db_cursor.execute("""
-            CREATE TABLE IF NOT EXISTS downloads (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                media_url TEXT UNIQUE,
-                file_path TEXT,
-                file_size INTEGER,
-                user_id TEXT,
-                post_id TEXT,
-                downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        migrate(self.db_connection)
+        # Las escrituras de las descargas pasan por el hilo escritor (commits agrupados);
+        # esta conexión queda para las lecturas
+        self.db_writer = DatabaseWriter.for_path(self.db_path, log_callback=self.log_callback)
+
+    def load_url_index(self):
+        """Obtiene el índice de URLs descargadas del proceso (se carga de la DB solo la primera vez)."""
+        self.db_writer.flush()  # Incluir lo que otros Downloader del proceso aún tienen en cola
+        self.url_index = UrlIndex.for_path(self.db_path)
+
+    def find_download(self, media_url):
+        """(file_path, file_size) si media_url ya está descargada, o None."""
+        if not self.url_index.contains(media_url):
+            return None
+        # Acierto probable del índice: se confirma en la DB (índice UNIQUE de media_url)
+        return self.query_download("SELECT file_path, file_size FROM downloads WHERE media_url = ?", (media_url,))
+
+    def find_content(self, content_hash):
+        """(file_path, file_size) del último archivo descargado con ese sha256, o None."""
+        if not self.url_index.contains_content(content_hash):
+            return None
+        return self.query_download(
+            "SELECT file_path, file_size FROM downloads WHERE content_hash = ? ORDER BY id DESC LIMIT 1",
+            (content_hash,)
+        )
+
+    def query_download(self, sql, params):
+        """
+        Fila (file_path, file_size) de un acierto del índice. Si no aparece puede ser
+        que el hilo escritor aún no la haya confirmado: se espera a la cola y se
+        repite la consulta una vez; si sigue sin estar, era un falso positivo.
+        """
+        for attempt in range(2):
+            if attempt:
+                self.db_writer.flush()
+            with self.db_lock:
+                self.db_cursor.execute(sql, params)
+                row = self.db_cursor.fetchone()
+            if row is not None:
+                return row
+        return None
+
+    @staticmethod
+    def content_hash(media_url):
+        """Devuelve el sha256 que coomer/kemono usan como nombre del archivo, o None."""
+        return content_hash(media_url)
+
+    def recover_jobs(self):
+        """
+        Al arrancar el proceso, devuelve a 'pending' las tareas que quedaron a
+        medias, purga las terminadas y retira las fallidas que ya agotaron sus
+        intentos o llevan demasiado tiempo en la cola. Solo la primera vez por
+        proceso: los Downloader que se crean después (p. ej. en una descarga por
+        lotes) no deben tocar las tareas que otro está procesando.
+        """
+        with self.recovered_db_paths_lock:
+            if self.db_path in self.recovered_db_paths:
+                return
+            self.recovered_db_paths.add(self.db_path)
+        self.db_writer.flush()
+        with self.db_lock:
+            self.db_cursor.execute("UPDATE jobs SET status = 'pending' WHERE status = 'in_progress'")
+            self.db_cursor.execute("DELETE FROM jobs WHERE status = 'done'")
+            self.db_cursor.execute(
+                "DELETE FROM jobs WHERE status = 'failed' AND (attempts >= ? OR updated_at < datetime('now', ?))",
+                (MAX_JOB_ATTEMPTS, f'-{FAILED_JOB_EXPIRY_DAYS} days')
+            )
+            self.db_connection.commit()
+
+    def enqueue_jobs(self, tasks):
+        """Registra las tareas (media_url, user_id, post_id, title) como pendientes."""
+        self.db_writer.executemany(
+            """INSERT INTO jobs (media_url, user_id, post_id, post_title, status)
+            VALUES (?, ?, ?, ?, 'pending')
+            ON CONFLICT(media_url) DO UPDATE SET
+                user_id = excluded.user_id, post_id = excluded.post_id, post_title = excluded.post_title,
+                status = 'pending', updated_at = CURRENT_TIMESTAMP
+            WHERE jobs.status != 'in_progress'""",
+            [(media_url, user_id, str(post_id), title) for media_url, user_id, post_id, title in tasks]
+        )
+
+    def set_job_status(self, media_url, status):
+        self.db_writer.execute(
+            "UPDATE jobs SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE media_url = ?",
+            (status, media_url)
+        )
+
+    def finish_job(self, media_url):
+        """Cierra la tarea según el resultado: done, pending si se canceló, o failed."""
+        # Basta con el índice: lo registrado en esta sesión está en él con seguridad
+        if self.url_index.contains(media_url):
+            status = 'done'
+        elif self.cancel_requested.is_set():
+            status = 'pending'
+        else:
+            status = 'failed'
+        if status != 'done':
+            session_stats.discard(media_url)  # Su tamaño ya no cuenta para el ETA de la sesión
+        if status == 'failed':
+            self.db_writer.execute(
+                """UPDATE jobs SET status = 'failed', attempts = COALESCE(attempts, 0) + 1,
+                updated_at = CURRENT_TIMESTAMP WHERE media_url = ?""",
+                (media_url,)
             )
-        """)
-        self.db_connection.commit()
+            return
+        self.set_job_status(media_url, status)
 
-    def load_download_cache(self):
-        """Carga todos los registros de la DB en un diccionario para búsquedas rápidas."""
+    def get_job(self, media_url):
+        """Devuelve (user_id, post_id, post_title) de la tarea o None si no está en la cola."""
+        self.db_writer.flush()
         with self.db_lock:
-            self.db_cursor.execute("SELECT media_url, file_path, file_size FROM downloads")
-            rows = self.db_cursor.fetchall()
-        # La cache se estructura como: { media_url: (file_path, file_size), ... }
-        self.download_cache = {row[0]: (row[1], row[2]) for row in rows}
+            self.db_cursor.execute("SELECT user_id, post_id, post_title FROM jobs WHERE media_url = ?", (media_url,))
+            return self.db_cursor.fetchone()
+
+    def count_unfinished_jobs(self):
+        self.db_writer.flush()
+        with self.db_lock:
+            self.db_cursor.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'failed')")
+            return self.db_cursor.fetchone()[0]
+
+    def iter_unfinished_jobs(self, batch_size=500):
+        """Genera las tareas pendientes o fallidas de la cola por lotes, sin cargarla entera."""
+        last_id = 0
+        self.db_writer.flush()
+        while not self.cancel_requested.is_set():
+            with self.db_lock:
+                self.db_cursor.execute(
+                    """SELECT id, media_url, user_id, post_id, post_title FROM jobs
+                    WHERE status IN ('pending', 'failed') AND id > ? ORDER BY id LIMIT ?""",
+                    (last_id, batch_size)
+                )
+                rows = self.db_cursor.fetchall()
+            if not rows:
+                return
+            for job_id, media_url, user_id, post_id, title in rows:
+                last_id = job_id
+                # Los ajustes pueden haber cambiado desde que se planificó la tarea
+                if not self.is_extension_enabled(os.path.splitext(media_url)[1].lower()):
+                    continue
+                self.total_files += 1
+                if self.update_global_progress_callback:
+                    self.update_global_progress_callback(self.completed_files, self.total_files)
+                yield media_url, user_id, post_id, title or ""
+
+    def get_sync_mark(self, site, service, user_id):
+        """Devuelve la marca (published, post_id) del último post sincronizado del creador, o None."""
+        self.db_writer.flush()
+        with self.db_lock:
+            self.db_cursor.execute(
+                "SELECT last_published, last_post_id FROM creator_sync WHERE site = ? AND service = ? AND user_id = ?",
+                (site, service, user_id)
+            )
+            row = self.db_cursor.fetchone()
+        return self.sync_key({'published': row[0], 'id': row[1]}) if row else None
+
+    def save_sync_mark(self, site, service, user_id, post):
+        self.db_writer.execute(
+            """INSERT OR REPLACE INTO creator_sync (site, service, user_id, last_post_id, last_published, synced_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)""",
+            (site, service, user_id, str(post.get('id')), post.get('published') or post.get('added') or '')
+        )
+
+    @staticmethod
+    def sync_key(post):
+        """Clave de orden de un post: fecha de publicación ISO y, para desempatar, su id numérico."""
+        post_id = str(post.get('id') or '')
+        return (post.get('published') or post.get('added') or '',
+                int(post_id) if post_id.isdigit() else 0)
 
 
     def log(self, message):
@@ -110,6 +318,10 @@ class Downloader:
             max_workers = 1  # Forzar a 1 hilo en modo cola
         
         self.download_mode = mode
+        if self.shared_executor:
+            # El executor es del DownloadScheduler: sus hilos y su sublímite no se tocan desde aquí
+            self.log(f"Updated download mode to {mode}; the scheduler keeps its own worker limit")
+            return
         self.max_workers = max_workers
 
         # Cerrar el executor anterior
@@ -129,7 +341,7 @@ class Downloader:
     def request_cancel(self):
         self.cancel_requested.set()
         self.log(self.tr("Download cancellation requested."))
-        for future in self.futures:
+        for future in list(self.futures):
             future.cancel()
 
     def shutdown_executor(self):
@@ -137,133 +349,271 @@ class Downloader:
             self.shutdown_called = True
             if self.executor:
                 self.executor.shutdown(wait=True)
+            # Que la pestaña de la base de datos vea ya todo lo descargado, sin colgarse si el escritor murió
+            self.db_writer.flush(timeout=SHUTDOWN_FLUSH_TIMEOUT)
             if self.enable_widgets_callback:
                 self.enable_widgets_callback()
             self.log(self.tr("All downloads completed or cancelled."))
 
-    def safe_request(self, url, max_retries=None):
+    def safe_request(self, url, max_retries=None, endpoint_class=None, headers=None):
         if max_retries is None:
             max_retries = self.max_retries
-
+        request_headers = {**self.headers, **headers} if headers else self.headers
+
+        original_url = url
+        if "coomer.su" in url:
+            # Si ya se conoce el subdominio que sirve este prefijo, se evita el 403 inicial
+            cached_host = self.subdomain_cache.get(url)
+            if cached_host:
+                url = SubdomainCache.apply(url, cached_host)
         domain = urlparse(url).netloc
-        path = urlparse(url).path
+        # El hueco del AIMD se toma con el host de la URL original: la respuesta se anota con el mismo
+        feedback_host = urlparse(original_url).netloc
+        endpoint_class = endpoint_class or classify_endpoint(url)
         retry_wait = 1
 
         for attempt in range(max_retries):
             if self.cancel_requested.is_set():
                 return None
 
-            with self.domain_locks[domain]:
-                elapsed_time = time.time() - self.domain_last_request[domain]
-                if elapsed_time < self.rate_limit_interval:
-                    time.sleep(self.rate_limit_interval - elapsed_time)
-
-                try:
-                    response = self.session.get(url, stream=True, headers=self.headers)
-                    if response.status_code == 403 and "coomer.su" in url:
-                        self.log(self.tr("403_warning"))
-
-                        # Intentar subdominios (una sola vez protegida por lock)
-                        with self.subdomain_locks[path]:
-                            if path in self.subdomain_cache:
-                                alt_url = self.subdomain_cache[path]
-                            else:
-                                alt_url = self._find_valid_subdomain(url)
-                                self.subdomain_cache[path] = alt_url
-
-                        if alt_url != url:
-                            response = self.session.get(alt_url, stream=True, headers=self.headers)
-                            response.raise_for_status()
-                            return response
-                        else:
-                            self.log("❌ Ningún subdominio válido. Abortando.")
-                            return None
-
-                    response.raise_for_status()
-                    return response
+            # Reservar turno en el token bucket del host; la espera ocurre sin tener ningún lock
+            self.throttle.acquire(endpoint_class, domain, cancel_event=self.cancel_requested)
+            if self.cancel_requested.is_set():
+                return None
 
-                except requests.exceptions.RequestException as e:
-                    status_code = getattr(e.response, 'status_code', None)
-                    if status_code in (429, 500, 502, 503, 504):
-                        self.log(self.tr("Intento {attempt}/{max_retries}: Error {status_code} - Reintentando...").format(
-                            attempt=attempt + 1, max_retries=max_retries, status_code=status_code))
-                        time.sleep(retry_wait)
-                        retry_wait *= 2
+            try:
+                with self.throttle.slot(endpoint_class, domain):
+                    request_start = time.monotonic()
+                    response = self.session.get(url, stream=True, headers=request_headers)
+                self.record_host_feedback(feedback_host, response.status_code, response.headers, request_start)
+                if response.status_code == 403 and "coomer.su" in url:
+                    self.log(self.tr("403_warning"))
+                    response.close()
+                    if url != original_url:
+                        # El subdominio guardado ya no sirve este prefijo
+                        self.subdomain_cache.invalidate(original_url)
+
+                    alt_url = self.resolve_subdomain(original_url)
+                    if alt_url != url and alt_url != original_url:
+                        request_start = time.monotonic()
+                        response = self.session.get(alt_url, stream=True, headers=request_headers)
+                        self.record_host_feedback(feedback_host, response.status_code, response.headers, request_start)
+                        response.raise_for_status()
+                        return response
                     else:
-                        url_display = getattr(e.request, 'url', url)
-                        if len(url_display) > 60:
-                            url_display = url_display[:60] + "..."
-                        self.log(self.tr("Intento {attempt}/{max_retries}: Error al acceder a {url} - {error}").format(
-                            attempt=attempt + 1, max_retries=max_retries, url=url_display, error=e))
-                        if attempt < max_retries - 1:
-                            time.sleep(self.retry_interval)
+                        self.log("❌ Ningún subdominio válido. Abortando.")
+                        return None
+
+                response.raise_for_status()
+                return response
+
+            except requests.exceptions.RequestException as e:
+                status_code = getattr(e.response, 'status_code', None)
+                if status_code in (429, 500, 502, 503, 504):
+                    self.log(self.tr("Intento {attempt}/{max_retries}: Error {status_code} - Reintentando...").format(
+                        attempt=attempt + 1, max_retries=max_retries, status_code=status_code))
+                    # Si el servidor indica Retry-After se respeta en lugar del back-off exponencial
+                    retry_after = parse_retry_after(e.response.headers.get('Retry-After'))
+                    self.cancel_requested.wait(retry_after if retry_after is not None else retry_wait)
+                    retry_wait *= 2
+                else:
+                    url_display = getattr(e.request, 'url', url)
+                    if len(url_display) > 60:
+                        url_display = url_display[:60] + "..."
+                    self.log(self.tr("Intento {attempt}/{max_retries}: Error al acceder a {url} - {error}").format(
+                        attempt=attempt + 1, max_retries=max_retries, url=url_display, error=e))
+                    if attempt < max_retries - 1:
+                        self.cancel_requested.wait(self.retry_interval)
 
         return None
 
+    def record_host_feedback(self, host, status, headers, request_start):
+        """Pasa al controlador AIMD el resultado de una petición al host con el que se tomó el hueco."""
+        if self.concurrency is not None:
+            self.concurrency.record(host, status=status, latency=time.monotonic() - request_start,
+                                    retry_after=parse_retry_after(headers.get('Retry-After')))
+
+    def api_get(self, api_url):
+        """
+        GET a la API respetando la política de throttling de la clase 'api'. Los
+        429/5xx y los errores de conexión se reintentan como en safe_request: con
+        back-off exponencial o lo que indique Retry-After, y cada reintento vuelve a
+        pasar por el token bucket de la API. Devuelve la última respuesta.
+        """
+        domain = urlparse(api_url).netloc
+        max_retries = max(1, self.max_retries)
+        retry_wait = 1
+        for attempt in range(max_retries):
+            self.throttle.acquire(ENDPOINT_API, domain, cancel_event=self.cancel_requested)
+            last_attempt = attempt == max_retries - 1 or self.cancel_requested.is_set()
+            try:
+                with self.throttle.slot(ENDPOINT_API, domain):
+                    response = self.session.get(api_url, headers=self.headers)
+            except requests.exceptions.RequestException as e:
+                if last_attempt:
+                    raise
+                self.log(self.tr("Intento {attempt}/{max_retries}: Error al acceder a {url} - {error}").format(
+                    attempt=attempt + 1, max_retries=max_retries, url=api_url, error=e))
+                retry_after = None
+            else:
+                if response.status_code not in (429, 500, 502, 503, 504) or last_attempt:
+                    return response
+                self.log(self.tr("Intento {attempt}/{max_retries}: Error {status_code} - Reintentando...").format(
+                    attempt=attempt + 1, max_retries=max_retries, status_code=response.status_code))
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                response.close()
+            self.cancel_requested.wait(retry_after if retry_after is not None else retry_wait)
+            retry_wait *= 2
+
+    def resolve_subdomain(self, url):
+        """
+        Devuelve `url` reescrita al subdominio que sirve su prefijo de hash, usando la
+        caché en disco o sondeando los candidatos en paralelo. Devuelve `url` si ninguno sirve.
+        """
+        cached_host = self.subdomain_cache.get(url)
+        if cached_host:
+            return SubdomainCache.apply(url, cached_host)
+        # Un solo sondeo por prefijo aunque varios hilos reciban 403 a la vez
+        with self.subdomain_locks[SubdomainCache.key(url)]:
+            cached_host = self.subdomain_cache.get(url)
+            if cached_host:
+                return SubdomainCache.apply(url, cached_host)
+            alt_url = self._find_valid_subdomain(url)
+            if alt_url != url:
+                self.subdomain_cache.set(url, urlparse(alt_url).netloc)
+            return alt_url
+
     def _find_valid_subdomain(self, url, max_subdomains=10):
         parsed = urlparse(url)
-        original_domain = parsed.netloc
         original_path = parsed.path
         path = f"/data{original_path}" if not original_path.startswith("/data/") else original_path
-
-        for i in range(1, max_subdomains + 1):
-            new_domain = f"n{i}.coomer.su"
-            new_url = parsed._replace(netloc=new_domain, path=path).geturl()
+        candidates = [parsed._replace(netloc=f"n{i}.coomer.su", path=path).geturl()
+                      for i in range(1, max_subdomains + 1)]
+        found = threading.Event()
+
+        def probe(new_url):
+            new_domain = urlparse(new_url).netloc
+            endpoint_class = classify_endpoint(new_url)
+            self.throttle.acquire(endpoint_class, new_domain, cancel_event=self.cancel_requested)
+            if found.is_set() or self.cancel_requested.is_set():
+                return None
             try:
                 self.log(self.tr("subdomain_test").format(domain=new_domain))
-                resp = self.session.get(new_url, headers=self.headers, timeout=15, stream=True)
+                with self.throttle.slot(endpoint_class, new_domain):
+                    resp = self.session.get(new_url, headers=self.headers, timeout=15, stream=True)
+                resp.close()
                 if resp.status_code == 200:
-                    self.log(f"✅ Subdominio funcional encontrado: {new_domain}")
-                    return new_url
-                else:
-                    self.log(self.tr("subdomain_invalid").format(domain=new_domain))
+                    return 'ok'
+                self.log(self.tr("subdomain_invalid").format(domain=new_domain))
             except requests.exceptions.ReadTimeout:
                 self.log(self.tr("subdomain_timeout").format(domain=new_domain))
-                return new_url
+                return 'timeout'
             except Exception as e:
                 self.log(self.tr("subdomain_error").format(domain=new_domain, error=e))
-        return url
+            return None
 
-    def fetch_user_posts(self, site, user_id, service, query=None, specific_post_id=None, initial_offset=0, log_fetching=True):
-        all_posts = []
-        offset = initial_offset
+        # Los candidatos en paralelo por el carril auxiliar: los hilos del pool de descargas pueden
+        # estar todos esperando este mismo sondeo en subdomain_locks. Gana el primero que responda 200
+        timed_out_url = None
+        probes = run_with_helpers(auxiliary_executor, probe, candidates)
+        try:
+            for candidate, result in probes:
+                if result == 'ok':
+                    found.set()
+                    self.log(f"✅ Subdominio funcional encontrado: {urlparse(candidate).netloc}")
+                    return candidate
+                if result == 'timeout' and timed_out_url is None:
+                    timed_out_url = candidate
+        finally:
+            probes.close()
+        # Como antes, un timeout de lectura se toma como subdominio probablemente válido
+        return timed_out_url or url
+
+    def fetch_posts_page(self, site, user_id, service, offset, query=None, log_fetching=True):
+        """Descarga una página de posts de la API. Devuelve la lista (vacía al final) o None si falla."""
         user_id_encoded = quote_plus(user_id)
-        while True:
-            if self.cancel_requested.is_set():
-                return all_posts
-
-            api_url = f"https://{site}/api/v1/{service}/user/{user_id_encoded}"
-            url_query = {"o": offset}
-            if query is not None:
-                url_query["q"] = query
-            api_url += "?" + urlencode(url_query)
-            if log_fetching:
-                self.log(self.tr("Fetching user posts from {api_url}", api_url=api_url))
+        api_url = f"https://{site}/api/v1/{service}/user/{user_id_encoded}"
+        url_query = {"o": offset}
+        if query is not None:
+            url_query["q"] = query
+        api_url += "?" + urlencode(url_query)
+        if log_fetching:
+            self.log(self.tr("Fetching user posts from {api_url}", api_url=api_url))
+        try:
+            # Para la llamada a la API no usamos stream
+            response = self.api_get(api_url)
+            response.raise_for_status()
             try:
-                # Para la llamada a la API no usamos stream
-                response = self.session.get(api_url, headers=self.headers)
-                response.raise_for_status()
-                try:
-                    posts_data = response.json()
-                except ValueError as e:
-                    self.log(self.tr("Error al parsear JSON: {e}", e=e))
-                    break
-                # Si la respuesta es un diccionario y tiene la clave 'data', se usa esa lista
-                if isinstance(posts_data, dict) and 'data' in posts_data:
-                    posts = posts_data['data']
-                else:
-                    posts = posts_data
+                posts_data = response.json()
+            except ValueError as e:
+                self.log(self.tr("Error al parsear JSON: {e}", e=e))
+                return None
+            # Si la respuesta es un diccionario y tiene la clave 'data', se usa esa lista
+            if isinstance(posts_data, dict) and 'data' in posts_data:
+                return posts_data['data']
+            return posts_data
+        except Exception as e:
+            self.log(self.tr("Error fetching user posts: {e}", e=e))
+            return None
+
+    def iter_user_post_pages(self, site, user_id, service, query=None, initial_offset=0, log_fetching=True,
+                             sync_mark=None):
+        """
+        Genera las páginas de posts en orden de offset. Mantiene hasta api_page_window
+        páginas en vuelo (sujetas a la política de throttling de la API) y se detiene
+        en la primera página vacía, corta (la última) o fallida; las peticiones
+        posteriores se descartan.
+        Una página fallida no es el final del perfil: deja pagination_failed a True.
+        Las páginas se piden al executor de las descargas, así cuentan contra el
+        presupuesto global y el sublímite del sitio. Con sync_mark se empieza con una
+        sola página en vuelo y la ventana solo se abre si la página entera es más
+        nueva que la marca: un perfil sin novedades cuesta una petición.
+        """
+        self.pagination_failed = False
+        full_window = max(1, self.api_page_window)
+        window = 1 if sync_mark is not None else full_window
+        pending = deque()
+        next_offset = initial_offset
+
+        def submit_next():
+            nonlocal next_offset
+            pending.append(self.executor.submit(self.fetch_posts_page, site, user_id, service,
+                                                next_offset, query, log_fetching))
+            next_offset += API_PAGE_SIZE
+
+        try:
+            for _ in range(window):
+                submit_next()
+            while pending:
+                if self.cancel_requested.is_set():
+                    return
+                posts = pending.popleft().result()
+                if posts is None:
+                    self.pagination_failed = True
+                    self.log(self.tr("Could not fetch every page of posts; the listing is incomplete."))
+                    return
                 if not posts:
-                    break
-                if specific_post_id:
-                    post = next((p for p in posts if p['id'] == specific_post_id), None)
-                    if post:
-                        return [post]
-                all_posts.extend(posts)
-                offset += 50
-            except Exception as e:
-                self.log(self.tr("Error fetching user posts: {e}", e=e))
-                break
+                    return
+                yield posts
+                if len(posts) < API_PAGE_SIZE:
+                    return  # Página corta: era la última, no se piden más offsets
+                if window < full_window and all(self.sync_key(post) > sync_mark for post in posts):
+                    window = full_window
+                while len(pending) < window:
+                    submit_next()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def fetch_user_posts(self, site, user_id, service, query=None, specific_post_id=None, initial_offset=0, log_fetching=True):
+        all_posts = []
+        for posts in self.iter_user_post_pages(site, user_id, service, query=query,
+                                               initial_offset=initial_offset, log_fetching=log_fetching):
+            if specific_post_id:
+                post = next((p for p in posts if p['id'] == specific_post_id), None)
+                if post:
+                    return [post]
+            all_posts.extend(posts)
         if specific_post_id:
             return [post for post in all_posts if post['id'] == specific_post_id]
         return all_posts
@@ -294,7 +644,8 @@ class Downloader:
             if not sanitized_post:
                 # Fallback to using post ID if available, or default to "post"
                 sanitized_post = f"post_{post_id}" if post_id else "post"
-            short_hash = f"{hash(media_url) & 0xFFFF:04x}"
+            # hash() de str cambia en cada proceso: el nombre debe ser el mismo en todas las sesiones
+            short_hash = url_digest(media_url)[:4]
             final_name = f"{sanitized_post}_{attachment_index}_{short_hash}{extension}"
         elif mode == 2:
             # Use post name and post ID
@@ -343,18 +694,16 @@ class Downloader:
             media_folder = os.path.join(self.download_folder, user_id, folder_name)
         return media_folder
 
-    def process_media_element(self, media_url, user_id, post_id=None,
-                          post_name=None, download_id=None):
-    # Si se ha solicitado cancelar, se aborta.
-        if self.cancel_requested.is_set():
-            return
-
+    def prepare_media_element(self, media_url, user_id, post_id=None, post_name=None):
+        """
+        Aplica los filtros de extensión, calcula el nombre y la carpeta destino y
+        consulta la DB. Devuelve (final_path, tmp_path) o None si el archivo se omite.
+        Lo comparten el motor por hilos y el motor asyncio.
+        """
         extension = os.path.splitext(media_url)[1].lower()
-        if (extension in self.image_extensions and not self.download_images) or \
-        (extension in self.video_extensions and not self.download_videos) or \
-        (extension in self.compressed_extensions and not self.download_compressed):
+        if not self.is_extension_enabled(extension):
             self.log(f"Skipping {media_url} due to settings.")
-            return
+            return None
 
         self.log(f"Starting download from {media_url}")
 
@@ -371,43 +720,217 @@ class Downloader:
         os.makedirs(media_folder, exist_ok=True)
 
         final_path = os.path.normpath(os.path.join(media_folder, filename))
-        tmp_path = final_path + ".tmp"
+        tmp_path = PartialDownload.tmp_path_for(os.path.normpath(media_folder), media_url)
+        if media_folder not in self.pruned_folders:
+            # Una vez por carpeta y sesión: .tmp abandonados y sidecars huérfanos
+            self.pruned_folders.add(media_folder)
+            if PartialDownload.prune(media_folder, self.partial_max_age_days):
+                self.log(f"Removed stale partial downloads from {media_folder}")
 
         # Si el archivo ya figura en la DB, se omite la descarga.
-        if media_url in self.download_cache:
+        if self.find_download(media_url):
             self.log(f"File from {media_url} is in DB, skipping.")
             self.skipped_files.append(final_path)
-            return
+            return None
+
+        # Mismo contenido ya descargado desde otra URL (otro creador u otro subdominio)
+        if self.content_dedup and self.reuse_downloaded_copy(media_url, final_path, user_id, post_id):
+            return None
+
+        return final_path, tmp_path
+
+    def reuse_downloaded_copy(self, media_url, final_path, user_id, post_id=None):
+        """
+        Si ya hay en disco un archivo con el mismo sha256, lo enlaza (hardlink) o lo
+        copia en final_path y lo registra sin tocar la red. Devuelve True si lo hizo.
+        """
+        content_hash = self.content_hash(media_url)
+        existing = self.find_content(content_hash) if content_hash else None
+        if not existing:
+            return False
+        source_path, file_size = existing
+        if not source_path or not os.path.isfile(source_path) or (file_size and os.path.getsize(source_path) != file_size):
+            # El archivo registrado ya no está (o cambió): se descarga de nuevo
+            return False
+
+        if not (os.path.exists(final_path) and os.path.samefile(source_path, final_path)):
+            if os.path.exists(final_path):
+                os.remove(final_path)
+            try:
+                os.link(source_path, final_path)
+                self.log(f"Linked {media_url} to existing copy {source_path}")
+            except OSError:
+                # Otro volumen o sistema de archivos sin hardlinks
+                shutil.copyfile(source_path, final_path)
+                self.log(f"Copied {media_url} from existing copy {source_path}")
+        self.record_completed_download(media_url, final_path, os.path.getsize(final_path), user_id, post_id)
+        return True
+
+    def finalize_media_element(self, media_url, tmp_path, final_path, total_size, user_id, post_id=None):
+        """Renombra el .tmp, actualiza los contadores y registra el archivo en la DB."""
+        # Una vez completada la descarga, renombrar el archivo.
+        if os.path.exists(final_path):
+            os.remove(final_path)
+        os.rename(tmp_path, final_path)
+        PartialDownload.remove_sidecar(tmp_path)
+        self.log(f"Download success from {media_url}")
+        self.record_completed_download(media_url, final_path, total_size, user_id, post_id)
 
-        response = self.safe_request(media_url, max_retries=self.max_retries)
+    def record_completed_download(self, media_url, final_path, total_size, user_id, post_id=None):
+        """Actualiza los contadores y registra el archivo en la DB y en el índice de URLs."""
+        self.completed_files += 1
+        if self.update_global_progress_callback:
+            self.update_global_progress_callback(self.completed_files, self.total_files)
+
+        content_hash = self.content_hash(media_url)
+        # Registrar el archivo en la base de datos; el hilo escritor lo confirma en el siguiente lote.
+        # El título del post sale de la cola de tareas, que se escribió antes en el mismo orden.
+        self.db_writer.execute(
+            """INSERT INTO downloads
+                (media_url, file_path, file_size, user_id, post_id, content_hash, post_title, file_type)
+            VALUES (?, ?, ?, ?, ?, ?, (SELECT post_title FROM jobs WHERE media_url = ?), ?)
+            ON CONFLICT(media_url) DO UPDATE SET
+                file_path = excluded.file_path, file_size = excluded.file_size, user_id = excluded.user_id,
+                post_id = excluded.post_id, content_hash = excluded.content_hash,
+                post_title = COALESCE(excluded.post_title, downloads.post_title),
+                file_type = excluded.file_type, downloaded_at = CURRENT_TIMESTAMP""",
+            (media_url, final_path, total_size, user_id, post_id, content_hash, media_url, file_type(final_path))
+        )
+
+        self.url_index.add(media_url, content_hash)
+
+    def process_media_element(self, media_url, user_id, post_id=None,
+                          post_name=None, download_id=None, host_slot_taken=False):
+        # host_slot_taken: run_media_tasks ya tomó el hueco del AIMD antes de encolar la tarea
+        host = urlparse(media_url).netloc
+        try:
+            # Si se ha solicitado cancelar, se aborta.
+            if self.cancel_requested.is_set():
+                return
+
+            self.set_job_status(media_url, 'in_progress')
+            try:
+                paths = self.prepare_media_element(media_url, user_id, post_id=post_id, post_name=post_name)
+                if paths is None:
+                    return
+                final_path, tmp_path = paths
+
+                if self.concurrency is not None and not host_slot_taken:
+                    # El controlador adaptativo decide cuántas transferencias admite el host ahora mismo
+                    if not self.concurrency.acquire(host, cancel_event=self.cancel_requested):
+                        return
+                    host_slot_taken = True
+                self.download_to_path(media_url, final_path, tmp_path, user_id, post_id, download_id)
+            except Exception as e:
+                # Sin esto la excepción se quedaría en el Future y el archivo no contaría como fallido
+                self.log(f"Error downloading {media_url}: {e}")
+                self.failed_files.append(media_url)
+            finally:
+                self.finish_job(media_url)
+        finally:
+            if host_slot_taken:
+                self.concurrency.release(host)
+
+    def download_to_path(self, media_url, final_path, tmp_path, user_id, post_id=None, download_id=None):
+        """Transfiere media_url a tmp_path y, si termina completo, lo finaliza en final_path."""
+        # Un .tmp de otra sesión se reanuda si el servidor confirma que el archivo no ha cambiado
+        partial = PartialDownload.load(tmp_path, media_url)
+        range_headers = partial.range_headers() if partial is not None and partial.segments is None else None
+        response = self.safe_request(media_url, max_retries=self.max_retries, headers=range_headers)
+        if response is None and partial is not None and not self.cancel_requested.is_set():
+            # p. ej. 416 porque el archivo remoto encogió: se descarta el .tmp y se empieza de cero
+            partial.discard()
+            partial = None
+            response = self.safe_request(media_url, max_retries=self.max_retries)
         if response is None:
             self.log(f"Failed to download {media_url} after retries.")
             self.failed_files.append(media_url)
             return
 
-        try:
-            total_size = int(response.headers.get('content-length', 0))
-        except Exception as e:
-            self.log(f"Error getting total size: {e}")
-            total_size = 0
+        if partial is not None and not partial.matches(response.status_code, response.headers):
+            self.log(f"Remote file changed, discarding partial download of {media_url}")
+            partial.discard()
+            partial = None
+            if response.status_code == 206:
+                response.close()
+                response = self.safe_request(media_url, max_retries=self.max_retries)
+                if response is None:
+                    self.log(f"Failed to download {media_url} after retries.")
+                    self.failed_files.append(media_url)
+                    return
+        # URL real (puede ser otro subdominio tras un 403) para reanudar desde el mismo host
+        download_url = response.url
 
-        downloaded_size = 0
-        self.start_time = time.time()
+        if partial is not None:
+            total_size = partial.size
+        else:
+            try:
+                total_size = int(response.headers.get('content-length', 0))
+            except Exception as e:
+                self.log(f"Error getting total size: {e}")
+                total_size = 0
+
+        # Archivos grandes: varias conexiones en paralelo sobre rangos de bytes
+        if (partial is not None and partial.segments is not None) or \
+                (partial is None and self.should_segment(response, total_size)):
+            response.close()
+            if partial is None:
+                partial = PartialDownload.from_headers(tmp_path, media_url, total_size, response.headers)
+            completed = self.download_segmented(download_url, partial, download_id=download_id)
+            if completed:
+                self.finalize_media_element(media_url, tmp_path, final_path, total_size, user_id, post_id)
+                return
+            if completed is False:
+                # El .tmp y su sidecar se conservan para reanudar los segmentos más tarde
+                if self.cancel_requested.is_set():
+                    self.log(f"Download cancelled from {media_url}")
+                else:
+                    self.log(f"Failed to download {media_url} after retries.")
+                    self.failed_files.append(media_url)
+                return
+            # El servidor no respeta los rangos: download_segmented ya descartó el .tmp y su
+            # sidecar, así que se descarga de nuevo en una sola conexión desde el principio
+            self.log(f"Falling back to a single-stream download of {media_url}")
+            partial = None
+            response = self.safe_request(media_url, max_retries=self.max_retries)
+            if response is None:
+                self.log(f"Failed to download {media_url} after retries.")
+                self.failed_files.append(media_url)
+                return
+            download_url = response.url
+            try:
+                total_size = int(response.headers.get('content-length', 0))
+            except Exception as e:
+                self.log(f"Error getting total size: {e}")
+                total_size = 0
+
+        if partial is not None:
+            downloaded_size = partial.offset()
+            self.log(f"Resuming download at byte {downloaded_size} for {media_url} from a previous session")
+        else:
+            downloaded_size = 0
+            if total_size:
+                PartialDownload.from_headers(tmp_path, media_url, total_size, response.headers).save()
+        resumed_size = downloaded_size
+        if resumed_size:
+            session_stats.begin(download_id, resumed_size)
+        start_time = time.time()
 
         # Abrir el archivo temporal para escribir los primeros chunks.
-        with open(tmp_path, 'wb') as f:
+        with open(tmp_path, 'r+b' if partial is not None else 'wb') as f:
+            f.seek(downloaded_size)
+            f.truncate()
             for chunk in response.iter_content(chunk_size=1048576):
                 if self.cancel_requested.is_set():
-                    f.close()
-                    os.remove(tmp_path)
                     self.log(f"Download cancelled from {media_url}")
                     return
                 if chunk:
                     f.write(chunk)
                     downloaded_size += len(chunk)
+                    bandwidth_limiter.consume(len(chunk), self.cancel_requested.is_set)
                     if self.update_progress_callback:
-                        elapsed_time = time.time() - self.start_time
-                        speed = downloaded_size / elapsed_time if elapsed_time > 0 else 0
+                        elapsed_time = time.time() - start_time
+                        speed = (downloaded_size - resumed_size) / elapsed_time if elapsed_time > 0 else 0
                         remaining_time = (total_size - downloaded_size) / speed if speed > 0 else 0
                         self.update_progress_callback(downloaded_size, total_size,
                                                     file_id=download_id,
@@ -421,22 +944,21 @@ class Downloader:
             resume_headers = self.headers.copy()
             resume_headers['Range'] = f'bytes={downloaded_size}-'
             self.log(f"Resuming download at byte {downloaded_size} for {media_url}")
-            part_response = self.session.get(media_url, stream=True, headers=resume_headers, timeout=30)
+            part_response = self.session.get(download_url, stream=True, headers=resume_headers, timeout=30)
             part_response.raise_for_status()
 
             with open(tmp_path, 'ab') as f:
                 for chunk in part_response.iter_content(chunk_size=1048576):
                     if self.cancel_requested.is_set():
-                        f.close()
-                        os.remove(tmp_path)
                         self.log(f"Download cancelled from {media_url}")
                         return
                     if chunk:
                         f.write(chunk)
                         downloaded_size += len(chunk)
+                        bandwidth_limiter.consume(len(chunk), self.cancel_requested.is_set)
                         if self.update_progress_callback:
-                            elapsed_time = time.time() - self.start_time
-                            speed = downloaded_size / elapsed_time if elapsed_time > 0 else 0
+                            elapsed_time = time.time() - start_time
+                            speed = (downloaded_size - resumed_size) / elapsed_time if elapsed_time > 0 else 0
                             remaining_time = (total_size - downloaded_size) / speed if speed > 0 else 0
                             self.update_progress_callback(downloaded_size, total_size,
                                                         file_id=download_id,
@@ -444,136 +966,424 @@ class Downloader:
                                                         speed=speed,
                                                         eta=remaining_time)
 
-        # Una vez completada la descarga, renombrar el archivo.
-        if os.path.exists(final_path):
-            os.remove(final_path)
-        os.rename(tmp_path, final_path)
+        self.finalize_media_element(media_url, tmp_path, final_path, total_size, user_id, post_id)
 
-        self.completed_files += 1
-        self.log(f"Download success from {media_url}")
-        if self.update_global_progress_callback:
-            self.update_global_progress_callback(self.completed_files, self.total_files)
 
-        # Registrar el archivo en la base de datos.
-        with self.db_lock:
-            self.db_cursor.execute(
-                """INSERT OR REPLACE INTO downloads (media_url, file_path, file_size, user_id, post_id)
-                VALUES (?, ?, ?, ?, ?)""",
-                (media_url, final_path, total_size, user_id, post_id)
-            )
-            self.db_connection.commit()
 
-        self.download_cache[media_url] = (final_path, total_size)
 
+    def should_segment(self, response, total_size):
+        """Indica si la respuesta admite rangos y supera el umbral para descargar por segmentos."""
+        if self.segment_count <= 1 or not total_size:
+            return False
+        if total_size < self.segment_threshold_mb * 1048576:
+            return False
+        return response.headers.get('Accept-Ranges', '').lower() == 'bytes'
 
+    @staticmethod
+    def split_ranges(total_size, parts):
+        """Divide [0, total_size) en `parts` rangos inclusivos (start, end)."""
+        step = -(-total_size // parts)
+        return [(start, min(start + step, total_size) - 1) for start in range(0, total_size, step)]
 
+    def download_segmented(self, url, partial, download_id=None):
+        """
+        Descarga un archivo en segment_count rangos de bytes en paralelo sobre un
+        .tmp preasignado. El progreso se reporta sumando todos los segmentos y la
+        posición de cada uno se guarda en el sidecar para reanudar en otra sesión.
+        Devuelve True solo si todos los segmentos se completaron, False si alguno
+        falló o se canceló (el sidecar queda para reanudar) y None si el servidor
+        ignoró un Range: en ese caso el .tmp y el sidecar se descartan, porque
+        reanudar por segmentos volvería a fallar igual en cada sesión.
+
+        Los ayudantes de los segmentos salen del executor de las descargas: las
+        conexiones extra cuentan contra el presupuesto y el sublímite del sitio en
+        lugar de ocupar el carril auxiliar, que es para trabajo corto. Si el pool está
+        lleno, el hilo que llama descarga los segmentos uno tras otro.
+        """
+        tmp_path = partial.tmp_path
+        total_size = partial.size
+        if partial.segments is None:
+            partial.segments = [list(segment) for segment in self.split_ranges(total_size, self.segment_count)]
+            # Preasignar el archivo temporal para que cada segmento escriba en su sitio
+            with open(tmp_path, 'wb') as f:
+                f.truncate(total_size)
+            partial.save()
+            self.log(f"Downloading {url} in {len(partial.segments)} segments ({total_size / 1048576:.2f} MB)")
+        else:
+            self.log(f"Resuming {len(partial.segments)} segments of {url} from a previous session")
+        segments = partial.segments
+        # Cada segmento es una petición más al host: pasa por su token bucket y su límite de
+        # peticiones simultáneas, y su respuesta se anota en el AIMD con el host original
+        domain = urlparse(url).netloc
+        endpoint_class = classify_endpoint(url)
+        feedback_host = urlparse(partial.url).netloc
+
+        progress_lock = threading.Lock()
+        # Lo marca el primer segmento que recibe un 200 para que los demás dejen de pedir rangos
+        range_ignored = threading.Event()
+        already_downloaded = total_size - sum(end - position + 1 for position, end in segments if position <= end)
+        progress = {'downloaded': already_downloaded, 'saved_at': time.monotonic()}
+        if already_downloaded:
+            session_stats.begin(download_id, already_downloaded)
+        start_time = time.time()
+
+        def report(segment, position, chunk_size):
+            with progress_lock:
+                segment[0] = position
+                progress['downloaded'] += chunk_size
+                downloaded_size = progress['downloaded']
+                # Persistir las posiciones como mucho una vez por segundo
+                if time.monotonic() - progress['saved_at'] >= 1.0:
+                    progress['saved_at'] = time.monotonic()
+                    partial.save()
+            if self.update_progress_callback:
+                elapsed_time = time.time() - start_time
+                speed = (downloaded_size - already_downloaded) / elapsed_time if elapsed_time > 0 else 0
+                remaining_time = (total_size - downloaded_size) / speed if speed > 0 else 0
+                self.update_progress_callback(downloaded_size, total_size,
+                                              file_id=download_id,
+                                              file_path=tmp_path,
+                                              speed=speed,
+                                              eta=remaining_time)
+
+        def fetch_segment(segment):
+            position, end = segment
+            start = position
+            attempts = 0
+            while position <= end:
+                if self.cancel_requested.is_set() or range_ignored.is_set():
+                    return False
+                segment_headers = self.headers.copy()
+                segment_headers['Range'] = f'bytes={position}-{end}'
+                self.throttle.acquire(endpoint_class, domain, cancel_event=self.cancel_requested)
+                if self.cancel_requested.is_set():
+                    return False
+                try:
+                    with self.throttle.slot(endpoint_class, domain):
+                        request_start = time.monotonic()
+                        part_response = self.session.get(url, stream=True, headers=segment_headers, timeout=30)
+                    self.record_host_feedback(feedback_host, part_response.status_code, part_response.headers,
+                                              request_start)
+                    part_response.raise_for_status()
+                    if part_response.status_code != 206:
+                        # El servidor ignoró el rango: no se puede escribir en esta posición
+                        part_response.close()
+                        self.log(f"Server ignored Range request for {url}")
+                        range_ignored.set()
+                        return False
+                    with open(tmp_path, 'r+b') as f:
+                        f.seek(position)
+                        for chunk in part_response.iter_content(chunk_size=1048576):
+                            if self.cancel_requested.is_set() or range_ignored.is_set():
+                                part_response.close()
+                                return False
+                            if not chunk:
+                                continue
+                            chunk = chunk[:end - position + 1]
+                            f.write(chunk)
+                            position += len(chunk)
+                            report(segment, position, len(chunk))
+                            bandwidth_limiter.consume(len(chunk), self.cancel_requested.is_set)
+                            if position > end:
+                                break
+                    part_response.close()
+                except requests.exceptions.RequestException as e:
+                    attempts += 1
+                    self.log(f"Segment {start}-{end} of {url} failed at byte {position}: {e}")
+                    if attempts >= self.max_retries:
+                        return False
+                    # Si el servidor indica Retry-After se respeta; la espera termina al cancelar
+                    retry_after = parse_retry_after(getattr(e.response, 'headers', {}).get('Retry-After'))
+                    self.cancel_requested.wait(retry_after if retry_after is not None else self.retry_interval)
+            return True
+
+        # Este hilo descarga un segmento y los demás van a huecos libres del executor
+        open_segments = [segment for segment in segments if segment[0] <= segment[1]]
+        results = [result for _, result in run_with_helpers(self.executor, fetch_segment, open_segments)]
+        if range_ignored.is_set():
+            partial.discard()
+            return None
+        if not all(results):
+            with progress_lock:
+                partial.save()
+        return all(results)
 
-    def get_remote_file_size(self, media_url, filename):
+    def get_remote_file_size(self, media_url):
+        """
+        Tamaño del archivo con un HEAD por la sesión compartida, respetando el
+        throttling de su clase de endpoint. Devuelve None si no se puede saber.
+        """
+        url = media_url
+        if "coomer.su" in url:
+            cached_host = self.subdomain_cache.get(url)
+            if cached_host:
+                url = SubdomainCache.apply(url, cached_host)
+        domain = urlparse(url).netloc
+        endpoint_class = classify_endpoint(url)
+        self.throttle.acquire(endpoint_class, domain, cancel_event=self.cancel_requested)
+        if self.cancel_requested.is_set():
+            return None
         try:
-            response = requests.head(media_url, allow_redirects=True)
-            if response.status_code == 200:
-                size = int(response.headers.get('Content-Length', 0))
-                return media_url, filename, size
+            with self.throttle.slot(endpoint_class, domain):
+                response = self.session.head(url, headers=self.headers, allow_redirects=True, timeout=15)
+            response.close()
+        except requests.exceptions.RequestException as e:
+            self.log(self.tr(f"Error getting size for {media_url}: {e}"))
+            return None
+        size = response.headers.get('Content-Length', '')
+        if response.status_code != 200 or not size.isdigit():
+            # Sin tamaño (p. ej. 403 del subdominio): la tarea se ordena al final y se descarga igual
+            return None
+        return int(size)
+
+    def prefetch_sizes(self, tasks):
+        """Pide con HEAD simultáneos el tamaño de las tareas que se van a descargar."""
+        urls = []
+        for media_url, _, _, _ in tasks:
+            if media_url in self.known_sizes or self.url_index.contains(media_url):
+                continue
+            content_hash = self.content_hash(media_url) if self.content_dedup else None
+            if content_hash and self.url_index.contains_content(content_hash):
+                continue  # Se reutilizará la copia local, no hace falta su tamaño
+            urls.append(media_url)
+        if not urls:
+            return
+        for media_url, size in run_with_helpers(self.executor, self.get_remote_file_size, urls,
+                                                max(1, self.head_prefetch_workers)):
+            if size:
+                self.known_sizes[media_url] = size
+                session_stats.expect(media_url, size)
+
+    def order_tasks(self, tasks):
+        """
+        Ordena las tareas según task_order usando el tamaño obtenido con HEAD:
+        'small_first' adelanta los primeros resultados, 'large_first' evita que un
+        vídeo enorme quede solo al final y 'interleaved' alterna grande y pequeño
+        para que los hilos sigan ocupados hasta el final. Las tareas sin tamaño
+        conocido van detrás en su orden original.
+        """
+        if self.task_order == 'none' or len(tasks) < 2 or self.cancel_requested.is_set():
+            return tasks
+        self.prefetch_sizes(tasks)
+        sized = [task for task in tasks if task[0] in self.known_sizes]
+        unsized = [task for task in tasks if task[0] not in self.known_sizes]
+        sized.sort(key=lambda task: self.known_sizes[task[0]], reverse=self.task_order == 'large_first')
+        if self.task_order == 'interleaved':
+            smallest, largest = 0, len(sized) - 1
+            ordered = []
+            while smallest <= largest:
+                ordered.append(sized[largest])
+                largest -= 1
+                if smallest <= largest:
+                    ordered.append(sized[smallest])
+                    smallest += 1
+            sized = ordered
+        return sized + unsized
+
+    def iter_media_tasks(self, posts, user_id):
+        """
+        Recorre los posts y genera una tupla (media_url, user_id, post_id, title)
+        por cada archivo que pasa los filtros de extensión.
+        """
+        for post in posts:
+            current_post_id = post.get('id') or "unknown_id"
+            # Tomamos el 'title' del post para usarlo como post_name
+            title = post.get('title') or ""
+
+            for media_url in self.process_post(post):
+                if not self.is_extension_enabled(os.path.splitext(media_url)[1].lower()):
+                    continue
+                yield media_url, user_id, current_post_id, title
+
+    def is_extension_enabled(self, extension):
+        """Indica si los ajustes permiten descargar archivos con esa extensión."""
+        return not ((extension in self.image_extensions and not self.download_images) or
+                    (extension in self.video_extensions and not self.download_videos) or
+                    (extension in self.compressed_extensions and not self.download_compressed))
+
+    def iter_user_media_tasks(self, site, user_id, service, query=None, download_all=False,
+                              initial_offset=0, sync=None):
+        """
+        Planificador en una sola pasada: convierte cada página de la API en tareas
+        según llega y va sumando total_files, de modo que las descargas empiezan con
+        la primera página y nunca se guarda la lista completa de posts en memoria.
+
+        Si se pasa `sync` ({'mark': ..., 'newest': None}), se descartan los posts en o
+        por detrás de la marca, la paginación se corta en la página que alcanza la
+        marca y en sync['newest'] queda el post más reciente visto.
+        """
+        # Sin "download all" solo se descargan los primeros 50 posts
+        remaining_posts = None if download_all else 50
+        sync_mark = sync['mark'] if sync is not None else None
+        for posts in self.iter_user_post_pages(site, user_id, service, query=query,
+                                               initial_offset=initial_offset, log_fetching=download_all,
+                                               sync_mark=sync_mark):
+            reached_mark = False
+            if sync is not None:
+                for post in posts:
+                    if sync['newest'] is None or self.sync_key(post) > self.sync_key(sync['newest']):
+                        sync['newest'] = post
+                if sync_mark is not None:
+                    new_posts = [post for post in posts if self.sync_key(post) > sync_mark]
+                    # Los posts llegan del más nuevo al más antiguo: lo que sigue ya está sincronizado
+                    reached_mark = len(new_posts) < len(posts)
+                    posts = new_posts
+                    if not posts:
+                        self.log(self.tr("Reached the last synced post, stopping pagination."))
+                        return
+            if remaining_posts is not None:
+                posts = posts[:remaining_posts]
+                remaining_posts -= len(posts)
+            # Las tareas de la página quedan en la cola persistente antes de repartirse
+            page_tasks = list(self.iter_media_tasks(posts, user_id))
+            self.enqueue_jobs(page_tasks)
+            page_tasks = self.order_tasks(page_tasks)
+            for task in page_tasks:
+                self.total_files += 1
+                if self.update_global_progress_callback:
+                    self.update_global_progress_callback(self.completed_files, self.total_files)
+                yield task
+            if reached_mark:
+                self.log(self.tr("Reached the last synced post, stopping pagination."))
+                return
+            if remaining_posts == 0:
+                return
+
+    def run_media_tasks(self, tasks):
+        """Descarga las tareas con el motor configurado ('threads' o 'async')."""
+        if self.download_engine == 'async' and self.shared_executor:
+            # Las transferencias del event loop no pasarían por el presupuesto global ni el sublímite del sitio
+            self.log("The asyncio engine does not share the scheduler limits; using the thread engine for this URL.")
+        elif self.download_engine == 'async':
+            from downloader.async_engine import AsyncDownloadEngine
+            engine = AsyncDownloadEngine(self, max_concurrency=self.async_max_concurrency)
+            engine.run(tasks)
+            return
+
+        # Contrapresión: como mucho dos tareas en cola por hilo, así el generador de
+        # tareas (y la paginación de la API) avanza al ritmo de las descargas
+        in_flight = BoundedSemaphore(self.max_workers * 2)
+        futures = set()
+        for media_url, user_id, post_id, title in tasks:
+            if self.cancel_requested.is_set():
+                break
+            # Dependiendo del modo, encolamos o hacemos en serie
+            if self.download_mode == 'queue':
+                # Llamada directa y secuencial
+                self.process_media_element(media_url, user_id, post_id=post_id, post_name=title)
             else:
-                self.log(self.tr(f"Failed to get size for {filename}: HTTP {response.status_code}"))
-                return media_url, filename, None
-        except Exception as e:
-            self.log(self.tr(f"Error getting size for {filename}: {e}"))
-            return media_url, filename, None
+                # Modo multi (threaded)
+                while not in_flight.acquire(timeout=0.5):
+                    if self.cancel_requested.is_set():
+                        break
+                if self.cancel_requested.is_set():
+                    break
+                # El hueco del AIMD se espera aquí y no en el pool, para no tener
+                # ocupado un hilo compartido mientras el host no admite más transferencias
+                host = urlparse(media_url).netloc
+                if self.concurrency is not None and not self.concurrency.acquire(host, cancel_event=self.cancel_requested):
+                    in_flight.release()
+                    break
+                future = self.executor.submit(
+                    self.process_media_element,
+                    media_url,
+                    user_id,
+                    post_id,
+                    title,  # <-- pasamos el título aquí
+                    media_url,
+                    self.concurrency is not None
+                )
+                futures.add(future)
+                self.futures.add(future)
+                future.add_done_callback(lambda f, host=host: self.task_done(f, host, in_flight))
+
+        # Espera a que terminen los hilos (si es multi)
+        if self.download_mode == 'multi':
+            for future in as_completed(futures):
+                if self.cancel_requested.is_set():
+                    break
+
+    def task_done(self, future, host, in_flight):
+        in_flight.release()
+        self.futures.discard(future)
+        if future.cancelled() and self.concurrency is not None:
+            # La tarea no llegó a ejecutarse: su hueco del AIMD no lo devolverá nadie más
+            self.concurrency.release(host)
+
+    def retry_failed_downloads(self, user_id):
+        """Reintenta los archivos fallidos. Devuelve True si al final no queda ninguno pendiente."""
+        # Intentamos re-descargar fallidos, si deseas
+        if self.failed_files:
+            self.log(self.tr("Retrying failed downloads..."))
+            pending = list(self.failed_files)
+            for media_url in pending:
+                if self.cancel_requested.is_set():
+                    break
+                # La cola conserva el usuario, post y título originales del archivo
+                job = self.get_job(media_url)
+                job_user_id, post_id, title = job if job else (user_id, None, None)
+                self.process_media_element(
+                    media_url,
+                    job_user_id or user_id,
+                    post_id=post_id,
+                    post_name=title,
+                    download_id=media_url
+                )
+            # process_media_element vuelve a añadir a failed_files lo que falla de nuevo
+            still_failed = self.failed_files[len(pending):]
+            self.failed_files.clear()
+            return not still_failed and not self.cancel_requested.is_set()
+        return not self.cancel_requested.is_set()
 
     def download_media(self, site, user_id, service, query=None, download_all=False, initial_offset=0):
         try:
             self.log(self.tr("Starting download process..."))
 
-            posts = self.fetch_user_posts(
+            self.total_files = 0
+            sync = None
+            # La marca solo tiene sentido al recorrer el perfil completo desde el principio y
+            # sin filtros de tipo: lo que se salte ahora no debe quedar por detrás de la marca
+            all_types = self.download_images and self.download_videos and self.download_compressed
+            if self.incremental_sync and download_all and query is None and not initial_offset and all_types:
+                sync = {'mark': self.get_sync_mark(site, service, user_id), 'newest': None}
+            # Las tareas se generan página a página mientras los workers ya descargan
+            tasks = self.iter_user_media_tasks(
                 site, user_id, service,
                 query=query,
+                download_all=download_all,
                 initial_offset=initial_offset,
-                log_fetching=download_all
+                sync=sync
             )
-            if not posts:
-                self.log(self.tr("No posts found for this user."))
+            try:
+                self.run_media_tasks(tasks)
+            finally:
+                tasks.close()  # Cancela las páginas pedidas de más si se cortó antes de tiempo
+            if not self.total_files and not self.cancel_requested.is_set():
+                if sync is not None and sync['mark'] is not None:
+                    self.log(self.tr("No new posts since the last sync."))
+                else:
+                    self.log(self.tr("No posts found for this user."))
                 return
 
-            if not download_all:
-                # Limita a los primeros 50 posts si no es "download all"
-                posts = posts[:50]
-
-            self.total_files = 0
-            for post in posts:
-                current_post_id = post.get('id') or "unknown_id"
-                # Tomamos el 'title' del post para usarlo como post_name
-                title = post.get('title') or ""
-
-                # Obtenemos la lista de URLs de archivos para este post
-                media_urls = self.process_post(post)
-
-
-                for media_url in media_urls:
-                    ext = os.path.splitext(media_url)[1].lower()
-                    if (ext in self.image_extensions and not self.download_images) or \
-                       (ext in self.video_extensions and not self.download_videos) or \
-                       (ext in self.compressed_extensions and not self.download_compressed):
-                        continue
-
-                    # Aumentamos total_files
-                    self.total_files += 1
-
-            # Segunda pasada, ya sabiendo cuántos archivos totales
-            # (Para el "progress" si así lo requieres)
-            futures = []
-            for post in posts:
-                current_post_id = post.get('id') or "unknown_id"
-                title = post.get('title') or ""
-
-                media_urls = self.process_post(post)
-                for media_url in media_urls:
-                    ext = os.path.splitext(media_url)[1].lower()
-                    if (ext in self.image_extensions and not self.download_images) or \
-                       (ext in self.video_extensions and not self.download_videos) or \
-                       (ext in self.compressed_extensions and not self.download_compressed):
-                        continue
-
-                    # Dependiendo del modo, encolamos o hacemos en serie
-                    if self.download_mode == 'queue':
-                        # Llamada directa y secuencial
-                        self.process_media_element(
-                            media_url,
-                            user_id,
-                            post_id=current_post_id,
-                            post_name=title  
-                        )
-                    else:
-                        # Modo multi (threaded)
-                        future = self.executor.submit(
-                            self.process_media_element,
-                            media_url,
-                            user_id,
-                            current_post_id,
-                            title,  # <-- pasamos el título aquí
-                            media_url 
-                        )
-                        futures.append(future)
-
-            # Espera a que terminen los hilos (si es multi)
-            if self.download_mode == 'multi':
-                for future in as_completed(futures):
-                    if self.cancel_requested.is_set():
-                        break
+            completed = self.retry_failed_downloads(user_id) and not self.pagination_failed
+            # La marca solo avanza si se listaron todas las páginas y todo lo nuevo se descargó;
+            # si no, la próxima vez se reintenta
+            if sync is not None and sync['newest'] is not None and completed:
+                self.save_sync_mark(site, service, user_id, sync['newest'])
 
-            # Intentamos re-descargar fallidos, si deseas
-            if self.failed_files:
-                self.log(self.tr("Retrying failed downloads..."))
-                for media_url in self.failed_files:
-                    if self.cancel_requested.is_set():
-                        break
-                    self.process_media_element(
-                        media_url,
-                        user_id,
-                        download_id=media_url
-                    )
-                self.failed_files.clear()
+        except Exception as e:
+            self.log(self.tr(f"Error during download: {e}"))
+        finally:
+            self.shutdown_executor()
 
+    def resume_jobs(self):
+        """Descarga lo que quedó pendiente o fallido en la cola de una sesión anterior."""
+        try:
+            self.log(self.tr("Resuming unfinished downloads from the previous session..."))
+            self.total_files = 0
+            self.run_media_tasks(self.iter_unfinished_jobs())
+            # Cada reintento toma el usuario de su propia tarea en la cola
+            self.retry_failed_downloads(None)
         except Exception as e:
             self.log(self.tr(f"Error during download: {e}"))
         finally:
@@ -581,68 +1391,76 @@ class Downloader:
 
     def download_single_post(self, site, post_id, service, user_id):
         try:
-            post = self.fetch_user_posts(site, user_id, service, specific_post_id=post_id)
+            # Una sola llamada al endpoint del post; solo si falla se pagina todo el perfil
+            post = self.fetch_single_post(site, post_id, service, user_id)
+            if post:
+                post = [post]
+            else:
+                self.log(self.tr("Direct post lookup failed, searching the creator's posts..."))
+                post = self.fetch_user_posts(site, user_id, service, specific_post_id=post_id)
             if not post:
                 self.log(self.tr("No post found for this ID."))
                 return
-            media_urls = self.process_post(post[0])
-            futures = []
-            grouped_media_urls = defaultdict(list)
-            for media_url in media_urls:
-                grouped_media_urls[post[0]['id']].append(media_url)
-            self.total_files = len(media_urls)
+            tasks = list(self.iter_media_tasks(post[:1], user_id))
+            self.enqueue_jobs(tasks)
+            tasks = self.order_tasks(tasks)
+            self.total_files = len(tasks)
             self.completed_files = 0
-            for post_id, media_urls in grouped_media_urls.items():
-                for media_url in media_urls:
-                    if self.download_mode == 'queue':
-                        self.process_media_element(media_url, user_id, post_id)
-                    else:
-                        future = self.executor.submit(self.process_media_element, media_url, user_id, post_id)
-                        futures.append(future)
-            if self.download_mode == 'multi':
-                for future in as_completed(futures):
-                    if self.cancel_requested.is_set():
-                        break
-            if self.failed_files:
-                self.log(self.tr("Retrying failed downloads..."))
-                for media_url in self.failed_files:
-                    if self.cancel_requested.is_set():
-                        break
-                    self.process_media_element(media_url, user_id)
-                self.failed_files.clear()
+
+            self.run_media_tasks(tasks)
+            self.retry_failed_downloads(user_id)
         except Exception as e:
             self.log(self.tr(f"Error during download: {e}"))
         finally:
             self.shutdown_executor()
     
-    def fetch_single_post(self, site, post_id, service):
-        api_url = f"https://{site}.su/api/v1/{service}/post/{post_id}"
+    def fetch_single_post(self, site, post_id, service, user_id):
+        """Pide un post concreto a la API. Devuelve el dict del post o None si no se obtiene."""
+        api_url = f"https://{site}/api/v1/{service}/user/{quote_plus(user_id)}/post/{quote_plus(str(post_id))}"
         self.log(self.tr(f"Fetching post from {api_url}"))
         try:
-            with self.rate_limit:
-                response = self.session.get(api_url, headers=self.headers)
+            response = self.api_get(api_url)
             response.raise_for_status()
-            return response.json()
+            post_data = response.json()
         except Exception as e:
             self.log(self.tr(f"Error fetching post: {e}"))
             return None
+        # Según la versión de la API llega {'post': {...}}, el post directamente o una lista
+        if isinstance(post_data, dict) and isinstance(post_data.get('post'), dict):
+            post_data = post_data['post']
+        elif isinstance(post_data, list):
+            post_data = next((p for p in post_data if isinstance(p, dict)), None)
+        if not isinstance(post_data, dict) or str(post_data.get('id')) != str(post_id):
+            return None
+        return post_data
 
     def clear_database(self):
         """Borra todos los registros de la base de datos."""
+        self.db_writer.flush()
         with self.db_lock:
             self.db_cursor.execute("DELETE FROM downloads")
+            self.db_cursor.execute("DELETE FROM creator_sync")
+            self.db_cursor.execute("DELETE FROM jobs")
             self.db_connection.commit()
+        UrlIndex.invalidate(self.db_path)
+        self.url_index = UrlIndex.for_path(self.db_path)
         self.log(self.tr("Database cleared."))
     
     def update_max_downloads(self, new_max):
         """
         Dynamically updates the number of max workers (threads) for this Downloader.
         Recreates the ThreadPoolExecutor and the rate_limit Semaphore.
+        A downloader that runs on a scheduler's shared executor is left untouched.
         """
+        if self.shared_executor:
+            return
+
         # shut down the old executor safely
         if self.executor:
             self.executor.shutdown(wait=True)
 
+        if self.concurrency is not None:
+            new_max = max(new_max, self.concurrency.maximum)
         self.max_workers = new_max
         self.executor = ThreadPoolExecutor(max_workers=new_max)
         self.rate_limit = Semaphore(new_max)
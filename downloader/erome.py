@@ -1,5 +1,4 @@
 import re
-from tkinter import messagebox, simpledialog
 import uuid
 import requests
 from bs4 import BeautifulSoup
@@ -10,9 +9,10 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
 from pathlib import Path
 from requests.exceptions import ChunkedEncodingError
+from downloader.rate_limiter import bandwidth_limiter
 
 class EromeDownloader:
-    def __init__(self, root, log_callback=None, enable_widgets_callback=None, update_progress_callback=None, update_global_progress_callback=None, download_images=True, download_videos=True, headers=None, language="en", is_profile_download=False, direct_download=False, tr=None, max_workers=5):
+    def __init__(self, root, log_callback=None, enable_widgets_callback=None, update_progress_callback=None, update_global_progress_callback=None, download_images=True, download_videos=True, headers=None, language="en", is_profile_download=False, direct_download=False, tr=None, max_workers=5, executor=None):
         self.root = root
         self.session = requests.Session()
         self.headers = {k: str(v).encode('ascii', 'ignore').decode('ascii') for k, v in (headers or {
@@ -28,7 +28,7 @@ class EromeDownloader:
         self.download_videos = download_videos
         self.cancel_requested = False
         self.language = language
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)  # Thread pool for concurrent downloads
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers)  # Thread pool for concurrent downloads
         self.total_files = 0
         self.completed_files = 0
         self.is_profile_download = is_profile_download
@@ -61,6 +61,11 @@ class EromeDownloader:
             os.makedirs(folder_name, exist_ok=True)
         except OSError as e:
             self.log(self.tr("Error creating folder: {error}", error=e))
+            if self.root is None:
+                # Sin interfaz (CLI) no se puede pedir otro nombre
+                return folder_name
+            # tkinter solo se importa cuando hay ventana, así el modo sin interfaz no lo carga
+            from tkinter import messagebox, simpledialog
             response = messagebox.askyesno(self.tr("Error"), self.tr("Couldn't create folder: {folder_name}\nWould you like to choose a new name?", folder_name=folder_name), parent=self.root)
             if response:
                 new_folder_name = simpledialog.askstring(self.tr("New folder name"), self.tr("Enter new folder name:"), parent=self.root)
@@ -100,6 +105,7 @@ class EromeDownloader:
                                 return
                             f.write(chunk)
                             downloaded_size += len(chunk)
+                            bandwidth_limiter.consume(len(chunk), lambda: self.cancel_requested)
                             if self.update_progress_callback:
                                 self.update_progress_callback(downloaded_size, total_size, file_id=file_id, file_path=file_path)
 
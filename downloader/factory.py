@@ -0,0 +1,156 @@
+from urllib.parse import urlparse
+
+from downloader.routing import (
+    SITE_BUNKR, SITE_COOMER, SITE_EROME, SITE_JPG5, SITE_SIMPCITY,
+    extract_ck_parameters, extract_ck_query, is_bunkr_post, is_erome_album
+)
+
+
+def build_downloader(url, site_kind, options, callbacks, tr, scheduler=None):
+    """
+    Crea el descargador y la llamada que procesa la URL, con el mismo reparto que
+    ImageDownloaderApp.start_download. Devuelve (downloader, callable) o None si la URL no es válida.
+
+    callbacks es un dict con 'log', 'progress', 'global_progress' y, opcionalmente,
+    'enable_widgets'. Con un DownloadScheduler, el descargador usa el pool compartido
+    con el sublímite de su sitio y los token buckets / AIMD del planificador.
+    """
+    settings = options['settings']
+    download_folder = options['download_folder']
+    max_workers = options['max_workers']
+    log = callbacks['log']
+    progress = callbacks['progress']
+    global_progress = callbacks['global_progress']
+    enable_widgets = callbacks.get('enable_widgets') or (lambda: None)
+
+    shared = {}
+    if scheduler is not None:
+        max_workers = scheduler.site_limit(site_kind)
+        global_progress = scheduler.global_progress_callback(url, global_progress)
+        shared['executor'] = scheduler.site_executor(site_kind, url)
+
+    if site_kind == SITE_EROME:
+        from downloader.erome import EromeDownloader
+        downloader = EromeDownloader(
+            root=None,
+            enable_widgets_callback=enable_widgets,
+            headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, como Gecko) Chrome/58.0.3029.110 Safari/537.36',
+                'Referer': 'https://www.erome.com/'
+            },
+            log_callback=log,
+            update_progress_callback=progress,
+            update_global_progress_callback=global_progress,
+            download_images=options['download_images'],
+            download_videos=options['download_videos'],
+            is_profile_download=not is_erome_album(url),
+            max_workers=max_workers,
+            tr=tr,
+            **shared
+        )
+        method = downloader.process_album_page if is_erome_album(url) else downloader.process_profile_page
+        return downloader, lambda: method(url, download_folder, options['download_images'], options['download_videos'])
+
+    if scheduler is not None:
+        shared['throttle'] = scheduler.throttle
+
+    if site_kind == SITE_BUNKR:
+        from downloader.bunkr import BunkrDownloader
+        downloader = BunkrDownloader(
+            download_folder=download_folder,
+            log_callback=log,
+            enable_widgets_callback=enable_widgets,
+            update_progress_callback=progress,
+            update_global_progress_callback=global_progress,
+            headers={
+                'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+                'Referer': 'https://bunkr.site/',
+            },
+            max_workers=max_workers,
+            throttle_policies=settings.get('throttle_policies'),
+            **shared
+        )
+        method = downloader.descargar_post_bunkr if is_bunkr_post(url) else downloader.descargar_perfil_bunkr
+        return downloader, lambda: method(url)
+
+    if site_kind == SITE_COOMER:
+        from downloader.downloader import Downloader
+        parsed_url = urlparse(url)
+        site = parsed_url.netloc
+        service, user, post = extract_ck_parameters(parsed_url)
+        if service is None or user is None:
+            log(tr("No se pudo extraer el servicio.") if service is None
+                else tr("No se pudo extraer el ID del usuario."))
+            return None
+        if scheduler is not None:
+            shared['concurrency_controller'] = scheduler.concurrency
+        downloader = Downloader(
+            download_folder=download_folder,
+            log_callback=log,
+            enable_widgets_callback=enable_widgets,
+            update_progress_callback=progress,
+            update_global_progress_callback=global_progress,
+            headers={
+                'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+                'Referer': 'https://coomer.su/',
+            },
+            download_images=options['download_images'],
+            download_videos=options['download_videos'],
+            download_compressed=options['download_compressed'],
+            tr=tr,
+            max_workers=max_workers,
+            folder_structure=settings.get('folder_structure', 'default'),
+            download_engine=settings.get('download_engine', 'threads'),
+            async_max_concurrency=settings.get('async_max_concurrency', 100),
+            segment_count=settings.get('segment_count', 1),
+            segment_threshold_mb=settings.get('segment_threshold_mb', 100),
+            rate_limit_per_second=settings.get('rate_limit_per_second'),
+            rate_limit_burst=settings.get('rate_limit_burst', 2),
+            throttle_policies=settings.get('throttle_policies'),
+            adaptive_concurrency=settings.get('adaptive_concurrency', False),
+            adaptive_max_concurrency=settings.get('adaptive_max_concurrency', 16),
+            subdomain_cache_ttl_hours=settings.get('subdomain_cache_ttl_hours', 24),
+            api_page_window=settings.get('api_page_window', 4),
+            incremental_sync=settings.get('incremental_sync', True),
+            content_dedup=settings.get('content_dedup', True),
+            task_order=settings.get('task_order', 'none'),
+            head_prefetch_workers=settings.get('head_prefetch_workers', 8),
+            partial_max_age_days=settings.get('partial_max_age_days', 7),
+            **shared
+        )
+        downloader.file_naming_mode = settings.get('file_naming_mode', 0)
+        if post is not None:
+            return downloader, lambda: downloader.download_single_post(site, post, service, user)
+        query, offset = extract_ck_query(parsed_url)
+        return downloader, lambda: downloader.download_media(site, user, service, query=query,
+                                                            download_all=True, initial_offset=offset)
+
+    if site_kind == SITE_SIMPCITY:
+        # SimpCity descarga secuencialmente y no tiene pool propio; el planificador solo limita las URLs activas
+        from downloader.simpcity import SimpCity
+        downloader = SimpCity(
+            download_folder=download_folder,
+            log_callback=log,
+            enable_widgets_callback=enable_widgets,
+            update_progress_callback=progress,
+            update_global_progress_callback=global_progress,
+            tr=tr
+        )
+        return downloader, lambda: downloader.download_images_from_simpcity(url)
+
+    if site_kind == SITE_JPG5:
+        from downloader.jpg5 import Jpg5Downloader
+        downloader = Jpg5Downloader(
+            url=url,
+            carpeta_destino=download_folder,
+            progress_manager=None,
+            log_callback=log,
+            tr=tr,
+            update_progress_callback=progress,
+            update_global_progress_callback=global_progress,
+            max_workers=max_workers,
+            executor=shared.get('executor')
+        )
+        return downloader, downloader.descargar_imagenes
+
+    return None
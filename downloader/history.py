@@ -0,0 +1,106 @@
+import re
+import sqlite3
+from contextlib import closing
+
+from downloader.db_schema import has_fts
+
+# Filas por página al desplegar un nodo del historial
+PAGE_SIZE = 200
+
+# Condición de los archivos sin post (post_id NULL o vacío)
+NO_POST = "(post_id IS NULL OR post_id = '')"
+
+
+class DownloadHistory:
+    """
+    Consultas paginadas sobre la tabla downloads para la pestaña Base de datos de
+    los ajustes. Cada llamada abre su propia conexión, así que se pueden hacer
+    desde un hilo de fondo sin tocar las del descargador. Las páginas piden una
+    fila de más para saber si queda otra página: devuelven (filas, hay_más).
+    """
+
+    def __init__(self, db_path, page_size=PAGE_SIZE):
+        self.db_path = db_path
+        self.page_size = page_size
+        self.fts = None  # Si la DB tiene el índice FTS5 (se comprueba en la primera búsqueda)
+
+    def _page(self, sql, params, offset):
+        with closing(sqlite3.connect(self.db_path)) as connection:
+            rows = connection.execute(f"{sql} LIMIT ? OFFSET ?", (*params, self.page_size + 1, offset)).fetchall()
+        return rows[:self.page_size], len(rows) > self.page_size
+
+    def users(self, offset=0):
+        """(user_id, archivos, bytes, última descarga) por usuario, en orden alfabético."""
+        # En el orden del índice (user_id, post_id) la agrupación se para al completar la página
+        return self._page(
+            """SELECT user_id, COUNT(*), COALESCE(SUM(file_size), 0), MAX(downloaded_at)
+            FROM downloads GROUP BY user_id ORDER BY user_id""",
+            (), offset
+        )
+
+    def posts(self, user_id, offset=0):
+        """(post_id, título, archivos, bytes, última descarga) de los posts de un usuario."""
+        return self._page(
+            """SELECT COALESCE(post_id, ''), MAX(post_title), COUNT(*), COALESCE(SUM(file_size), 0), MAX(downloaded_at)
+            FROM downloads WHERE user_id IS ? GROUP BY COALESCE(post_id, '') ORDER BY MAX(id) DESC""",
+            (user_id,), offset
+        )
+
+    def files(self, user_id, post_id, offset=0):
+        """(id, file_path, file_size, file_type, downloaded_at) de los archivos de un post."""
+        if post_id:
+            where, params = "user_id IS ? AND post_id = ?", (user_id, post_id)
+        else:
+            where, params = f"user_id IS ? AND {NO_POST}", (user_id,)
+        return self._page(
+            f"SELECT id, file_path, file_size, file_type, downloaded_at FROM downloads WHERE {where} ORDER BY id",
+            params, offset
+        )
+
+    def search(self, text='', file_type=None, min_size=None, max_size=None, date_from=None, date_to=None, offset=0):
+        """
+        Archivos que contienen todas las palabras de text (como prefijo) en el
+        nombre, el título del post o el usuario, con filtros opcionales de tipo,
+        tamaño en bytes y fechas (YYYY-MM-DD, ambas incluidas). Devuelve filas
+        (id, file_path, file_size, file_type, downloaded_at, user_id, post_id,
+        post_title), de la más reciente a la más antigua.
+        """
+        if self.fts is None:
+            with closing(sqlite3.connect(self.db_path)) as connection:
+                self.fts = has_fts(connection)
+
+        conditions, params = [], []
+        if file_type:
+            conditions.append("d.file_type = ?")
+            params.append(file_type)
+        if min_size is not None:
+            conditions.append("d.file_size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            conditions.append("d.file_size <= ?")
+            params.append(max_size)
+        if date_from:
+            conditions.append("d.downloaded_at >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("d.downloaded_at < date(?, '+1 day')")
+            params.append(date_to)
+
+        columns = "d.id, d.file_path, d.file_size, d.file_type, d.downloaded_at, d.user_id, d.post_id, d.post_title"
+        terms = re.findall(r'\w+', text or '')
+        if terms and self.fts:
+            # Cada palabra como frase con prefijo: "foto"* también encuentra "fotos"
+            match = ' '.join(f'"{term}"*' for term in terms)
+            where = ' AND '.join(["downloads_fts MATCH ?"] + conditions)
+            # Ordenar por el rowid de la tabla FTS deja que FTS5 recorra el índice en ese orden y pare en el LIMIT
+            sql = f"""SELECT {columns} FROM downloads_fts JOIN downloads d ON d.id = downloads_fts.rowid
+                WHERE {where} ORDER BY downloads_fts.rowid DESC"""
+            return self._page(sql, [match] + params, offset)
+
+        for term in terms:
+            # Sin FTS5: subcadena con LIKE (recorre la tabla)
+            pattern = '%' + re.sub(r'([\\%_])', r'\\\1', term) + '%'
+            conditions.append("(d.file_path LIKE ? ESCAPE '\\' OR d.post_title LIKE ? ESCAPE '\\' OR d.user_id LIKE ? ESCAPE '\\')")
+            params.extend([pattern] * 3)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._page(f"SELECT {columns} FROM downloads d {where} ORDER BY d.id DESC", params, offset)
@@ -3,10 +3,10 @@ from bs4 import BeautifulSoup
 import os
 import threading
 from concurrent.futures import ThreadPoolExecutor
-from app import progress_manager
+from downloader.rate_limiter import bandwidth_limiter
 
 class Jpg5Downloader:
-    def __init__(self, url, carpeta_destino, progress_manager, log_callback=None, tr=None, update_progress_callback=None, update_global_progress_callback=None, max_workers=3):
+    def __init__(self, url, carpeta_destino, progress_manager, log_callback=None, tr=None, update_progress_callback=None, update_global_progress_callback=None, max_workers=3, executor=None):
         self.url = url
         self.carpeta_destino = carpeta_destino
         self.log_callback = log_callback
@@ -16,6 +16,7 @@ class Jpg5Downloader:
         self.update_global_progress_callback = update_global_progress_callback
         self.max_workers = max_workers
         self.progress_manager = progress_manager
+        self.executor = executor  # Executor compartido (DownloadScheduler); si no hay, se crea uno por descarga
 
     def log(self, message):
         if self.log_callback:
@@ -43,7 +44,8 @@ class Jpg5Downloader:
         total_divs = len(divs)
         self.log(self.tr(f"Total de elementos a procesar: {total_divs}"))
 
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+        executor = self.executor or ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
             futures = []
             for i, div in enumerate(divs):
                 if self.cancel_requested.is_set():
@@ -60,6 +62,9 @@ class Jpg5Downloader:
 
             for future in futures:
                 future.result()  # Esperar a que todas las descargas terminen
+        finally:
+            if executor is not self.executor:
+                executor.shutdown(wait=True)
 
     def descargar_enlace(self, enlace, i, total_divs):
         try:
@@ -97,6 +102,7 @@ class Jpg5Downloader:
                                 return
                             f.write(chunk)
                             downloaded_size += len(chunk)
+                            bandwidth_limiter.consume(len(chunk), self.cancel_requested.is_set)
                             if self.update_progress_callback:
                                 self.update_progress_callback(downloaded_size, total_size)
 
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import time
+
+
+def url_digest(url):
+    """sha1 de la URL en hexadecimal: igual en todas las sesiones, a diferencia de hash()."""
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+class PartialDownload:
+    """
+    Sidecar JSON junto a un .tmp a medio descargar (<tmp>.json, ver tmp_path_for) con la
+    URL, el tamaño esperado y los validadores (ETag / Last-Modified) del servidor.
+    Permite reanudar el .tmp con un Range en otra sesión y descartarlo solo si el
+    archivo remoto ha cambiado. En descargas segmentadas guarda además la posición
+    de cada segmento.
+    """
+
+    ORPHAN_GRACE_SECONDS = 3600  # El sidecar se guarda justo antes de crear el .tmp: margen para no pisarlo
+
+    def __init__(self, tmp_path, url, size, etag=None, last_modified=None, segments=None):
+        self.tmp_path = tmp_path
+        self.url = url
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.segments = segments  # [[posición, fin], ...] o None si la descarga es secuencial
+
+    @staticmethod
+    def sidecar_path(tmp_path):
+        return tmp_path + ".json"
+
+    @staticmethod
+    def tmp_path_for(folder, url):
+        """
+        Ruta del .tmp de una URL dentro de folder. Depende solo de la URL (no del
+        nombre final, que lleva el índice de adjunto), así otra sesión encuentra
+        el mismo .tmp aunque los archivos se planifiquen en otro orden.
+        """
+        base_name = os.path.basename(url).split('?')[0][:80]
+        return os.path.join(folder, f"{base_name}.{url_digest(url)[:12]}.tmp")
+
+    @classmethod
+    def prune(cls, folder, max_age_days):
+        """
+        Borra de folder los sidecars sin .tmp (con más de una hora) y los .tmp (con
+        su sidecar) que no se han tocado en max_age_days días. Devuelve cuántos
+        archivos se borraron.
+        """
+        if not max_age_days or max_age_days <= 0:
+            return 0
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            return 0
+        now = time.time()
+        expire_before = now - max_age_days * 86400
+        removed = 0
+        for name in names:
+            path = os.path.join(folder, name)
+            try:
+                if name.endswith(".tmp.json"):
+                    if not os.path.exists(path[:-len(".json")]) and \
+                            os.path.getmtime(path) < now - cls.ORPHAN_GRACE_SECONDS:
+                        os.remove(path)
+                        removed += 1
+                elif name.endswith(".tmp") and os.path.getmtime(path) < expire_before:
+                    os.remove(path)
+                    removed += 1
+                    if os.path.exists(cls.sidecar_path(path)):
+                        os.remove(cls.sidecar_path(path))
+                        removed += 1
+            except OSError:
+                continue  # En uso o ya borrado por otro hilo
+        return removed
+
+    @classmethod
+    def load(cls, tmp_path, url):
+        """Devuelve el estado guardado para tmp_path o None si no hay nada reanudable de esa URL."""
+        if not os.path.exists(tmp_path):
+            cls.remove_sidecar(tmp_path)
+            return None
+        try:
+            with open(cls.sidecar_path(tmp_path), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if not isinstance(data, dict) or data.get('url') != url or not data.get('size'):
+            return None
+        return cls(tmp_path, url, data['size'], data.get('etag'), data.get('last_modified'), data.get('segments'))
+
+    @classmethod
+    def from_headers(cls, tmp_path, url, size, headers, segments=None):
+        """Crea el estado a partir de las cabeceras de una respuesta 200 completa."""
+        return cls(tmp_path, url, size, headers.get('ETag'), headers.get('Last-Modified'), segments)
+
+    def save(self):
+        data = {
+            'url': self.url,
+            'size': self.size,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'segments': self.segments,
+        }
+        sidecar = self.sidecar_path(self.tmp_path)
+        with open(sidecar + ".part", 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(sidecar + ".part", sidecar)
+
+    @classmethod
+    def remove_sidecar(cls, tmp_path):
+        try:
+            os.remove(cls.sidecar_path(tmp_path))
+        except FileNotFoundError:
+            pass
+
+    def discard(self):
+        """Borra el .tmp y su sidecar."""
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.remove_sidecar(self.tmp_path)
+
+    def offset(self):
+        """Byte desde el que reanudar. Como mínimo se pide el último byte para validar el archivo."""
+        return min(os.path.getsize(self.tmp_path), self.size - 1)
+
+    def range_headers(self):
+        """Cabeceras Range + If-Range: si el archivo cambió, el servidor responde 200 con el archivo entero."""
+        headers = {'Range': f'bytes={self.offset()}-'}
+        validator = self.etag if self.etag and not self.etag.startswith('W/') else self.last_modified
+        if validator:
+            headers['If-Range'] = validator
+        return headers
+
+    def matches(self, status, headers):
+        """Comprueba que la respuesta corresponde al mismo archivo remoto que el .tmp."""
+        if status == 206:
+            content_range = headers.get('Content-Range', '')
+            total = content_range.rsplit('/', 1)[-1] if '/' in content_range else ''
+            if not total.isdigit() or int(total) != self.size:
+                return False
+        elif status == 200:
+            if self.segments is None:
+                # Se pidió un rango y llegó el archivo entero: los validadores ya no coinciden
+                return False
+            if int(headers.get('Content-Length') or 0) != self.size:
+                return False
+        else:
+            return False
+        for stored, name in ((self.etag, 'ETag'), (self.last_modified, 'Last-Modified')):
+            received = headers.get(name)
+            if stored and received and stored != received:
+                return False
+        return True
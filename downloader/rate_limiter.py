@@ -0,0 +1,249 @@
+import datetime
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class TokenBucket:
+    """
+    Token bucket con reserva: reserve() descuenta los tokens bajo un lock breve y
+    devuelve cuánto hay que esperar; la espera ocurre fuera del lock. Los tokens
+    pueden quedar en negativo, así que las peticiones se sirven en orden de reserva
+    sin que ningún hilo duerma bloqueando a los demás.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate  # Tokens por segundo (0 o None = sin límite)
+        self.burst = max(burst, 1)  # Capacidad máxima del bucket
+        self.tokens = self.burst
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """Reserva `tokens` y devuelve los segundos que hay que esperar antes de usarlos."""
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens=1, cancel_event=None):
+        """Reserva y espera. Si se pasa cancel_event, la espera termina al cancelar."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            if cancel_event is not None:
+                cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+        return delay
+
+
+class HostRateLimiter:
+    """Un TokenBucket independiente por host, creado bajo demanda."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def configure(self, rate, burst):
+        with self.lock:
+            self.rate = rate
+            self.burst = burst
+            self.buckets.clear()
+
+    def bucket(self, host):
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def reserve(self, host, tokens=1):
+        return self.bucket(host).reserve(tokens)
+
+    def acquire(self, host, tokens=1, cancel_event=None):
+        return self.bucket(host).acquire(tokens, cancel_event=cancel_event)
+
+
+def parse_clock(value):
+    """'HH:MM' -> minutos desde medianoche."""
+    hours, minutes = str(value).split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60):
+        raise ValueError(value)
+    return hours * 60 + minutes
+
+
+class BandwidthLimiter:
+    """
+    Límite de bytes por segundo compartido por todos los descargadores del
+    proceso. Es un TokenBucket en bytes: cada bucle de descarga reserva el tamaño
+    del fragmento recibido y espera lo que le toque, así el ancho de banda se
+    reparte en orden de reserva entre todas las transferencias activas.
+
+    El límite puede depender de la hora con la sección 'bandwidth_limit' de
+    settings.json: limit_mb_per_second fuera del horario y una lista 'schedule'
+    de franjas {start, end, limit_mb_per_second}. 0 es sin límite.
+    """
+
+    RECHECK_SECONDS = 5.0  # Cada cuánto se vuelve a mirar el horario
+
+    def __init__(self):
+        self.default_rate = 0
+        self.schedule = []  # [(inicio, fin, bytes/s)] con las horas en minutos desde medianoche
+        self.rate = 0
+        self.bucket = TokenBucket(0, 1)
+        self.next_check = 0.0
+        self.lock = threading.Lock()
+
+    def configure(self, config=None):
+        config = config or {}
+        schedule = []
+        for entry in config.get('schedule') or []:
+            try:
+                schedule.append((parse_clock(entry['start']), parse_clock(entry['end']),
+                                 self.to_bytes(entry.get('limit_mb_per_second'))))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue  # Franja mal escrita: se ignora
+        with self.lock:
+            self.default_rate = self.to_bytes(config.get('limit_mb_per_second'))
+            self.schedule = schedule
+            self.next_check = 0.0
+
+    @staticmethod
+    def to_bytes(megabytes):
+        try:
+            return max(0, int(float(megabytes or 0) * 1024 * 1024))
+        except (TypeError, ValueError):
+            return 0
+
+    def rate_at(self, moment):
+        """Bytes por segundo permitidos a esa hora."""
+        minute = moment.hour * 60 + moment.minute
+        for start, end, rate in self.schedule:
+            if start <= end:
+                inside = start <= minute < end
+            else:  # La franja cruza la medianoche (p. ej. 22:00-06:00)
+                inside = minute >= start or minute < end
+            if inside:
+                return rate
+        return self.default_rate
+
+    def current_bucket(self):
+        if time.monotonic() < self.next_check:
+            return self.bucket
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.next_check:
+                self.next_check = now + self.RECHECK_SECONDS
+                rate = self.rate_at(datetime.datetime.now())
+                if rate != self.rate:
+                    self.rate = rate
+                    # Un cuarto de segundo de ráfaga (mínimo 64 KB) para que el reparto sea suave
+                    self.bucket = TokenBucket(rate, max(rate // 4, 65536)) if rate else TokenBucket(0, 1)
+            return self.bucket
+
+    def reserve(self, nbytes):
+        """Reserva nbytes y devuelve los segundos que hay que esperar (para el motor asyncio)."""
+        return self.current_bucket().reserve(nbytes)
+
+    def consume(self, nbytes, cancelled=None):
+        """Reserva nbytes y espera su turno. cancelled() corta la espera si se cancela la descarga."""
+        delay = self.reserve(nbytes)
+        if delay <= 0:
+            return
+        deadline = time.monotonic() + delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (cancelled is not None and cancelled()):
+                return
+            time.sleep(min(remaining, 0.25))
+
+
+# Límite de ancho de banda único para todo el proceso (interfaz y coomerdl)
+bandwidth_limiter = BandwidthLimiter()
+
+
+# Clases de endpoint con políticas de throttling independientes
+ENDPOINT_API = 'api'  # Paginación JSON de /api/v1
+ENDPOINT_MEDIA = 'media'  # Transferencias de archivos desde los CDN (n1..n10, /data/)
+ENDPOINT_HTML = 'html'  # Páginas HTML que se scrapean
+
+DEFAULT_THROTTLE_POLICIES = {
+    ENDPOINT_API: {'rate_per_second': 1.0, 'burst': 2, 'max_concurrent': 2},
+    ENDPOINT_MEDIA: {'rate_per_second': 0, 'burst': 8, 'max_concurrent': 8},
+    ENDPOINT_HTML: {'rate_per_second': 0.5, 'burst': 2, 'max_concurrent': 2},
+}
+
+MEDIA_HOST_PATTERN = re.compile(r'^(n\d+|c\d+|i\d*|i-[\w-]+|cdn[\w-]*|media[\w-]*)\.', re.IGNORECASE)
+
+
+def classify_endpoint(url):
+    """Devuelve la clase de endpoint (api, media o html) de una URL."""
+    parsed = urlparse(url)
+    if parsed.path.startswith('/api/'):
+        return ENDPOINT_API
+    if parsed.path.startswith('/data/') or MEDIA_HOST_PATTERN.match(parsed.netloc):
+        return ENDPOINT_MEDIA
+    extension = os.path.splitext(parsed.path)[1].lower()
+    if extension and extension not in ('.html', '.htm', '.php'):
+        return ENDPOINT_MEDIA
+    return ENDPOINT_HTML
+
+
+class ThrottlePolicies:
+    """
+    Un HostRateLimiter y un límite de peticiones simultáneas por host para cada
+    clase de endpoint, de modo que las transferencias del CDN no paguen el
+    espaciado que solo necesita la API.
+    """
+
+    def __init__(self, policies=None, default_rate=0, default_burst=2):
+        self.policies = {}
+        self.limiters = {}
+        self.slots = {}
+        self.lock = threading.Lock()
+        self.configure(policies, default_rate, default_burst)
+
+    def configure(self, policies=None, default_rate=0, default_burst=2):
+        """Aplica las políticas; las claves que falten se toman de DEFAULT_THROTTLE_POLICIES."""
+        policies = policies or {}
+        with self.lock:
+            for endpoint_class, defaults in DEFAULT_THROTTLE_POLICIES.items():
+                policy = dict(defaults)
+                if endpoint_class not in policies and endpoint_class != ENDPOINT_MEDIA:
+                    # Sin configuración propia se usan rate_limit_per_second / rate_limit_burst
+                    policy.update(rate_per_second=default_rate, burst=default_burst)
+                policy.update(policies.get(endpoint_class, {}))
+                self.policies[endpoint_class] = policy
+                self.limiters[endpoint_class] = HostRateLimiter(policy['rate_per_second'], policy['burst'])
+            self.slots.clear()
+
+    def policy(self, endpoint_class):
+        return self.policies.get(endpoint_class, self.policies[ENDPOINT_HTML])
+
+    def reserve(self, endpoint_class, host, tokens=1):
+        return self.limiters.get(endpoint_class, self.limiters[ENDPOINT_HTML]).reserve(host, tokens)
+
+    def acquire(self, endpoint_class, host, cancel_event=None):
+        """Espera (fuera de cualquier lock) hasta que el host tenga un token libre para esa clase."""
+        limiter = self.limiters.get(endpoint_class, self.limiters[ENDPOINT_HTML])
+        return limiter.acquire(host, cancel_event=cancel_event)
+
+    def slot(self, endpoint_class, host):
+        """Semáforo que limita las peticiones simultáneas al host para esa clase."""
+        key = (endpoint_class, host)
+        with self.lock:
+            semaphore = self.slots.get(key)
+            if semaphore is None:
+                semaphore = self.slots[key] = threading.Semaphore(self.policy(endpoint_class)['max_concurrent'])
+            return semaphore
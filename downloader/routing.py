@@ -0,0 +1,64 @@
+import re
+from typing import Optional
+from urllib.parse import ParseResult, parse_qs, urlparse
+
+# Sitios soportados; el orden de detect_site es el mismo que sigue start_download
+SITE_EROME = 'erome'
+SITE_BUNKR = 'bunkr'
+SITE_COOMER = 'coomer'  # coomer.su y kemono.su comparten API y Downloader
+SITE_SIMPCITY = 'simpcity'
+SITE_JPG5 = 'jpg5'
+
+BUNKR_URL_PATTERN = re.compile(r"https?://([a-z0-9-]+\.)?bunkr\.[a-z]{2,}")
+COOMER_HOSTS = ("coomer.su", "kemono.su")
+
+
+def detect_site(url: str) -> Optional[str]:
+    """
+    Devuelve qué descargador corresponde a la URL, o None si no se reconoce
+    """
+    if "erome.com" in url:
+        return SITE_EROME
+    if BUNKR_URL_PATTERN.search(url):
+        return SITE_BUNKR
+    if urlparse(url).netloc in COOMER_HOSTS:
+        return SITE_COOMER
+    if "simpcity.su" in url:
+        return SITE_SIMPCITY
+    if "jpg5.su" in url:
+        return SITE_JPG5
+    return None
+
+
+def is_erome_album(url: str) -> bool:
+    return "/a/" in url
+
+
+def is_bunkr_post(url: str) -> bool:
+    # Si la URL contiene "/v/", "/i/" o "/f/", es un post individual.
+    return any(sub in url for sub in ["/v/", "/i/", "/f/"])
+
+
+def extract_ck_parameters(url: ParseResult) -> tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Get the service, user and post id from the url if they exist
+    """
+    match = re.search(r"/(?P<service>[^/?]+)(/user/(?P<user>[^/?]+)(/post/(?P<post>[^/?]+))?)?", url.path)
+    if match:
+        [site, service, post] = match.group("service", "user", "post")
+        return site, service, post
+    else:
+        return None, None, None
+
+
+def extract_ck_query(url: ParseResult) -> tuple[Optional[str], int]:
+    """
+    Try to obtain the query and offset from the url if they exist
+    """
+
+    # This is kinda contrived but query parameters are awful to get right
+    query = parse_qs(url.query)
+    q = query.get("q")[0] if query.get("q") is not None and len(query.get("q")) > 0 else None
+    o = query.get("o")[0] if query.get("o") is not None and len(query.get("o")) > 0 else "0"
+
+    return q, int(o) if str.isdigit(o) else 0
@@ -0,0 +1,350 @@
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from downloader.concurrency import host_concurrency
+from downloader.rate_limiter import ThrottlePolicies
+from downloader.routing import SITE_BUNKR, SITE_COOMER, SITE_EROME, SITE_JPG5, SITE_SIMPCITY
+
+DEFAULT_SITE_LIMITS = {
+    SITE_COOMER: 6,
+    SITE_BUNKR: 4,
+    SITE_EROME: 4,
+    SITE_JPG5: 3,
+    SITE_SIMPCITY: 1,
+}
+
+
+def cancel_downloader(downloader):
+    """Pide la cancelación a cualquier descargador, tenga o no request_cancel."""
+    if hasattr(downloader, 'request_cancel'):
+        downloader.request_cancel()
+    else:
+        downloader.cancel_requested = True
+
+
+# Carril reservado para el trabajo auxiliar corto de una descarga en curso (sondeos
+# de subdominios): no hace cola detrás de las tareas del pool de descargas, que
+# pueden estar esperando justo a ese trabajo. Las peticiones que lanza siguen
+# pasando por los token buckets y los límites por host de ThrottlePolicies.
+AUXILIARY_WORKERS = 8
+auxiliary_executor = ThreadPoolExecutor(max_workers=AUXILIARY_WORKERS, thread_name_prefix='auxiliary')
+
+
+def run_with_helpers(executor, fn, items, max_parallel=None):
+    """
+    Aplica fn a cada elemento y genera (elemento, resultado) según terminan. El
+    hilo que llama también ejecuta elementos y, como mucho, max_parallel - 1
+    ayudantes se piden a executor. Con el executor de las descargas, el trabajo
+    auxiliar (HEAD) cuenta contra el presupuesto y el sublímite del sitio; con
+    auxiliary_executor no espera detrás de la cola de tareas. Un ayudante que
+    arranca tarde no encuentra nada y termina, de modo que una tarea del pool que
+    espera aquí nunca se bloquea por falta de huecos. Si se deja de iterar, los
+    elementos que no habían empezado se descartan.
+    """
+    pending = deque(items)
+    remaining = len(pending)
+    results = queue.SimpleQueue()
+
+    def run_next():
+        try:
+            item = pending.popleft()
+        except IndexError:
+            return False
+        try:
+            results.put((item, fn(item), None))
+        except BaseException as e:
+            results.put((item, None, e))
+        return True
+
+    def helper():
+        while run_next():
+            pass
+
+    helpers = []
+    for _ in range(min(max_parallel or remaining, remaining) - 1):
+        try:
+            helpers.append(executor.submit(helper))
+        except RuntimeError:  # Executor cerrado: el hilo que llama lo hace todo
+            break
+    try:
+        while remaining:
+            try:
+                item, result, error = results.get_nowait()
+            except queue.Empty:
+                # Nada terminado: se ejecuta otro elemento aquí o, si no quedan, se espera a los que siguen en curso
+                if run_next():
+                    continue
+                item, result, error = results.get()
+            remaining -= 1
+            if error is not None:
+                raise error
+            yield item, result
+    finally:
+        pending.clear()
+        for future in helpers:
+            future.cancel()
+
+
+class FairShareDispatcher:
+    """
+    Reparte los huecos de un sitio entre los trabajos (URLs) que tienen tareas en
+    cola. En lugar de servir las tareas por orden de llegada, se sirven por turnos:
+    cada trabajo lanza tantas tareas seguidas como su peso y cede el turno al
+    siguiente. Así un creador con miles de archivos no deja esperando al resto.
+    """
+
+    def __init__(self, executor, slots):
+        self.executor = executor
+        self.free_slots = slots
+        self.queues = OrderedDict()  # {trabajo: deque[(Future, fn, args, kwargs)]}, en orden de turno
+        self.weights = {}
+        self.credits = {}  # Tareas que le quedan al trabajo en su turno actual
+        self.closing = set()  # Trabajos cerrados que aún tienen tareas en cola
+        self.lock = threading.Lock()
+
+    def register(self, job, weight=1):
+        with self.lock:
+            if job not in self.queues:
+                self.queues[job] = deque()
+            self.weights[job] = max(1, int(weight))
+            self.credits[job] = self.weights[job]
+
+    def unregister(self, job, cancel_pending=False):
+        """Quita el trabajo del turno; sus tareas en cola se cancelan o se siguen lanzando."""
+        with self.lock:
+            queue = self.queues.get(job)
+            if queue is None:
+                return
+            if cancel_pending:
+                pending = list(queue)
+                queue.clear()
+            else:
+                pending = []
+            if queue:
+                self.closing.add(job)
+            else:
+                self._remove(job)
+        for future, _, _, _ in pending:
+            future.cancel()
+
+    def _remove(self, job):
+        del self.queues[job]
+        self.weights.pop(job, None)
+        self.credits.pop(job, None)
+        self.closing.discard(job)
+
+    def submit(self, job, fn, args, kwargs):
+        future = Future()
+        with self.lock:
+            self.queues[job].append((future, fn, args, kwargs))
+        self._dispatch()
+        return future
+
+    def _next_item(self):
+        # Se llama con el lock tomado. El trabajo en cabeza tiene el turno.
+        for _ in range(len(self.queues)):
+            job, queue = next(iter(self.queues.items()))
+            if queue:
+                item = queue.popleft()
+                self.credits[job] -= 1
+                if self.credits[job] <= 0 or not queue:
+                    self.credits[job] = self.weights[job]
+                    self.queues.move_to_end(job)
+                return item
+            if job in self.closing:
+                self._remove(job)
+            else:
+                self.queues.move_to_end(job)
+        return None
+
+    def _dispatch(self):
+        while True:
+            with self.lock:
+                if self.free_slots <= 0:
+                    return
+                item = self._next_item()
+                if item is None:
+                    return
+                self.free_slots -= 1
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                self._release()
+                continue
+            try:
+                self.executor.submit(self._run, future, fn, args, kwargs)
+            except RuntimeError as e:  # El pool compartido ya se cerró
+                future.set_exception(e)
+                self._release()
+
+    def _run(self, future, fn, args, kwargs):
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            self._release()
+            self._dispatch()
+
+    def _release(self):
+        with self.lock:
+            self.free_slots += 1
+
+
+class SiteExecutor:
+    """
+    Vista de un trabajo (una URL) sobre el pool compartido con la interfaz que
+    usan los descargadores (submit / shutdown). Las tareas pasan por el
+    FairShareDispatcher del sitio, de modo que cada sitio nunca ocupa más de su
+    sublímite y los trabajos del mismo sitio se turnan; shutdown() solo afecta a
+    las tareas de esta vista.
+    """
+
+    def __init__(self, dispatcher, job, weight=1):
+        self.dispatcher = dispatcher
+        self.job = job
+        self.futures = set()
+        self.lock = threading.Lock()
+        self.closed = False
+        dispatcher.register(job, weight)
+
+    def submit(self, fn, *args, **kwargs):
+        if self.closed:
+            raise RuntimeError('cannot schedule new futures after shutdown')
+        future = self.dispatcher.submit(self.job, fn, args, kwargs)
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self._task_done)
+        return future
+
+    def _task_done(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.closed = True
+        self.dispatcher.unregister(self.job, cancel_pending=cancel_futures)
+        with self.lock:
+            futures = list(self.futures)
+        if wait:
+            for future in futures:
+                if not future.cancelled():
+                    future.exception()  # Espera sin propagar el error; el descargador ya lo registra
+
+
+class DownloadScheduler:
+    """
+    Planificador global para varias URLs de cualquier sitio. Un único
+    ThreadPoolExecutor es el presupuesto de hilos de descarga; cada sitio tiene
+    un sublímite de transferencias simultáneas, que se reparte por turnos entre
+    las URLs activas, y como mucho max_active_urls URLs (creadores, álbumes,
+    hilos) se procesan a la vez. Los descargadores que lo
+    usan comparten también los token buckets por host y el controlador AIMD, así
+    que varias URLs del mismo sitio no multiplican la carga sobre un host.
+    """
+
+    def __init__(self, max_workers=8, max_active_urls=3, site_limits=None,
+                 throttle_policies=None, rate_limit_per_second=None, rate_limit_burst=2,
+                 rate_limit_interval=2.0, adaptive_concurrency=False, adaptive_max_concurrency=16):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download')
+        self.url_pool = ThreadPoolExecutor(max_workers=max(1, max_active_urls), thread_name_prefix='url')
+        self.site_limits = {**DEFAULT_SITE_LIMITS, **(site_limits or {})}
+        self.dispatchers = {}  # {sitio: FairShareDispatcher}
+        self.job_weights = {}  # {url: peso en el reparto por turnos}
+        if rate_limit_per_second is None:
+            rate_limit_per_second = 1.0 / rate_limit_interval if rate_limit_interval > 0 else 0
+        self.throttle = ThrottlePolicies(throttle_policies, rate_limit_per_second, rate_limit_burst)
+        self.concurrency = host_concurrency if adaptive_concurrency else None
+        if self.concurrency is not None:
+            self.concurrency.configure(maximum=adaptive_max_concurrency)
+        self.cancel_requested = threading.Event()
+        self.downloaders = set()
+        self.file_counts = {}  # Progreso global: {clave de URL: (completados, total)}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings, **overrides):
+        """Crea el planificador con la sección 'scheduler' y los límites de settings.json."""
+        scheduler_settings = settings.get('scheduler', {})
+        options = {
+            'max_workers': scheduler_settings.get('max_workers', 8),
+            'max_active_urls': scheduler_settings.get('max_active_urls', 3),
+            'site_limits': scheduler_settings.get('site_limits'),
+            'throttle_policies': settings.get('throttle_policies'),
+            'rate_limit_per_second': settings.get('rate_limit_per_second'),
+            'rate_limit_burst': settings.get('rate_limit_burst', 2),
+            'adaptive_concurrency': settings.get('adaptive_concurrency', False),
+            'adaptive_max_concurrency': settings.get('adaptive_max_concurrency', 16),
+        }
+        options.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**options)
+
+    def site_limit(self, site_kind):
+        """Transferencias simultáneas permitidas a un sitio (nunca más que el presupuesto global)."""
+        return max(1, min(self.site_limits.get(site_kind, self.max_workers), self.max_workers))
+
+    def site_executor(self, site_kind, job):
+        """Executor para las tareas de un trabajo (URL) dentro del sublímite de su sitio."""
+        with self.lock:
+            dispatcher = self.dispatchers.get(site_kind)
+            if dispatcher is None:
+                dispatcher = FairShareDispatcher(self.executor, self.site_limit(site_kind))
+                self.dispatchers[site_kind] = dispatcher
+            weight = self.job_weights.get(job, 1)
+        return SiteExecutor(dispatcher, job, weight)
+
+    def global_progress_callback(self, key, callback):
+        """Envuelve el callback de progreso global para que sume los archivos de todas las URLs."""
+        if callback is None:
+            return None
+
+        def update(completed_files, total_files):
+            with self.lock:
+                self.file_counts[key] = (completed_files, total_files)
+                completed = sum(counts[0] for counts in self.file_counts.values())
+                total = sum(counts[1] for counts in self.file_counts.values())
+            callback(completed, total)
+        return update
+
+    def submit(self, url, build, weight=1):
+        """
+        Encola una URL. build() se llama ya en el hilo de la URL y devuelve
+        (descargador, llamada) o None; el Future resultante devuelve el descargador.
+        weight es cuántas tareas seguidas lanza la URL en cada turno del reparto.
+        """
+        with self.lock:
+            self.job_weights[url] = weight
+        return self.url_pool.submit(self._run_url, url, build)
+
+    def _run_url(self, url, build):
+        if self.cancel_requested.is_set():
+            return None
+        built = build()
+        if built is None:
+            return None
+        downloader, download = built
+        with self.lock:
+            self.downloaders.add(downloader)
+        try:
+            if self.cancel_requested.is_set():
+                cancel_downloader(downloader)
+            download()
+        finally:
+            with self.lock:
+                self.downloaders.discard(downloader)
+        return downloader
+
+    def request_cancel(self):
+        self.cancel_requested.set()
+        with self.lock:
+            downloaders = list(self.downloaders)
+        for downloader in downloaders:
+            cancel_downloader(downloader)
+
+    def shutdown(self, wait=True):
+        self.url_pool.shutdown(wait=wait, cancel_futures=self.cancel_requested.is_set())
+        self.executor.shutdown(wait=wait)
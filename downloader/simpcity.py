@@ -12,6 +12,7 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from concurrent.futures import ThreadPoolExecutor
+from downloader.rate_limiter import bandwidth_limiter
 
 class SimpCity:
     def __init__(self, download_folder, max_workers=5, log_callback=None, enable_widgets_callback=None, update_progress_callback=None, update_global_progress_callback=None, tr=None):
@@ -97,6 +98,7 @@ class SimpCity:
             with open(path, 'wb') as file:
                 for chunk in response.iter_content(1024):
                     file.write(chunk)
+                    bandwidth_limiter.consume(len(chunk), lambda: self.cancel_requested)
             self.log(self.tr(f"Archivo descargado: {path}"))
         else:
             self.log(self.tr(f"Error al descargar {file_url}: {response.status_code}"))
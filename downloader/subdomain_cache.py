@@ -0,0 +1,72 @@
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class SubdomainCache:
+    """
+    Caché en disco de qué subdominio (n1..n10) sirve cada prefijo de hash de un
+    host, p. ej. coomer.su/ab -> n3.coomer.su. Las entradas caducan tras `ttl`
+    segundos y se comparten entre archivos y entre sesiones.
+    """
+
+    def __init__(self, path=os.path.join("resources", "config", "subdomains.json"), ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def key(url):
+        """Host base + primer segmento del hash: /data/ab/cd/<sha256>.ext -> 'coomer.su/ab'."""
+        parsed = urlparse(url)
+        host = parsed.netloc.split('.', 1)[1] if parsed.netloc.count('.') > 1 else parsed.netloc
+        parts = [p for p in parsed.path.split('/') if p and p != 'data']
+        prefix = parts[0] if len(parts) > 1 else ''
+        return f"{host}/{prefix}"
+
+    def get(self, url):
+        """Devuelve el subdominio guardado para la URL o None si no hay entrada vigente."""
+        key = self.key(url)
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+            if time.time() - entry.get('checked_at', 0) > self.ttl:
+                del self.entries[key]
+                return None
+            return entry.get('host')
+
+    def set(self, url, host):
+        with self.lock:
+            self.entries[self.key(url)] = {'host': host, 'checked_at': time.time()}
+            self._save()
+
+    def invalidate(self, url):
+        with self.lock:
+            if self.entries.pop(self.key(url), None) is not None:
+                self._save()
+
+    @staticmethod
+    def apply(url, host):
+        """Reescribe la URL para que apunte al subdominio dado bajo /data/."""
+        parsed = urlparse(url)
+        path = parsed.path if parsed.path.startswith("/data/") else f"/data{parsed.path}"
+        return parsed._replace(netloc=host, path=path).geturl()
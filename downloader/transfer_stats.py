@@ -0,0 +1,102 @@
+import math
+import threading
+import time
+
+
+class TransferAccountant:
+    """
+    Contabilidad de bytes de toda la sesión de descarga, sumando todos los hilos
+    y descargadores. Los tamaños esperados llegan del HEAD al planificar
+    (expect) o del Content-Length del primer progreso de cada archivo; los bytes
+    recibidos, de los callbacks de progreso (update). La velocidad es una media
+    móvil exponencial (EWMA) del total, así que el ETA es el de toda la sesión y
+    no el del último archivo que informó.
+    """
+
+    SAMPLE_SECONDS = 0.5  # Intervalo mínimo entre muestras de velocidad
+    SMOOTHING_SECONDS = 5.0  # Constante de tiempo de la EWMA
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Empieza una sesión nueva (cada vez que se pulsa Descargar o se lanza coomerdl)."""
+        with self.lock:
+            self.expected = {}  # { file_id: tamaño } de los archivos aún sin terminar
+            self.received = {}  # { file_id: bytes del archivo ya en disco }
+            self.finished_bytes = 0  # Tamaño de los archivos terminados
+            self.transferred = 0  # Bytes recibidos en esta sesión (sin lo reanudado de otra)
+            self.sample_bytes = 0
+            self.sample_time = time.monotonic()
+            self.speed = 0.0
+
+    def expect(self, file_id, size):
+        """Registra el tamaño de un archivo planificado antes de que empiece a descargarse."""
+        if not size:
+            return
+        with self.lock:
+            if file_id not in self.received:
+                self.expected[file_id] = size
+
+    def begin(self, file_id, offset):
+        """Un archivo que se reanuda: los offset bytes que ya había en disco no cuentan para la velocidad."""
+        with self.lock:
+            self.received[file_id] = offset
+
+    def discard(self, file_id):
+        """Olvida un archivo que no se va a descargar (omitido o fallido)."""
+        with self.lock:
+            self.expected.pop(file_id, None)
+            self.received.pop(file_id, None)
+
+    def update(self, file_id, downloaded, total):
+        """
+        Actualiza con un callback de progreso. Devuelve True si se ha calculado una
+        muestra nueva de velocidad (momento de refrescar el pie de la ventana).
+        """
+        if file_id is None:
+            return False
+        with self.lock:
+            if total:
+                self.expected[file_id] = total
+            previous = self.received.get(file_id, 0)
+            if downloaded > previous:
+                self.transferred += downloaded - previous
+            if total and downloaded >= total:
+                self.received.pop(file_id, None)
+                self.expected.pop(file_id, None)
+                self.finished_bytes += total
+            else:
+                # Los segmentos de un mismo archivo pueden informar desordenados
+                self.received[file_id] = max(previous, downloaded)
+            return self._sample()
+
+    def _sample(self):
+        # Se llama con el lock tomado
+        now = time.monotonic()
+        elapsed = now - self.sample_time
+        if elapsed < self.SAMPLE_SECONDS:
+            return False
+        instant = (self.transferred - self.sample_bytes) / elapsed
+        weight = 1 - math.exp(-elapsed / self.SMOOTHING_SECONDS)
+        self.speed = instant if self.speed == 0 else self.speed + weight * (instant - self.speed)
+        self.sample_bytes = self.transferred
+        self.sample_time = now
+        return True
+
+    def snapshot(self):
+        """(bytes hechos, bytes conocidos en total, velocidad en B/s, ETA en segundos o None)."""
+        with self.lock:
+            self._sample()  # Si ningún archivo avanza, la velocidad también baja
+            in_progress = sum(self.received.values())
+            done = self.finished_bytes + in_progress
+            total = self.finished_bytes + sum(self.expected.values())
+            total = max(total, done)
+            speed = self.speed
+        eta = (total - done) / speed if speed > 0 else None
+        return done, total, speed, eta
+
+
+# Contabilidad única para todo el proceso (interfaz y coomerdl)
+session_stats = TransferAccountant()
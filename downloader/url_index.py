@@ -0,0 +1,150 @@
+import heapq
+import os
+import sqlite3
+import threading
+from array import array
+from bisect import bisect_left
+
+# Claves de la sesión que se acumulan antes de fundirlas en los arrays ordenados
+MERGE_THRESHOLD = 4096
+
+
+def url_key(media_url):
+    """
+    Clave de 64 bits de una URL. hash() de str (SipHash) cambia entre procesos,
+    pero el índice vive solo en memoria y se reconstruye en cada proceso.
+    """
+    return hash(media_url)
+
+
+def content_key(content_hash):
+    """Clave de 64 bits de un sha256 en hexadecimal (sus primeros 16 dígitos, con signo)."""
+    return int(content_hash[:16], 16) - (1 << 63)
+
+
+def sorted_keys(keys):
+    return array('q', sorted(keys))
+
+
+def file_identity(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def merge_keys(keys, new_keys):
+    """Array ordenado con las claves de keys (ya ordenado) y las de new_keys."""
+    return array('q', heapq.merge(keys, sorted(new_keys)))
+
+
+def contains_key(keys, key):
+    # bisect trabaja directamente sobre el array, sin pasar los enteros a una lista
+    position = bisect_left(keys, key)
+    return position < len(keys) and keys[position] == key
+
+
+class UrlIndex:
+    """
+    Índice compacto de lo que ya está en la tabla downloads, para la comprobación
+    de "ya descargado" de cada tarea. En lugar de un dict con todas las filas
+    ({media_url: (file_path, file_size)}), guarda solo claves de 64 bits de las
+    URLs y de los sha256 de contenido en dos arrays ordenados (8 bytes por fila),
+    que se consultan con búsqueda binaria. Un acierto es probable, no seguro: la
+    ruta y el tamaño se piden a la base de datos (consulta por índice) solo
+    entonces. Las claves registradas durante la sesión van a un set pequeño que
+    se funde en los arrays cada MERGE_THRESHOLD altas, así que la memoria sigue
+    siendo de 8 bytes por fila por larga que sea la sesión.
+
+    Hay un índice por archivo de base de datos para todo el proceso (for_path),
+    compartido por todos los Downloader; se carga la primera vez que se pide.
+    """
+
+    indexes = {}
+    indexes_lock = threading.Lock()
+
+    def __init__(self, url_keys=None, content_keys=None, identity=None):
+        self.identity = identity  # Archivo del que se cargó, para notar si se reemplaza la DB
+        self.url_keys = url_keys if url_keys is not None else array('q')
+        self.content_keys = content_keys if content_keys is not None else array('q')
+        self.recent_urls = set()  # Claves de URL registradas desde la última fusión
+        self.recent_contents = set()  # Claves de sha256 registradas desde la última fusión
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, db_path):
+        """Devuelve el índice del proceso para db_path, cargándolo si hace falta."""
+        with cls.indexes_lock:
+            index = cls.indexes.get(db_path)
+            if index is None or index.identity != file_identity(db_path):
+                index = cls.indexes[db_path] = cls.load(db_path)
+            return index
+
+    @classmethod
+    def invalidate(cls, db_path):
+        """
+        Recarga el índice del proceso tras borrar filas. Se recarga en el mismo
+        objeto porque los Downloader vivos lo comparten: si solo se descartara,
+        seguirían viendo las filas borradas (y finish_job confía en contains()).
+        Antes hay que confirmar lo que el hilo escritor tenga en cola.
+        """
+        with cls.indexes_lock:
+            index = cls.indexes.get(db_path)
+            if index is not None:
+                index.reload(db_path)
+
+    def reload(self, db_path):
+        """Sustituye las claves por las que hay ahora en la DB y olvida las de la sesión."""
+        fresh = self.load(db_path)
+        with self.lock:
+            self.identity = fresh.identity
+            self.url_keys = fresh.url_keys
+            self.content_keys = fresh.content_keys
+            self.recent_urls = set()
+            self.recent_contents = set()
+
+    @classmethod
+    def load(cls, db_path):
+        """Recorre la tabla downloads sin materializar las filas y construye los arrays de claves."""
+        identity = file_identity(db_path)
+        connection = sqlite3.connect(db_path)
+        try:
+            urls = array('q')
+            contents = array('q')
+            for media_url, content_hash in connection.execute("SELECT media_url, content_hash FROM downloads"):
+                if media_url:
+                    urls.append(url_key(media_url))
+                if content_hash:
+                    contents.append(content_key(content_hash))
+        finally:
+            connection.close()
+        return cls(sorted_keys(urls), sorted_keys(contents), identity)
+
+    def __len__(self):
+        return len(self.url_keys) + len(self.recent_urls)
+
+    def add(self, media_url, content_hash):
+        with self.lock:
+            self.recent_urls.add(url_key(media_url))
+            if content_hash:
+                self.recent_contents.add(content_key(content_hash))
+            if len(self.recent_urls) >= MERGE_THRESHOLD:
+                self.merge()
+
+    def merge(self):
+        # Primero el array nuevo y después el set vacío: una consulta sin lock ve la clave en uno de los dos
+        self.url_keys = merge_keys(self.url_keys, self.recent_urls)
+        self.recent_urls = set()
+        self.content_keys = merge_keys(self.content_keys, self.recent_contents)
+        self.recent_contents = set()
+
+    def contains(self, media_url):
+        """True si la URL probablemente ya está descargada."""
+        key = url_key(media_url)
+        return key in self.recent_urls or contains_key(self.url_keys, key)
+
+    def contains_content(self, content_hash):
+        """True si probablemente ya hay un archivo descargado con ese sha256."""
+        key = content_key(content_hash)
+        return key in self.recent_contents or contains_key(self.content_keys, key)